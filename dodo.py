@@ -11,7 +11,10 @@ import sys
 
 sys.path.insert(1, "./src/")
 
+import importlib
 import shutil
+from datetime import datetime
+from functools import wraps
 from os import environ, getcwd, path
 from pathlib import Path
 
@@ -24,9 +27,15 @@ from colorama import Fore, Style, init
 # presses on the keyboard before continuing. However, I want to be able
 # to easily see the task lines printed by PyDoit. I want them to stand out
 # from among all the other lines printed to the console.
+from doit.dependency import MD5Checker
 from doit.reporter import ConsoleReporter
 
-from settings import config
+import perf_ledger
+from aggregate_ravenpack import partials_year_path
+from link_ravenpack_crsp import merged_year_path, with_permno_year_path
+from parquet_fingerprint import parquet_fingerprint
+from pull_ravenpack import END_DATE, START_DATE, year_file_path, year_range
+from settings import config, create_directories
 
 try:
     in_slurm = environ["SLURM_JOB_ID"] is not None
@@ -48,6 +57,31 @@ class GreenReporter(ConsoleReporter):
         self.outstream.write(output)
 
 
+## Up-to-date check for large Parquet dependencies
+# doit's default checker md5-hashes every file_dep whose mtime changed, which
+# means reading multi-GB Parquet files in full just to decide what to run.
+# For .parquet files this checker compares (mtime, size) first and otherwise
+# the footer fingerprint (schema, row groups, column statistics) from
+# src/parquet_fingerprint.py. A rewrite with identical content keeps the
+# task up to date. Other files keep the default md5 behaviour.
+class ParquetChecker(MD5Checker):
+    def check_modified(self, file_path, file_stat, state):
+        if not str(file_path).endswith(".parquet"):
+            return super().check_modified(file_path, file_stat, state)
+        timestamp, size, fingerprint = state
+        if file_stat.st_mtime == timestamp and file_stat.st_size == size:
+            return False
+        return fingerprint != parquet_fingerprint(file_path)
+
+    def get_state(self, dep, current_state):
+        if not str(dep).endswith(".parquet"):
+            return super().get_state(dep, current_state)
+        stat = Path(dep).stat()
+        if current_state and list(current_state[:2]) == [stat.st_mtime, stat.st_size]:
+            return None
+        return stat.st_mtime, stat.st_size, parquet_fingerprint(dep)
+
+
 if not in_slurm:
     DOIT_CONFIG = {
         "reporter": GreenReporter,
@@ -55,9 +89,14 @@ if not in_slurm:
         # "cleanforget": True, # Doit will forget about tasks that have been cleaned.
         "backend": "sqlite3",
         "dep_file": "./.doit-db.sqlite",
+        "check_file_uptodate": ParquetChecker,
     }
 else:
-    DOIT_CONFIG = {"backend": "sqlite3", "dep_file": "./.doit-db.sqlite"}
+    DOIT_CONFIG = {
+        "backend": "sqlite3",
+        "dep_file": "./.doit-db.sqlite",
+        "check_file_uptodate": ParquetChecker,
+    }
 init(autoreset=True)
 
 
@@ -68,6 +107,56 @@ OUTPUT_DIR = config("OUTPUT_DIR")
 OS_TYPE = config("OS_TYPE")
 USER = config("USER")
 
+# Yearly RavenPack files: the years and paths the pull, link and aggregate
+# modules read in their combine steps
+RAVENPACK_YEARS = year_range(START_DATE, END_DATE)
+
+
+SUMMARY_CUBE_MANIFESTS = [
+    DATA_DIR / "summary_cube" / table / "_manifest.json"
+    for table in ["crsp_daily", "ravenpack_daily", "sentiment_hist"]
+]
+
+## Performance ledger
+# Every task is wrapped between perf_ledger.start_task and finish_task, which
+# record its wall/CPU time, peak memory, I/O and Parquet rows in
+# .doit-perf.sqlite. `python ./src/perf_ledger.py` prints the trend per task.
+RUN_ID = datetime.now().isoformat(timespec="seconds")
+
+
+def ledgered(task_creator):
+    """Decorator adding the perf_ledger actions to every task of a creator."""
+
+    @wraps(task_creator)
+    def wrapper():
+        tasks = task_creator()
+        if isinstance(tasks, dict):
+            tasks = [{"basename": task_creator.__name__[len("task_") :], **tasks}]
+        for task in tasks:
+            if task.get("actions"):
+                basename = task.get("basename", task_creator.__name__[len("task_") :])
+                name = f"{basename}:{task['name']}" if "name" in task else basename
+                task = {
+                    **task,
+                    "actions": [
+                        (perf_ledger.start_task, [name, RUN_ID]),
+                        *task["actions"],
+                        (
+                            perf_ledger.finish_task,
+                            [
+                                name,
+                                RUN_ID,
+                                task.get("file_dep", []),
+                                task.get("targets", []),
+                            ],
+                        ),
+                    ],
+                }
+            yield task
+
+    return wrapper
+
+
 ## Helpers for handling Jupyter Notebook tasks
 environ["PYDEVD_DISABLE_FILE_VALIDATION"] = "1"
 
@@ -112,29 +201,41 @@ def copy_file(origin_path, destination_path, mkdir=True):
     return _copy_file
 
 
+## In-process task actions
+# Tasks call `main()` of their module inside the doit process instead of
+# starting `ipython ./src/<module>.py`, which saves an interpreter start and
+# the imports of pandas & co. per task. Under `doit -P process` each task
+# still runs in its own worker process.
+def run_main(module, **kwargs):
+    """Python action calling `main(**kwargs)` of a module in ./src/"""
+    importlib.import_module(module).main(**kwargs)
+
+
 ##################################
 ## Begin rest of PyDoit tasks here
 ##################################
 
 
+@ledgered
 def task_config():
     """Create empty directories for data and output if they don't exist"""
     return {
-        "actions": ["ipython ./src/settings.py"],
+        "actions": [(create_directories,)],
         "targets": [DATA_DIR, OUTPUT_DIR],
         "file_dep": ["./src/settings.py"],
         "clean": [],
     }
 
 
+@ledgered
 def task_pull():
     """Pull data from external sources"""
     yield {
         "name": "crsp_stock",
         "doc": "Pull daily CRSP stock data and Russell 1000 proxy from WRDS",
         "actions": [
-            "ipython ./src/settings.py",
-            "ipython ./src/pull_CRSP_stock.py",
+            (create_directories,),
+            (run_main, ["pull_CRSP_stock"]),
         ],
         "targets": [
             DATA_DIR / "CRSP_DAILY_PAPER_UNIVERSE.parquet",
@@ -147,8 +248,8 @@ def task_pull():
         "name": "russell_1000",
         "doc": "Pull Russell 1000 constituents from iShares",
         "actions": [
-            "ipython ./src/settings.py",
-            "ipython ./src/pull_russell_1000.py",
+            (create_directories,),
+            (run_main, ["pull_russell_1000"]),
         ],
         "targets": [
             DATA_DIR / "RUSSELL_1000_CONSTITUENTS.parquet",
@@ -157,41 +258,169 @@ def task_pull():
         "clean": [],
     }
 
+    # RavenPack is pulled, linked, merged and aggregated one year per subtask,
+    # so `doit -n 8 -P process` rebuilds only stale years, concurrently. Each
+    # stage is then combined into the single file that later tasks read.
+    for year in RAVENPACK_YEARS:
+        yield {
+            "name": f"ravenpack_djpr_{year}",
+            "doc": f"Pull RavenPack DJPR equities for {year} from WRDS",
+            "actions": [
+                (create_directories,),
+                (run_main, ["pull_ravenpack"], {"step": "pull", "year": year}),
+            ],
+            "targets": [year_file_path(year)],
+            "file_dep": ["./src/settings.py", "./src/pull_ravenpack.py"],
+            "clean": [],
+        }
+
     yield {
         "name": "ravenpack_djpr",
         "doc": "Pull RavenPack DJPR equities (US, relevance>=90, single-firm stories) from WRDS and save as one parquet superset",
         "actions": [
-            "ipython ./src/settings.py",
-            "ipython ./src/pull_ravenpack.py",
+            (create_directories,),
+            (run_main, ["pull_ravenpack"], {"step": "combine"}),
         ],
         "targets": [
             DATA_DIR / "ravenpack_djpr.parquet",
         ],
-        "file_dep": ["./src/settings.py", "./src/pull_ravenpack.py"],
+        "file_dep": [
+            "./src/settings.py",
+            "./src/pull_ravenpack.py",
+            *(year_file_path(y) for y in RAVENPACK_YEARS),
+        ],
         "clean": [],
     }
 
     yield {
-        "name": "link_ravenpack_crsp",
-        "doc": "Link RavenPack to CRSP using WRDS method (ncusip vs isin->cusip8), then merge to CRSP daily",
+        "name": "raven_crsp_crosswalk",
+        "doc": "Link RavenPack to CRSP using WRDS method (ncusip vs isin->cusip8)",
         "actions": [
-            "ipython ./src/settings.py",
-            "ipython ./src/link_ravenpack_crsp.py",
+            (create_directories,),
+            (run_main, ["link_ravenpack_crsp"], {"step": "crosswalk"}),
         ],
         "targets": [
             DATA_DIR / "raven_crsp_crosswalk.parquet",
+        ],
+        "file_dep": ["./src/settings.py", "./src/link_ravenpack_crsp.py"],
+        "clean": [],
+    }
+
+    for year in RAVENPACK_YEARS:
+        yield {
+            "name": f"ravenpack_with_permno_{year}",
+            "doc": f"Attach permno to RavenPack {year}",
+            "actions": [
+                (create_directories,),
+                (run_main, ["link_ravenpack_crsp"], {"step": "attach", "year": year}),
+            ],
+            "targets": [with_permno_year_path(year)],
+            "file_dep": [
+                "./src/settings.py",
+                "./src/link_ravenpack_crsp.py",
+                year_file_path(year),
+                DATA_DIR / "raven_crsp_crosswalk.parquet",
+            ],
+            "clean": [],
+        }
+
+        yield {
+            "name": f"ravenpack_crsp_merged_{year}",
+            "doc": f"Merge RavenPack {year} (with permno) to CRSP daily",
+            "actions": [
+                (create_directories,),
+                (run_main, ["link_ravenpack_crsp"], {"step": "merge", "year": year}),
+            ],
+            "targets": [merged_year_path(year)],
+            "file_dep": [
+                "./src/settings.py",
+                "./src/link_ravenpack_crsp.py",
+                with_permno_year_path(year),
+                DATA_DIR / "CRSP_DAILY_PAPER_UNIVERSE.parquet",
+            ],
+            "task_dep": ["pull:crsp_stock"],
+            "clean": [],
+        }
+
+        yield {
+            "name": f"ravenpack_firm_day_{year}",
+            "doc": f"Aggregate RavenPack {year} (with permno) to firm-day partials",
+            "actions": [
+                (create_directories,),
+                (
+                    run_main,
+                    ["aggregate_ravenpack"],
+                    {"step": "aggregate", "year": year},
+                ),
+            ],
+            "targets": [partials_year_path(year)],
+            "file_dep": [
+                "./src/settings.py",
+                "./src/aggregate_ravenpack.py",
+                with_permno_year_path(year),
+                DATA_DIR / "CRSP_DAILY_PAPER_UNIVERSE.parquet",
+            ],
+            "task_dep": ["pull:crsp_stock"],
+            "clean": [],
+        }
+
+    yield {
+        "name": "link_ravenpack_crsp",
+        "doc": "Combine the yearly RavenPack-with-permno and RavenPack x CRSP daily files",
+        "actions": [
+            (create_directories,),
+            (run_main, ["link_ravenpack_crsp"], {"step": "combine"}),
+        ],
+        "targets": [
             DATA_DIR / "ravenpack_djpr_with_permno.parquet",
             DATA_DIR / "ravenpack_crsp_merged.parquet",
         ],
         "file_dep": [
             "./src/settings.py",
             "./src/link_ravenpack_crsp.py",
-            DATA_DIR / "ravenpack_djpr.parquet",
+            *(with_permno_year_path(y) for y in RAVENPACK_YEARS),
+            *(merged_year_path(y) for y in RAVENPACK_YEARS),
+        ],
+        "clean": [],
+    }
+
+    yield {
+        "name": "ravenpack_firm_day",
+        "doc": "Aggregate RavenPack (with permno) to a (permno, trading_date) news panel",
+        "actions": [
+            (create_directories,),
+            (run_main, ["aggregate_ravenpack"], {"step": "combine"}),
+        ],
+        "targets": [
+            DATA_DIR / "ravenpack_firm_day.parquet",
+        ],
+        "file_dep": [
+            "./src/settings.py",
+            "./src/aggregate_ravenpack.py",
+            *(partials_year_path(y) for y in RAVENPACK_YEARS),
+        ],
+        "clean": [],
+    }
+
+    yield {
+        "name": "summary_cube",
+        "doc": "Backfill the yearly daily summary cube read by the exploratory charts",
+        "actions": [
+            (create_directories,),
+            (run_main, ["summary_cube"]),
+        ],
+        "targets": SUMMARY_CUBE_MANIFESTS,
+        "file_dep": [
+            "./src/settings.py",
+            "./src/summary_cube.py",
             DATA_DIR / "CRSP_DAILY_PAPER_UNIVERSE.parquet",
+            DATA_DIR / "ravenpack_djpr.parquet",
+            DATA_DIR / "ravenpack_crsp_merged.parquet",
         ],
         "task_dep": [
             "pull:crsp_stock",
             "pull:ravenpack_djpr",
+            "pull:link_ravenpack_crsp",
         ],
         "clean": [],
     }
@@ -200,8 +429,8 @@ def task_pull():
         "name": "exploratory_charts",
         "doc": "Generate exploratory HTML charts for CRSP, RavenPack, and merged data",
         "actions": [
-            "ipython ./src/settings.py",
-            "ipython ./src/generate_charts.py",
+            (create_directories,),
+            (run_main, ["generate_charts"]),
         ],
         "targets": [
             OUTPUT_DIR / "crsp_avg_market_cap.html",
@@ -211,19 +440,190 @@ def task_pull():
         "file_dep": [
             "./src/settings.py",
             "./src/generate_charts.py",
-            DATA_DIR / "CRSP_DAILY_PAPER_UNIVERSE.parquet",
-            DATA_DIR / "ravenpack_djpr.parquet",
-            DATA_DIR / "ravenpack_crsp_merged.parquet",
+            "./src/parquet_fingerprint.py",
+            "./src/summary_cube.py",
+            *SUMMARY_CUBE_MANIFESTS,
         ],
         "task_dep": [
-            "pull:crsp_stock",
-            "pull:ravenpack_djpr",
-            "pull:link_ravenpack_crsp",
+            "pull:summary_cube",
+        ],
+        "clean": [],
+    }
+
+
+@ledgered
+def task_features():
+    """Build headline text features from RavenPack"""
+    yield {
+        "name": "headline_embeddings",
+        "doc": "Encode distinct RavenPack headlines into a memory-mapped float16 matrix (cached across runs)",
+        "actions": [
+            (create_directories,),
+            (run_main, ["embed_headlines"]),
+        ],
+        "targets": [
+            DATA_DIR / "headline_embeddings" / "hashing512" / "embeddings.npy",
+            DATA_DIR / "headline_embeddings" / "hashing512" / "headline_index.parquet",
+            DATA_DIR / "headline_embeddings" / "hashing512" / "story_headline.parquet",
+        ],
+        "file_dep": [
+            "./src/settings.py",
+            "./src/embed_headlines.py",
+            DATA_DIR / "ravenpack_djpr.parquet",
+        ],
+        "task_dep": ["pull:ravenpack_djpr"],
+        "clean": [],
+    }
+
+    yield {
+        "name": "headline_novelty",
+        "doc": "Flag near-duplicate headlines per firm with MinHash-LSH and compute days since a similar story",
+        "actions": [
+            (create_directories,),
+            (run_main, ["headline_novelty"]),
+        ],
+        "targets": [
+            DATA_DIR / "headline_novelty.parquet",
+        ],
+        "file_dep": [
+            "./src/settings.py",
+            "./src/embed_headlines.py",
+            "./src/headline_novelty.py",
+            DATA_DIR / "ravenpack_djpr_with_permno.parquet",
+        ],
+        "task_dep": ["pull:link_ravenpack_crsp"],
+        "clean": [],
+    }
+
+    yield {
+        "name": "headline_dtm",
+        "doc": "Build yearly sparse document-term matrix chunks of RavenPack headlines",
+        "actions": [
+            (create_directories,),
+            (run_main, ["headline_dtm"]),
         ],
+        "targets": [
+            DATA_DIR / "headline_dtm" / "vocab" / "vocabulary.parquet",
+        ],
+        "file_dep": [
+            "./src/settings.py",
+            "./src/embed_headlines.py",
+            "./src/headline_dtm.py",
+            DATA_DIR / "ravenpack_djpr.parquet",
+        ],
+        "task_dep": ["pull:ravenpack_djpr"],
         "clean": [],
     }
 
 
+@ledgered
+def task_models():
+    """Estimate news-based return prediction models"""
+    yield {
+        "name": "walk_forward_ridge",
+        "doc": "Rolling-window ridge on headline embeddings with incremental Gram updates; out-of-sample predictions",
+        "actions": [
+            (create_directories,),
+            (run_main, ["rolling_ridge"]),
+        ],
+        "targets": [
+            DATA_DIR / "prediction_panel.parquet",
+            DATA_DIR / "oos_predictions.parquet",
+        ],
+        "file_dep": [
+            "./src/settings.py",
+            "./src/aggregate_ravenpack.py",
+            "./src/embed_headlines.py",
+            "./src/load_data.py",
+            "./src/rolling_ridge.py",
+            DATA_DIR / "ravenpack_djpr_with_permno.parquet",
+            DATA_DIR / "CRSP_DAILY_PAPER_UNIVERSE.parquet",
+            DATA_DIR / "headline_embeddings" / "hashing512" / "embeddings.npy",
+            DATA_DIR / "headline_embeddings" / "hashing512" / "story_headline.parquet",
+        ],
+        "task_dep": ["features:headline_embeddings"],
+        "clean": [],
+    }
+    yield {
+        "name": "news_sentiment_backtest",
+        "doc": "Daily quintile long-short backtest of firm-day news sentiment (equal and value weights)",
+        "actions": [
+            (create_directories,),
+            (run_main, ["backtest"]),
+        ],
+        "targets": [
+            DATA_DIR / "backtest_css_mean_equal_h1.parquet",
+            DATA_DIR / "backtest_css_mean_value_h1.parquet",
+        ],
+        "file_dep": [
+            "./src/settings.py",
+            "./src/misc_tools.py",
+            "./src/backtest.py",
+            DATA_DIR / "ravenpack_firm_day.parquet",
+            DATA_DIR / "CRSP_DAILY_PAPER_UNIVERSE.parquet",
+        ],
+        "task_dep": ["pull:ravenpack_firm_day"],
+        "clean": [],
+    }
+    yield {
+        "name": "market_model",
+        "doc": "Rolling market-model betas, daily abnormal returns and news-event CARs",
+        "actions": [
+            (create_directories,),
+            (run_main, ["market_model"]),
+        ],
+        "targets": [
+            DATA_DIR / "market_model_daily.parquet",
+            DATA_DIR / "news_event_cars.parquet",
+        ],
+        "file_dep": [
+            "./src/settings.py",
+            "./src/aggregate_ravenpack.py",
+            "./src/misc_tools.py",
+            "./src/load_data.py",
+            "./src/market_model.py",
+            DATA_DIR / "ravenpack_firm_day.parquet",
+            DATA_DIR / "CRSP_DAILY_PAPER_UNIVERSE.parquet",
+        ],
+        "task_dep": ["pull:crsp_stock", "pull:ravenpack_firm_day"],
+        "clean": [],
+    }
+
+
+@ledgered
+def task_profile():
+    """Profile datasets from Parquet footers and streaming sketches"""
+    datasets = {
+        "crsp_daily": ("CRSP_DAILY_PAPER_UNIVERSE.parquet", "pull:crsp_stock"),
+        "ravenpack_djpr": ("ravenpack_djpr.parquet", "pull:ravenpack_djpr"),
+        "ravenpack_crsp_merged": (
+            "ravenpack_crsp_merged.parquet",
+            "pull:link_ravenpack_crsp",
+        ),
+        "ravenpack_firm_day": (
+            "ravenpack_firm_day.parquet",
+            "pull:ravenpack_firm_day",
+        ),
+    }
+    for name, (filename, producer) in datasets.items():
+        yield {
+            "name": name,
+            "doc": f"Row counts, min/max, nulls, yearly coverage, distinct counts and quantiles of {filename}",
+            "actions": [
+                (create_directories,),
+                (run_main, ["profile_parquet"], {"dataset": name}),
+            ],
+            "targets": [DATA_DIR / "profiles" / f"{name}.json"],
+            "file_dep": [
+                "./src/settings.py",
+                "./src/profile_parquet.py",
+                DATA_DIR / filename,
+            ],
+            "task_dep": [producer],
+            "clean": [],
+        }
+
+
 # def task_summary_stats():
 #     """Generate summary statistics tables"""
 #     file_dep = ["./src/example_table.py"]
@@ -251,8 +651,6 @@ def task_pull():
 #         "targets": [],
 #     },
 # }
-
-
 # # fmt: off
 # def task_run_notebooks():
 #     """Preps the notebooks for presentation format.
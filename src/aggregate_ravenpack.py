@@ -0,0 +1,396 @@
+"""
+Aggregate article-level RavenPack news into a compact firm-day panel.
+
+`ravenpack_crsp_merged.parquet` repeats every CRSP column for every news
+record. Most of the analysis only needs firm-day signals, so this stage
+collapses RavenPack (with permno attached) to one row per
+(permno, trading_date) with:
+
+ - n_records, n_articles, n_events, n_novel
+ - mean/min/max of event_sentiment_score (ess_*) and css (css_*)
+ - one count column per RavenPack event group (n_group_<rp_group>)
+
+News is keyed on its UTC calendar date, as in `merge_ravenpack_with_crsp_daily`,
+and rolled forward to the next CRSP trading date when it falls on a weekend
+or holiday.
+
+The input is streamed in record batches. Each batch is reduced with a single
+sort-based segment pass into mergeable partial aggregates (counts, sums,
+minima, maxima), and the partials are combined at the end. Because partials
+are mergeable, the same functions also aggregate one year at a time: doit
+saves the partials of each year (--STEP=aggregate --YEAR=2005) and a final
+--STEP=combine merges and finalizes them. News from the last days of a year
+can roll forward into the next year's first trading date, which the merge
+handles like any other shared key.
+
+The one statistic that is not mergeable is n_articles, a distinct count: the
+records of a story can straddle two batches. Within a file it is counted
+from the unique (firm-day, story) pairs of all batches. Across years the
+per-year counts are summed, which is exact because the records of a story
+share its timestamp and so fall in the same year.
+"""
+
+from __future__ import annotations
+
+from pathlib import Path
+from typing import Iterable, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+import pyarrow.parquet as pq
+
+from parquet_layout import write_parquet
+from settings import config
+
+DATA_DIR = Path(config("DATA_DIR"))
+PARTIALS_YEAR_DIR = DATA_DIR / "ravenpack_firm_day_years"
+
+# A story counts as novel when RavenPack saw no similar event in the
+# preceding `NOVELTY_DAYS` days.
+NOVELTY_DAYS = 1
+
+EVENT_TYPE_COL = "rp_group"
+
+INPUT_COLUMNS = [
+    "permno",
+    "timestamp_utc",
+    "rp_story_id",
+    "event_sentiment_score",
+    "css",
+    "event_similarity_days",
+    EVENT_TYPE_COL,
+]
+
+SCORE_COLUMNS = {"event_sentiment_score": "ess", "css": "css"}
+
+
+def load_trading_calendar(crsp_daily_path: Optional[Path] = None) -> np.ndarray:
+    """
+    Sorted unique CRSP trading dates as datetime64[D].
+    Only the `date` column of the CRSP file is read.
+    """
+    if crsp_daily_path is None:
+        crsp_daily_path = DATA_DIR / "CRSP_DAILY_PAPER_UNIVERSE.parquet"
+    dates = pq.read_table(crsp_daily_path, columns=["date"]).column("date")
+    dates = dates.to_numpy().astype("datetime64[D]")
+    return np.unique(dates)
+
+
+def trading_date_codes(timestamps, calendar: np.ndarray) -> np.ndarray:
+    """
+    Map timestamps to positions in `calendar` (the first trading date on or
+    after the UTC calendar date). Returns -1 where no such trading date exists.
+    """
+    days = np.asarray(pd.to_datetime(timestamps).values).astype("datetime64[D]")
+    codes = np.searchsorted(calendar, days, side="left")
+    codes[(codes >= len(calendar)) | np.isnat(days)] = -1
+    return codes
+
+
+def _keyed_records(df: pd.DataFrame, calendar: np.ndarray):
+    """
+    Records with a permno and a trading date, with their permno, trading
+    date code, firm-day key (permno * len(calendar) + code) and story hash.
+    """
+    permno = pd.to_numeric(df["permno"], errors="coerce").to_numpy(dtype="float64")
+    codes = trading_date_codes(df["timestamp_utc"], calendar)
+    keep = ~np.isnan(permno) & (codes >= 0)
+
+    df = df.loc[keep]
+    permno = permno[keep].astype("int64")
+    codes = codes[keep].astype("int64")
+    key = permno * len(calendar) + codes
+    story = pd.util.hash_array(df["rp_story_id"].astype(str).to_numpy())
+    return df, permno, codes, key, story
+
+
+def _unique_pairs(key: np.ndarray, story: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    order = np.lexsort((story, key))
+    key, story = key[order], story[order]
+    first = np.ones(len(key), dtype=bool)
+    first[1:] = (key[1:] != key[:-1]) | (story[1:] != story[:-1])
+    return key[first], story[first]
+
+
+def firm_day_story_pairs(
+    df: pd.DataFrame, calendar: np.ndarray
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Unique (firm-day key, story hash) pairs of a batch of records.
+    """
+    _, _, _, key, story = _keyed_records(df, calendar)
+    return _unique_pairs(key, story)
+
+
+def count_firm_day_articles(
+    pairs: Iterable[Tuple[np.ndarray, np.ndarray]], calendar: np.ndarray
+) -> pd.DataFrame:
+    """
+    Distinct stories per (permno, trading_date) from the story pairs of
+    every batch, sorted by (permno, trading_date).
+
+    n_articles is a distinct count, so unlike the other partials it cannot
+    be summed across batches: a story whose records straddle a batch
+    boundary would be counted twice.
+    """
+    pairs = list(pairs)
+    key, _ = _unique_pairs(
+        np.concatenate([np.zeros(0, "int64")] + [k for k, _ in pairs]),
+        np.concatenate([np.zeros(0, "uint64")] + [s for _, s in pairs]),
+    )
+    keys, counts = np.unique(key, return_counts=True)
+    return pd.DataFrame(
+        {
+            "permno": keys // len(calendar),
+            "trading_date": calendar[keys % len(calendar)],
+            "n_articles": counts,
+        }
+    )
+
+
+def partial_firm_day_aggregates(
+    df: pd.DataFrame,
+    calendar: np.ndarray,
+    novelty_days: int = NOVELTY_DAYS,
+    event_type_col: str = EVENT_TYPE_COL,
+) -> pd.DataFrame:
+    """
+    Reduce one batch of RavenPack records to mergeable firm-day partials.
+
+    Rows are sorted once by (firm-day key, story) and every statistic is a
+    segment reduction over that order. Records without a permno or a
+    trading date are dropped. n_articles counts the distinct stories of
+    this batch only; see `count_firm_day_articles`.
+    """
+    df, permno, codes, key, story = _keyed_records(df, calendar)
+    if not len(df):
+        return pd.DataFrame()
+
+    order = np.lexsort((story, key))
+    key = key[order]
+    story = story[order]
+
+    new_key = np.empty(len(key), dtype=bool)
+    new_key[0] = True
+    new_key[1:] = key[1:] != key[:-1]
+    new_story = new_key.copy()
+    new_story[1:] |= story[1:] != story[:-1]
+    starts = np.flatnonzero(new_key)
+
+    out = {
+        "permno": permno[order][starts],
+        "trading_date": calendar[codes[order][starts]],
+        "n_records": np.diff(np.append(starts, len(key))),
+        "n_articles": np.add.reduceat(new_story.astype("int64"), starts),
+    }
+
+    for col, short in SCORE_COLUMNS.items():
+        x = pd.to_numeric(df[col], errors="coerce").to_numpy(dtype="float64")[order]
+        valid = ~np.isnan(x)
+        out[f"{short}_n"] = np.add.reduceat(valid.astype("int64"), starts)
+        out[f"{short}_sum"] = np.add.reduceat(np.where(valid, x, 0.0), starts)
+        out[f"{short}_min"] = np.fmin.reduceat(x, starts)
+        out[f"{short}_max"] = np.fmax.reduceat(x, starts)
+
+    similarity = pd.to_numeric(df["event_similarity_days"], errors="coerce")
+    novel = (similarity.to_numpy(dtype="float64") >= novelty_days)[order]
+    out["n_novel"] = np.add.reduceat(novel.astype("int64"), starts)
+
+    segment = np.cumsum(new_key) - 1
+    group_codes, groups = pd.factorize(df[event_type_col].to_numpy()[order])
+    valid = group_codes >= 0
+    counts = np.bincount(
+        segment[valid] * len(groups) + group_codes[valid],
+        minlength=len(starts) * len(groups),
+    ).reshape(len(starts), len(groups))
+    for j, name in enumerate(groups):
+        out[f"n_group_{name}"] = counts[:, j]
+
+    return pd.DataFrame(out)
+
+
+def combine_firm_day_partials(partials: Iterable[pd.DataFrame]) -> pd.DataFrame:
+    """
+    Merge partial aggregates that may share (permno, trading_date) keys.
+    """
+    partials = [p for p in partials if len(p)]
+    if not partials:
+        return pd.DataFrame()
+    df = pd.concat(partials, ignore_index=True)
+
+    count_cols = [
+        c for c in df.columns if c.startswith("n_") or c.endswith(("_n", "_sum"))
+    ]
+    df[count_cols] = df[count_cols].fillna(0)
+    agg = {c: "sum" for c in count_cols}
+    agg.update({c: "min" for c in df.columns if c.endswith("_min")})
+    agg.update({c: "max" for c in df.columns if c.endswith("_max")})
+
+    combined = df.groupby(["permno", "trading_date"], sort=True).agg(agg)
+    int_cols = [c for c in count_cols if not c.endswith("_sum")]
+    combined[int_cols] = combined[int_cols].astype("int64")
+    return combined.reset_index()
+
+
+def finalize_firm_day_panel(partials: pd.DataFrame) -> pd.DataFrame:
+    """
+    Turn combined partials into the published panel (sums become means).
+    Empty partials (e.g. a year without linked news) give an empty panel.
+    """
+    lead = ["permno", "trading_date", "n_records", "n_articles", "n_events", "n_novel"]
+    scores = [
+        f"{short}_{stat}"
+        for short in SCORE_COLUMNS.values()
+        for stat in ("mean", "min", "max")
+    ]
+    if partials.empty:
+        empty = {c: pd.Series(dtype="int64") for c in lead}
+        empty["trading_date"] = pd.Series(dtype="datetime64[ns]")
+        empty.update({c: pd.Series(dtype="float64") for c in scores})
+        return pd.DataFrame(empty)
+
+    panel = partials.copy()
+    panel["n_events"] = panel["ess_n"]
+    for short in SCORE_COLUMNS.values():
+        panel[f"{short}_mean"] = panel[f"{short}_sum"] / panel[f"{short}_n"].where(
+            panel[f"{short}_n"] > 0
+        )
+    panel = panel.drop(columns=["ess_sum", "ess_n", "css_sum", "css_n"])
+
+    groups = sorted(c for c in panel.columns if c.startswith("n_group_"))
+    return panel[lead + scores + groups]
+
+
+def aggregate_ravenpack_firm_day_partials(
+    ravenpack_with_permno_path: Path,
+    calendar: np.ndarray,
+    batch_size: int = 1_000_000,
+    novelty_days: int = NOVELTY_DAYS,
+) -> pd.DataFrame:
+    """
+    Stream a RavenPack-with-permno parquet file and return combined partials,
+    with n_articles counted over the whole file.
+    """
+    pf = pq.ParquetFile(ravenpack_with_permno_path)
+    partials: List[pd.DataFrame] = []
+    pairs = []
+    for batch in pf.iter_batches(batch_size=batch_size, columns=INPUT_COLUMNS):
+        df = batch.to_pandas()
+        partials.append(
+            partial_firm_day_aggregates(df, calendar, novelty_days=novelty_days)
+        )
+        pairs.append(firm_day_story_pairs(df, calendar))
+
+    combined = combine_firm_day_partials(partials)
+    if len(combined):
+        # Both are sorted by (permno, trading_date) and cover the same keys
+        combined["n_articles"] = count_firm_day_articles(pairs, calendar)[
+            "n_articles"
+        ].to_numpy()
+    return combined
+
+
+def aggregate_ravenpack_firm_day(
+    ravenpack_with_permno_path: Optional[Path] = None,
+    crsp_daily_path: Optional[Path] = None,
+    out_path: Optional[Path] = None,
+    batch_size: int = 1_000_000,
+    novelty_days: int = NOVELTY_DAYS,
+) -> Path:
+    """
+    Build the (permno, trading_date) news panel and save it as parquet.
+    """
+    if ravenpack_with_permno_path is None:
+        ravenpack_with_permno_path = DATA_DIR / "ravenpack_djpr_with_permno.parquet"
+    if out_path is None:
+        out_path = DATA_DIR / "ravenpack_firm_day.parquet"
+
+    calendar = load_trading_calendar(crsp_daily_path)
+    partials = aggregate_ravenpack_firm_day_partials(
+        ravenpack_with_permno_path,
+        calendar,
+        batch_size=batch_size,
+        novelty_days=novelty_days,
+    )
+    panel = finalize_firm_day_panel(partials)
+
+    out_path.parent.mkdir(parents=True, exist_ok=True)
+    write_parquet(panel, out_path, "firm_day")
+    print(f"Saved firm-day news panel -> {out_path}")
+    print(f"Rows: {len(panel):,}")
+    return out_path
+
+
+def partials_year_path(year: int) -> Path:
+    return PARTIALS_YEAR_DIR / f"ravenpack_firm_day_partials_{year}.parquet"
+
+
+def aggregate_ravenpack_firm_day_year(
+    year: int,
+    ravenpack_with_permno_path: Optional[Path] = None,
+    crsp_daily_path: Optional[Path] = None,
+    batch_size: int = 1_000_000,
+    novelty_days: int = NOVELTY_DAYS,
+) -> Path:
+    """
+    Save the combined (not finalized) partials of one year of RavenPack with permno.
+    """
+    if ravenpack_with_permno_path is None:
+        ravenpack_with_permno_path = (
+            DATA_DIR
+            / "ravenpack_with_permno_years"
+            / f"ravenpack_djpr_with_permno_{year}.parquet"
+        )
+
+    calendar = load_trading_calendar(crsp_daily_path)
+    partials = aggregate_ravenpack_firm_day_partials(
+        ravenpack_with_permno_path,
+        calendar,
+        batch_size=batch_size,
+        novelty_days=novelty_days,
+    )
+    out_path = partials_year_path(year)
+    out_path.parent.mkdir(parents=True, exist_ok=True)
+    write_parquet(partials, out_path, "firm_day")
+    print(f"Saved {len(partials):,} firm-day partials for {year} -> {out_path}")
+    return out_path
+
+
+def combine_firm_day_years(
+    partial_paths: Optional[Iterable[Path]] = None, out_path: Optional[Path] = None
+) -> Path:
+    """
+    Merge per-year partials and save the finalized firm-day panel.
+    """
+    if partial_paths is None:
+        partial_paths = sorted(
+            PARTIALS_YEAR_DIR.glob("ravenpack_firm_day_partials_*.parquet")
+        )
+    if out_path is None:
+        out_path = DATA_DIR / "ravenpack_firm_day.parquet"
+    partials = combine_firm_day_partials(pd.read_parquet(p) for p in partial_paths)
+    panel = finalize_firm_day_panel(partials)
+
+    out_path.parent.mkdir(parents=True, exist_ok=True)
+    write_parquet(panel, out_path, "firm_day")
+    print(f"Saved firm-day news panel -> {out_path}")
+    print(f"Rows: {len(panel):,}")
+    return out_path
+
+
+def main(step: Optional[str] = None, year: Optional[int] = None) -> None:
+    """
+    doit runs step="aggregate" with a year per task, then step="combine".
+    From the command line: --STEP=aggregate --YEAR=2005.
+    """
+    step = step or config("STEP", default="all")
+    if step == "aggregate":
+        aggregate_ravenpack_firm_day_year(year or int(config("YEAR")))
+    elif step == "combine":
+        combine_firm_day_years()
+    else:
+        aggregate_ravenpack_firm_day()
+
+
+if __name__ == "__main__":
+    main()
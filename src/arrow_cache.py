@@ -0,0 +1,135 @@
+"""
+Memory-mapped Arrow IPC cache of frequently loaded Parquet files.
+
+Reading a Parquet file decompresses and decodes every page on each load.
+`read_parquet_cached` keeps an uncompressed Arrow IPC (Feather v2) copy next
+to the Parquet master (`X.parquet` -> `X.arrow`) and memory-maps it, so a
+load is a zero-copy read of the mapped buffers (plus the conversion to
+pandas when a DataFrame is requested).
+
+The cache file stores the footer fingerprint of its source (see
+`parquet_fingerprint.py`) and the source's size and mtime in its schema
+metadata. The cache is rebuilt on the next load when any of them differs:
+the footer alone misses edits that keep every statistic (e.g. two values
+swapped within a row group), the mtime does not. When the cache cannot be
+written (e.g. a read-only DATA_DIR) the Parquet file is read directly.
+
+Set ARROW_CACHE=false to bypass the cache, e.g. to save disk space:
+the cache is as large as the uncompressed data.
+"""
+
+from __future__ import annotations
+
+import os
+from pathlib import Path
+from typing import Optional, Sequence, Tuple
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+from pyarrow import feather
+
+from parquet_fingerprint import parquet_fingerprint
+from settings import config
+
+FINGERPRINT_KEY = b"arrow_cache.source_fingerprint"
+STAT_KEY = b"arrow_cache.source_stat"
+
+
+def cache_enabled() -> bool:
+    return str(config("ARROW_CACHE", default="true")).lower() not in {
+        "0",
+        "false",
+        "no",
+    }
+
+
+def cache_path(parquet_path: Path) -> Path:
+    return Path(parquet_path).with_suffix(".arrow")
+
+
+def _source_stat(parquet_path: Path) -> str:
+    stat = Path(parquet_path).stat()
+    return f"{stat.st_size}-{stat.st_mtime_ns}"
+
+
+def _cached_source(path: Path) -> Optional[Tuple[str, str]]:
+    """(fingerprint, stat) of the source recorded in a cache file."""
+    try:
+        with pa.memory_map(str(path)) as source:
+            metadata = pa.ipc.open_file(source).schema.metadata or {}
+    except (OSError, pa.ArrowInvalid):
+        return None
+    if FINGERPRINT_KEY not in metadata or STAT_KEY not in metadata:
+        return None
+    return metadata[FINGERPRINT_KEY].decode(), metadata[STAT_KEY].decode()
+
+
+def build_cache(parquet_path: Path, fingerprint: Optional[str] = None) -> Path:
+    """Write the uncompressed Arrow IPC copy of a Parquet file."""
+    parquet_path = Path(parquet_path)
+    # Stat before reading: a rewrite during the read then shows up as stale
+    stat = _source_stat(parquet_path)
+    fingerprint = fingerprint or parquet_fingerprint(parquet_path)
+    table = pq.read_table(parquet_path)
+    metadata = {
+        **(table.schema.metadata or {}),
+        FINGERPRINT_KEY: fingerprint.encode(),
+        STAT_KEY: stat.encode(),
+    }
+    table = table.replace_schema_metadata(metadata)
+
+    out = cache_path(parquet_path)
+    # Write under a temporary name so that readers never map a partial file
+    tmp = out.with_name(f"{out.name}.{os.getpid()}.tmp")
+    try:
+        feather.write_feather(table, tmp, compression="uncompressed")
+        os.replace(tmp, out)
+    finally:
+        tmp.unlink(missing_ok=True)
+    return out
+
+
+def read_table_cached(
+    parquet_path: Path,
+    columns: Optional[Sequence[str]] = None,
+    use_cache: Optional[bool] = None,
+) -> pa.Table:
+    """
+    Arrow table of a Parquet file, memory-mapped from its IPC cache. The
+    cache is (re)built when missing or when the Parquet file's footer
+    fingerprint, size or mtime changed.
+    """
+    parquet_path = Path(parquet_path)
+    if use_cache is None:
+        use_cache = cache_enabled()
+    if not use_cache:
+        return pq.read_table(parquet_path, columns=columns)
+
+    path = cache_path(parquet_path)
+    fingerprint = parquet_fingerprint(parquet_path)
+    if _cached_source(path) != (fingerprint, _source_stat(parquet_path)):
+        try:
+            build_cache(parquet_path, fingerprint)
+        except OSError as e:
+            print(f"Not caching {parquet_path.name} ({e}); reading Parquet")
+            return pq.read_table(parquet_path, columns=columns)
+
+    table = feather.read_table(path, columns=columns, memory_map=True)
+    metadata = dict(table.schema.metadata or {})
+    metadata.pop(FINGERPRINT_KEY, None)
+    metadata.pop(STAT_KEY, None)
+    return table.replace_schema_metadata(metadata)
+
+
+def read_parquet_cached(
+    parquet_path: Path,
+    columns: Optional[Sequence[str]] = None,
+    use_cache: Optional[bool] = None,
+) -> pd.DataFrame:
+    """Drop-in for `pd.read_parquet(path, columns=...)` going through the cache."""
+    return read_table_cached(parquet_path, columns, use_cache).to_pandas()
+
+
+def clear_cache(parquet_path: Path) -> None:
+    cache_path(parquet_path).unlink(missing_ok=True)
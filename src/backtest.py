@@ -0,0 +1,270 @@
+"""
+Vectorized daily quantile-portfolio backtests of news signals.
+
+Given a (permno, date, signal) panel, stocks are sorted into `n_quantiles`
+portfolios at the close of each trading date and held for the next
+`holding_days` trading days. Portfolios are equal-weighted or weighted by the
+market cap on the formation date (i.e., lagged relative to the holding days).
+
+Everything runs over the full panel at once, with no per-date Python loop:
+
+ - Quantiles: one lexsort by (date, signal). Breakpoints are the per-date
+   positions floor(k * n_date / n_quantiles); ranks are looked up against the
+   concatenated breakpoints with a single `searchsorted`. Tied signals share
+   the lowest rank of their run, so they always land in the same portfolio.
+ - Returns: with holding_days = h, the portfolio on day d is the equal mix of
+   the h cohorts formed on days d-1, ..., d-h (Jegadeesh and Titman, 1993).
+   Cohort returns are weighted averages computed with
+   `misc_tools.groupby_weighted_average`.
+ - Turnover: each day the cohort formed h days ago is replaced, so daily
+   turnover is half the absolute change in normalised weights between the
+   cohorts formed on d-1 and d-1-h, divided by h.
+
+Signals dated on a non-trading day are rolled forward to the next trading
+date, as in `aggregate_ravenpack`.
+"""
+
+from __future__ import annotations
+
+from pathlib import Path
+from typing import Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+from load_data import load
+from misc_tools import groupby_weighted_average
+from settings import config
+
+DATA_DIR = Path(config("DATA_DIR"))
+
+
+def assign_quantiles(
+    date_code: np.ndarray, signal: np.ndarray, n_quantiles: int = 5
+) -> np.ndarray:
+    """
+    Portfolio number (0 = lowest signal) of each row within its date.
+
+    >>> assign_quantiles(np.array([0, 0, 0, 0, 1, 1]),
+    ...                  np.array([4.0, 1.0, 3.0, 2.0, 9.0, 8.0]), n_quantiles=2)
+    array([1, 0, 1, 0, 1, 0])
+    """
+    n = len(signal)
+    out = np.empty(n, dtype=np.int64)
+    if n == 0:
+        return out
+
+    order = np.lexsort((signal, date_code))
+    d = date_code[order]
+    s = signal[order]
+
+    new_date = np.r_[True, d[1:] != d[:-1]]
+    seg_start = np.flatnonzero(new_date)
+    seg_len = np.diff(np.r_[seg_start, n])
+    seg_id = np.cumsum(new_date) - 1
+
+    # Ties take the first position of their run of equal values
+    new_run = new_date | np.r_[True, s[1:] != s[:-1]]
+    pos = np.maximum.accumulate(np.where(new_run, np.arange(n), 0))
+
+    k = np.arange(1, n_quantiles)
+    breakpoints = seg_start[:, None] + (k[None, :] * seg_len[:, None]) // n_quantiles
+    q = np.searchsorted(breakpoints.ravel(), pos, side="right")
+    out[order] = q - seg_id * (n_quantiles - 1)
+    return out
+
+
+def _day_codes(dates, calendar: np.ndarray) -> np.ndarray:
+    days = pd.to_datetime(dates).to_numpy().astype("datetime64[D]")
+    codes = np.searchsorted(calendar, days, side="left")
+    codes[codes >= len(calendar)] = -1
+    return codes
+
+
+def quantile_portfolio_backtest(
+    signals: pd.DataFrame,
+    crsp: pd.DataFrame,
+    signal_col: str = "signal",
+    n_quantiles: int = 5,
+    weighting: str = "equal",
+    holding_days: int = 1,
+    date_col: str = "date",
+    ret_col: str = "ret",
+    size_col: str = "market_cap",
+) -> Tuple[pd.DataFrame, pd.DataFrame]:
+    """
+    Daily quantile portfolio returns and turnover.
+
+    Parameters
+    ----------
+    signals : pandas.DataFrame
+        Columns permno, `date_col` and `signal_col`.
+    crsp : pandas.DataFrame
+        CRSP daily with permno, date, `ret_col` and (for value weights)
+        `size_col`. Its dates define the trading calendar.
+    weighting : str
+        "equal" or "value" (formation-date market cap).
+
+    Returns
+    -------
+    (returns, turnover) : tuple of pandas.DataFrame
+        Indexed by date with columns Q1..Qn and LS (= Qn - Q1).
+    """
+    if weighting not in {"equal", "value"}:
+        raise ValueError("weighting must be 'equal' or 'value'")
+
+    calendar = np.unique(crsp["date"].to_numpy().astype("datetime64[D]"))
+    n_days = len(calendar)
+
+    crsp_code = _day_codes(crsp["date"], calendar)
+    crsp_key = crsp["permno"].to_numpy(dtype=np.int64) * n_days + crsp_code
+
+    sig = signals[["permno", date_col, signal_col]].dropna()
+    code = _day_codes(sig[date_col], calendar)
+    keep = code >= 0
+    permno = sig["permno"].to_numpy(dtype=np.int64)[keep]
+    code = code[keep]
+    value = sig[signal_col].to_numpy(dtype=np.float64)[keep]
+
+    # Formation-date weights: 1 or the market cap on the formation date
+    if weighting == "value":
+        size = pd.Series(crsp[size_col].to_numpy(dtype=np.float64), index=crsp_key)
+        size = size[~size.index.duplicated()]
+        weight = size.reindex(permno * n_days + code).to_numpy()
+    else:
+        weight = np.ones(len(permno))
+    ok = np.isfinite(weight) & (weight > 0)
+    holdings = pd.DataFrame(
+        {
+            "permno": permno[ok],
+            "formation": code[ok],
+            "quantile": assign_quantiles(code[ok], value[ok], n_quantiles) + 1,
+            "weight": weight[ok],
+        }
+    )
+
+    # Returns of each cohort on each of its holding days
+    rets = pd.Series(crsp[ret_col].to_numpy(dtype=np.float64), index=crsp_key)
+    rets = rets[~rets.index.duplicated()]
+    pieces = []
+    for lag in range(1, holding_days + 1):
+        day = holdings["formation"].to_numpy() + lag
+        h = holdings.assign(
+            day=day,
+            ret=rets.reindex(holdings["permno"].to_numpy() * n_days + day).to_numpy(),
+        )
+        pieces.append(h[day < n_days])
+    held = pd.concat(pieces, ignore_index=True)
+
+    cohort = groupby_weighted_average(
+        data_col="ret",
+        weight_col="weight",
+        by_col=["day", "formation", "quantile"],
+        data=held,
+    )
+    daily = cohort.groupby(level=["day", "quantile"]).mean().unstack("quantile")
+    returns = _finalize(daily, calendar, n_quantiles, long_short="diff")
+
+    # Turnover: cohort formed on d-1 replaces the one formed on d-1-h
+    w = holdings["weight"] / holdings.groupby(["formation", "quantile"])[
+        "weight"
+    ].transform("sum")
+    new = holdings[["permno", "formation", "quantile"]].assign(w_new=w)
+    old = new.rename(columns={"w_new": "w_old"}).assign(
+        formation=new["formation"] + holding_days
+    )
+    both = new.merge(old, on=["permno", "formation", "quantile"], how="outer")
+    formations = np.unique(holdings["formation"])
+    both = both[
+        both["formation"].isin(formations)
+        & both["formation"].isin(formations + holding_days)
+    ]
+    both["change"] = (both["w_new"].fillna(0) - both["w_old"].fillna(0)).abs()
+    turnover = (
+        0.5 * both.groupby(["formation", "quantile"])["change"].sum() / holding_days
+    )
+    turnover = turnover.unstack("quantile")
+    turnover.index = turnover.index + 1  # traded at the start of the next day
+    turnover = _finalize(turnover, calendar, n_quantiles, long_short="sum")
+    return returns, turnover
+
+
+def _finalize(
+    wide: pd.DataFrame, calendar: np.ndarray, n_quantiles: int, long_short: str
+) -> pd.DataFrame:
+    wide = wide.reindex(columns=range(1, n_quantiles + 1))
+    wide.columns = [f"Q{q}" for q in wide.columns]
+    top, bottom = wide[f"Q{n_quantiles}"], wide["Q1"]
+    wide["LS"] = top - bottom if long_short == "diff" else top + bottom
+    wide = wide[wide.index < len(calendar)]
+    wide.index = pd.DatetimeIndex(calendar[wide.index.to_numpy()], name="date")
+    return wide
+
+
+def summarize_backtest(returns: pd.DataFrame, periods_per_year: int = 252):
+    """
+    Annualised mean, volatility and Sharpe ratio of each portfolio.
+    """
+    mean = returns.mean() * periods_per_year
+    vol = returns.std() * np.sqrt(periods_per_year)
+    return pd.DataFrame({"ann_mean": mean, "ann_vol": vol, "sharpe": mean / vol})
+
+
+def run_news_sentiment_backtest(
+    firm_day_path: Optional[Path] = None,
+    crsp_daily_path: Optional[Path] = None,
+    signal_col: str = "css_mean",
+    n_quantiles: int = 5,
+    weighting: str = "equal",
+    holding_days: int = 1,
+    out_path: Optional[Path] = None,
+) -> Path:
+    """
+    Backtest a column of the firm-day news panel and save daily returns.
+    """
+    if firm_day_path is None:
+        firm_day_path = DATA_DIR / "ravenpack_firm_day.parquet"
+    if crsp_daily_path is None:
+        crsp_daily_path = DATA_DIR / "CRSP_DAILY_PAPER_UNIVERSE.parquet"
+    if out_path is None:
+        out_path = (
+            DATA_DIR / f"backtest_{signal_col}_{weighting}_h{holding_days}.parquet"
+        )
+
+    signals = pd.read_parquet(
+        firm_day_path, columns=["permno", "trading_date", signal_col]
+    )
+    crsp = load(
+        "crsp_daily",
+        columns=["permno", "date", "ret", "market_cap"],
+        # All firms are kept: the trading calendar is built from CRSP dates
+        start=signals["trading_date"].min(),
+        path=crsp_daily_path,
+    )
+
+    returns, turnover = quantile_portfolio_backtest(
+        signals,
+        crsp,
+        signal_col=signal_col,
+        n_quantiles=n_quantiles,
+        weighting=weighting,
+        holding_days=holding_days,
+        date_col="trading_date",
+    )
+    print(summarize_backtest(returns))
+    print(f"Average daily turnover:\n{turnover.mean()}")
+
+    out = returns.join(turnover, rsuffix="_turnover")
+    out_path.parent.mkdir(parents=True, exist_ok=True)
+    out.to_parquet(out_path)
+    print(f"Saved backtest -> {out_path}")
+    return out_path
+
+
+def main():
+    run_news_sentiment_backtest(weighting="equal")
+    run_news_sentiment_backtest(weighting="value")
+
+
+if __name__ == "__main__":
+    main()
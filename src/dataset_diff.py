@@ -0,0 +1,307 @@
+"""
+Compare two versions of a Parquet dataset (e.g. `ravenpack_djpr.parquet`
+before and after a WRDS re-pull) without loading either one fully.
+
+Both files are streamed batch by batch. Every row is reduced to a
+fingerprint with the vectorized `pandas.util.hash_pandas_object`:
+
+ - key hash: 128 bits (two 64-bit hashes with different hash keys) of the
+   key columns, or 64 bits with bits=64;
+ - row hash: 64 bits of the compared (non-key) columns;
+ - partition: the year of a timestamp column, or an integer column.
+
+Only these arrays are kept in memory (about 28 bytes per row). Rows sharing
+a key are combined into one order-independent multiset fingerprint. Keys are
+then matched with one sort over both versions and classified as added,
+removed, changed or unchanged. An optional second streaming pass turns the
+hashes of the differing keys back into key values.
+
+Rows hash by value *and* dtype, so a column whose type changed between the
+two versions shows up as changed everywhere. Integer and boolean columns are
+read as pandas nullable dtypes: otherwise a batch with a null would turn
+them into float or object, and the same value would hash differently
+depending on where the batch boundaries fall.
+
+Example:
+
+    python ./src/dataset_diff.py --DIFF_OLD=/path/to/old.parquet \
+        --DIFF_NEW=/path/to/new.parquet
+"""
+
+from __future__ import annotations
+
+from pathlib import Path
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from settings import config
+
+DATA_DIR = Path(config("DATA_DIR"))
+
+RAVENPACK_KEYS = ["rp_story_id", "rp_entity_id"]
+
+# hash_pandas_object needs 16-character hash keys
+_HASH_KEYS = ("0123456789123456", "p17-dataset-diff")
+STATUSES = ["added", "removed", "changed", "unchanged"]
+
+# Arrow type -> pandas dtype that keeps the type when a batch has nulls
+_NULLABLE_DTYPES = {
+    pa.int8(): pd.Int8Dtype(),
+    pa.int16(): pd.Int16Dtype(),
+    pa.int32(): pd.Int32Dtype(),
+    pa.int64(): pd.Int64Dtype(),
+    pa.uint8(): pd.UInt8Dtype(),
+    pa.uint16(): pd.UInt16Dtype(),
+    pa.uint32(): pd.UInt32Dtype(),
+    pa.uint64(): pd.UInt64Dtype(),
+    pa.bool_(): pd.BooleanDtype(),
+}
+
+
+def _hash(frame: pd.DataFrame, hash_key: str) -> np.ndarray:
+    return pd.util.hash_pandas_object(frame, index=False, hash_key=hash_key).to_numpy()
+
+
+def _partition_values(series: Optional[pd.Series], n: int) -> np.ndarray:
+    if series is None:
+        return np.zeros(n, dtype=np.int64)
+    if pd.api.types.is_datetime64_any_dtype(series):
+        return series.dt.year.fillna(-1).to_numpy(dtype=np.int64)
+    return pd.to_numeric(series, errors="coerce").fillna(-1).to_numpy(dtype=np.int64)
+
+
+def fingerprint_frame(
+    df: pd.DataFrame,
+    key_columns: Sequence[str],
+    value_columns: Sequence[str],
+    partition_col: Optional[str] = None,
+    bits: int = 128,
+) -> Dict[str, np.ndarray]:
+    """
+    Key hashes (hi, lo), row hash and partition of each row.
+    """
+    keys = df[list(key_columns)]
+    hi = _hash(keys, _HASH_KEYS[0])
+    lo = _hash(keys, _HASH_KEYS[1]) if bits == 128 else np.zeros_like(hi)
+    if value_columns:
+        row = _hash(df[list(value_columns)], _HASH_KEYS[0])
+    else:
+        row = np.zeros_like(hi)
+    part = _partition_values(
+        df[partition_col] if partition_col is not None else None, len(df)
+    )
+    return {"hi": hi, "lo": lo, "row": row, "partition": part}
+
+
+def _iter_frames(path: Path, columns: List[str], batch_size: int):
+    pf = pq.ParquetFile(path)
+    for batch in pf.iter_batches(batch_size=batch_size, columns=columns):
+        yield batch.to_pandas(types_mapper=_NULLABLE_DTYPES.get)
+
+
+def fingerprint_dataset(
+    path: Path,
+    key_columns: Sequence[str],
+    value_columns: Sequence[str],
+    partition_col: Optional[str] = None,
+    bits: int = 128,
+    batch_size: int = 1_000_000,
+) -> Dict[str, np.ndarray]:
+    """
+    Stream a Parquet file and return one fingerprint per distinct key, sorted
+    by key. Duplicate keys are folded into a wrapping sum of their row hashes.
+    """
+    columns = list(dict.fromkeys([*key_columns, *value_columns]))
+    if partition_col is not None and partition_col not in columns:
+        columns.append(partition_col)
+
+    parts: Dict[str, list] = {"hi": [], "lo": [], "row": [], "partition": []}
+    for df in _iter_frames(path, columns, batch_size):
+        fp = fingerprint_frame(df, key_columns, value_columns, partition_col, bits)
+        for name, values in fp.items():
+            parts[name].append(values)
+    fp = {
+        name: (
+            np.concatenate(values)
+            if values
+            else np.zeros(0, dtype=np.int64 if name == "partition" else np.uint64)
+        )
+        for name, values in parts.items()
+    }
+
+    order = np.lexsort((fp["lo"], fp["hi"]))
+    fp = {name: values[order] for name, values in fp.items()}
+    n = len(order)
+    if n == 0:
+        return fp
+    start = np.flatnonzero(
+        np.r_[True, (fp["hi"][1:] != fp["hi"][:-1]) | (fp["lo"][1:] != fp["lo"][:-1])]
+    )
+    with np.errstate(over="ignore"):
+        row = np.add.reduceat(fp["row"], start)
+    return {
+        "hi": fp["hi"][start],
+        "lo": fp["lo"][start],
+        "row": row,
+        "partition": fp["partition"][start],
+    }
+
+
+def diff_fingerprints(
+    old: Dict[str, np.ndarray], new: Dict[str, np.ndarray]
+) -> pd.DataFrame:
+    """
+    Classify every key of either version. Both inputs must have unique keys.
+
+    Returns key_hi, key_lo, partition (new version, else old) and status.
+    """
+    n_old = len(old["hi"])
+    hi = np.concatenate([old["hi"], new["hi"]])
+    lo = np.concatenate([old["lo"], new["lo"]])
+    row = np.concatenate([old["row"], new["row"]])
+    part = np.concatenate([old["partition"], new["partition"]])
+    side = np.r_[np.zeros(n_old, dtype=np.int8), np.ones(len(new["hi"]), np.int8)]
+
+    order = np.lexsort((side, lo, hi))
+    hi, lo, row, part, side = (a[order] for a in (hi, lo, row, part, side))
+
+    # A key present in both versions shows up as an (old, new) adjacent pair
+    pair = (hi[1:] == hi[:-1]) & (lo[1:] == lo[:-1])
+    first = np.r_[pair, False]  # old row of a pair
+    second = np.r_[False, pair]  # new row of a pair
+
+    status = np.where(side == 1, "added", "removed").astype(object)
+    status[second] = np.where(row[second] == row[first], "unchanged", "changed")
+    keep = ~first
+    return pd.DataFrame(
+        {
+            "key_hi": hi[keep],
+            "key_lo": lo[keep],
+            "partition": part[keep],
+            "status": pd.Categorical(status[keep], categories=STATUSES),
+        }
+    )
+
+
+def summarize_diff(status: pd.DataFrame) -> pd.DataFrame:
+    """
+    Number of keys by partition and status.
+    """
+    summary = pd.crosstab(status["partition"], status["status"], dropna=False)
+    summary = summary.reindex(columns=STATUSES, fill_value=0)
+    summary.loc["total"] = summary.sum()
+    return summary
+
+
+def _collect_keys(
+    path: Path,
+    key_columns: Sequence[str],
+    status: pd.DataFrame,
+    bits: int,
+    batch_size: int,
+) -> pd.DataFrame:
+    """
+    Second pass: key values of the rows whose key hash appears in `status`.
+    """
+    wanted_hi = np.unique(status["key_hi"].to_numpy())
+    frames = []
+    for df in _iter_frames(path, list(key_columns), batch_size):
+        hi = _hash(df, _HASH_KEYS[0])
+        hit = np.isin(hi, wanted_hi)
+        if not hit.any():
+            continue
+        df = df[hit].copy()
+        df["key_hi"] = hi[hit]
+        df["key_lo"] = (
+            _hash(df[list(key_columns)], _HASH_KEYS[1])
+            if bits == 128
+            else np.zeros(len(df), np.uint64)
+        )
+        frames.append(df.merge(status, on=["key_hi", "key_lo"]))
+    if not frames:
+        return pd.DataFrame(columns=[*key_columns, "partition", "status"])
+    keys = pd.concat(frames, ignore_index=True)
+    keys = keys.drop_duplicates(subset=["key_hi", "key_lo"])
+    return keys[[*key_columns, "partition", "status"]].reset_index(drop=True)
+
+
+def diff_parquet_datasets(
+    old_path: Path,
+    new_path: Path,
+    key_columns: Sequence[str] = RAVENPACK_KEYS,
+    partition_col: Optional[str] = "timestamp_utc",
+    value_columns: Optional[Sequence[str]] = None,
+    bits: int = 128,
+    batch_size: int = 1_000_000,
+    collect_keys: bool = True,
+) -> Tuple[pd.DataFrame, Optional[pd.DataFrame]]:
+    """
+    Diff two Parquet files on `key_columns`.
+
+    value_columns defaults to every column the two files have in common
+    (other than the keys). Returns (summary by partition, differing keys);
+    the second item is None when collect_keys=False.
+    """
+    if bits not in {64, 128}:
+        raise ValueError("bits must be 64 or 128")
+    old_names = pq.ParquetFile(old_path).schema_arrow.names
+    new_names = pq.ParquetFile(new_path).schema_arrow.names
+    if value_columns is None:
+        value_columns = [
+            c for c in old_names if c in new_names and c not in key_columns
+        ]
+        only = sorted(set(old_names) ^ set(new_names))
+        if only:
+            print(f"Columns in only one version (not compared): {only}")
+
+    old = fingerprint_dataset(
+        old_path, key_columns, value_columns, partition_col, bits, batch_size
+    )
+    new = fingerprint_dataset(
+        new_path, key_columns, value_columns, partition_col, bits, batch_size
+    )
+    status = diff_fingerprints(old, new)
+    summary = summarize_diff(status)
+    if not collect_keys:
+        return summary, None
+
+    differing = status[status["status"] != "unchanged"]
+    keys = pd.concat(
+        [
+            _collect_keys(
+                old_path,
+                key_columns,
+                differing[differing["status"] == "removed"],
+                bits,
+                batch_size,
+            ),
+            _collect_keys(
+                new_path,
+                key_columns,
+                differing[differing["status"] != "removed"],
+                bits,
+                batch_size,
+            ),
+        ],
+        ignore_index=True,
+    )
+    return summary, keys
+
+
+if __name__ == "__main__":
+    old_path = Path(config("DIFF_OLD"))
+    new_path = Path(
+        config("DIFF_NEW", default=str(DATA_DIR / "ravenpack_djpr.parquet"))
+    )
+    summary, keys = diff_parquet_datasets(old_path, new_path)
+    print(summary)
+
+    out_dir = DATA_DIR / "dataset_diff"
+    out_dir.mkdir(parents=True, exist_ok=True)
+    summary.to_csv(out_dir / f"{new_path.stem}_summary.csv")
+    keys.to_parquet(out_dir / f"{new_path.stem}_keys.parquet", index=False)
+    print(f"Saved diff -> {out_dir}")
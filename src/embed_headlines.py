@@ -0,0 +1,360 @@
+"""
+Turn RavenPack headlines into vectors for the Chen, Kelly, and Xiu (2022)
+return-prediction models.
+
+Headlines are deduplicated by a 64-bit hash, so each distinct headline is
+encoded exactly once. Vectors are stored as float16 in a memory-mapped `.npy`
+file whose row number is the headline id:
+
+    _data/headline_embeddings/<encoder>/
+        embeddings.npy          float16 (n_headlines, dim), row = headline_id
+        headline_index.parquet  headline_hash -> headline_id
+        story_headline.parquet  rp_story_id -> headline_id
+
+Re-runs only encode headlines whose hash is not in the index yet. Downstream
+code should open the matrix with `load_headline_embeddings`, which memory-maps
+it read-only, so slicing rows never loads the whole matrix.
+
+Two encoders are supported:
+ - "hashing": signed feature hashing of word unigrams and bigrams (no
+   dependencies, deterministic).
+ - a path or name of a locally available sentence-transformers model
+   (requires the optional `sentence-transformers` package).
+"""
+
+from __future__ import annotations
+
+import os
+import re
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import nullcontext
+from itertools import pairwise
+from pathlib import Path
+from typing import Iterator, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from settings import config
+
+DATA_DIR = Path(config("DATA_DIR"))
+EMBEDDING_DIR = DATA_DIR / "headline_embeddings"
+
+HASHING_DIM = 512
+_TOKEN_RE = re.compile(r"[a-z0-9]+")
+
+# Per-process model cache so each pool worker loads the model once
+_MODEL_CACHE = {}
+
+
+def tokenize_headline(text: str) -> List[str]:
+    """
+    Lower-case word tokens of a headline.
+
+    >>> tokenize_headline("Apple Q3 EPS beats; shares up 5%")
+    ['apple', 'q3', 'eps', 'beats', 'shares', 'up', '5']
+    """
+    if not isinstance(text, str):
+        return []
+    return _TOKEN_RE.findall(text.lower())
+
+
+def hash_headlines(headlines) -> np.ndarray:
+    """
+    Stable 64-bit hash of each headline (after trimming whitespace).
+    Missing headlines hash like the empty string.
+    """
+    values = pd.Series(headlines, dtype="object").fillna("").str.strip()
+    return pd.util.hash_array(values.to_numpy(dtype=object))
+
+
+def encode_hashing(texts: List[str], dim: int = HASHING_DIM) -> np.ndarray:
+    """
+    Signed feature hashing of unigrams and bigrams, L2-normalised.
+
+    The sign of each feature comes from the top bit of its hash, which keeps
+    collisions unbiased in inner products.
+    """
+    rows, tokens = [], []
+    for i, text in enumerate(texts):
+        words = tokenize_headline(text)
+        grams = words + [f"{a} {b}" for a, b in pairwise(words)]
+        rows.extend([i] * len(grams))
+        tokens.extend(grams)
+
+    out = np.zeros((len(texts), dim), dtype=np.float32)
+    if tokens:
+        h = pd.util.hash_array(np.asarray(tokens, dtype=object))
+        col = (h % np.uint64(dim)).astype(np.int64)
+        sign = np.where(h >> np.uint64(63), -1.0, 1.0)
+        flat = np.bincount(
+            np.asarray(rows, dtype=np.int64) * dim + col,
+            weights=sign,
+            minlength=len(texts) * dim,
+        )
+        out[:] = flat.reshape(len(texts), dim)
+    norms = np.linalg.norm(out, axis=1, keepdims=True)
+    np.divide(out, norms, out=out, where=norms > 0)
+    return out
+
+
+def encode_sentence_transformer(texts: List[str], model_name: str) -> np.ndarray:
+    """
+    Encode with a locally available sentence-transformers model.
+    """
+    model = _MODEL_CACHE.get(model_name)
+    if model is None:
+        try:
+            from sentence_transformers import SentenceTransformer
+        except ImportError as e:
+            raise ImportError(
+                "Encoding with a language model requires `sentence-transformers`. "
+                "Install it or use encoder='hashing'."
+            ) from e
+        model = SentenceTransformer(model_name, device="cpu")
+        _MODEL_CACHE[model_name] = model
+    return model.encode(
+        list(texts), batch_size=256, normalize_embeddings=True, show_progress_bar=False
+    )
+
+
+def encode_headlines(texts: List[str], encoder: str = "hashing") -> np.ndarray:
+    """
+    Encode a batch of headlines with the named encoder.
+    """
+    if encoder == "hashing":
+        return encode_hashing(texts)
+    return encode_sentence_transformer(texts, encoder)
+
+
+def _encode_batch(args: Tuple[np.ndarray, List[str], str]):
+    ids, texts, encoder = args
+    return ids, encode_headlines(texts, encoder).astype(np.float16)
+
+
+def encoder_dir(encoder: str = "hashing", embedding_dir: Path = EMBEDDING_DIR) -> Path:
+    """
+    Cache directory for an encoder (model paths are reduced to their name).
+    """
+    if encoder == "hashing":
+        name = f"hashing{HASHING_DIM}"
+    else:
+        name = re.sub(r"[^A-Za-z0-9_.-]+", "_", Path(encoder).name)
+    return Path(embedding_dir) / name
+
+
+def load_headline_index(
+    encoder: str = "hashing", embedding_dir: Path = EMBEDDING_DIR
+) -> pd.DataFrame:
+    """
+    Load the headline_hash -> headline_id index (empty if nothing cached yet).
+    """
+    path = encoder_dir(encoder, embedding_dir) / "headline_index.parquet"
+    if not path.exists():
+        return pd.DataFrame(
+            {
+                "headline_hash": pd.Series(dtype="uint64"),
+                "headline_id": pd.Series(dtype="int64"),
+            }
+        )
+    return pd.read_parquet(path)
+
+
+def load_headline_embeddings(
+    encoder: str = "hashing",
+    embedding_dir: Path = EMBEDDING_DIR,
+    mmap_mode: str = "r",
+) -> np.ndarray:
+    """
+    Memory-map the embedding matrix. Rows are headline ids.
+
+    Slices such as `emb[a:b]` are views on the file, so only the touched
+    pages are read.
+    """
+    path = encoder_dir(encoder, embedding_dir) / "embeddings.npy"
+    return np.load(path, mmap_mode=mmap_mode)
+
+
+def load_story_headline_ids(
+    encoder: str = "hashing", embedding_dir: Path = EMBEDDING_DIR
+) -> pd.DataFrame:
+    """
+    Load the rp_story_id -> headline_id map.
+    """
+    path = encoder_dir(encoder, embedding_dir) / "story_headline.parquet"
+    return pd.read_parquet(path)
+
+
+def _grow_embedding_file(
+    path: Path, n_rows: int, dim: int, copy_chunk: int = 1_000_000
+):
+    """
+    Return a writable memmap with `n_rows` rows, keeping any existing rows.
+    """
+    if not path.exists():
+        return np.lib.format.open_memmap(
+            path, mode="w+", dtype=np.float16, shape=(n_rows, dim)
+        )
+
+    old = np.load(path, mmap_mode="r")
+    if old.shape[1] != dim:
+        raise ValueError(
+            f"Cached embeddings in {path} have dim {old.shape[1]}, expected {dim}"
+        )
+    if old.shape[0] == n_rows:
+        del old
+        return np.lib.format.open_memmap(path, mode="r+")
+
+    tmp_path = path.with_suffix(".tmp.npy")
+    new = np.lib.format.open_memmap(
+        tmp_path, mode="w+", dtype=np.float16, shape=(n_rows, dim)
+    )
+    for start in range(0, old.shape[0], copy_chunk):
+        stop = min(start + copy_chunk, old.shape[0])
+        new[start:stop] = old[start:stop]
+    new.flush()
+    del new, old
+    os.replace(tmp_path, path)
+    return np.lib.format.open_memmap(path, mode="r+")
+
+
+def _iter_headline_batches(
+    ravenpack_path: Path, batch_size: int
+) -> Iterator[pd.DataFrame]:
+    pf = pq.ParquetFile(ravenpack_path)
+    for batch in pf.iter_batches(
+        batch_size=batch_size, columns=["rp_story_id", "headline"]
+    ):
+        yield batch.to_pandas()
+
+
+def _bounded_map(executor, fn, items, max_pending: int):
+    """Like executor.map, but never queues more than `max_pending` items."""
+    pending = []
+    for item in items:
+        pending.append(executor.submit(fn, item))
+        if len(pending) >= max_pending:
+            yield pending.pop(0).result()
+    for fut in pending:
+        yield fut.result()
+
+
+def embed_headlines(
+    ravenpack_path: Optional[Path] = None,
+    encoder: str = "hashing",
+    embedding_dir: Path = EMBEDDING_DIR,
+    encode_batch_size: int = 4096,
+    read_batch_size: int = 1_000_000,
+    n_jobs: Optional[int] = None,
+) -> Path:
+    """
+    Encode every distinct RavenPack headline not yet in the cache.
+
+    Pass 1 hashes headlines to find new ones and sizes the memmap once.
+    Pass 2 streams the file again, sends new headlines to a process pool in
+    batches of `encode_batch_size`, and writes the vectors in place. With
+    `n_jobs=1` the batches are encoded in this process.
+    """
+    if ravenpack_path is None:
+        ravenpack_path = DATA_DIR / "ravenpack_djpr.parquet"
+    if n_jobs is None:
+        n_jobs = os.cpu_count() or 1
+
+    out_dir = encoder_dir(encoder, embedding_dir)
+    out_dir.mkdir(parents=True, exist_ok=True)
+    index = load_headline_index(encoder, embedding_dir)
+
+    # Pass 1: story -> hash, and the set of hashes that still need vectors
+    story_ids, story_hashes = [], []
+    for df in _iter_headline_batches(ravenpack_path, read_batch_size):
+        story_ids.append(df["rp_story_id"].to_numpy(dtype=object))
+        story_hashes.append(hash_headlines(df["headline"]))
+    story_ids = np.concatenate(story_ids) if story_ids else np.array([], dtype=object)
+    story_hashes = (
+        np.concatenate(story_hashes) if story_hashes else np.array([], dtype=np.uint64)
+    )
+
+    known = index["headline_hash"].to_numpy(dtype=np.uint64)
+    unique_hashes = np.unique(story_hashes)
+    new_hashes = unique_hashes[~np.isin(unique_hashes, known)]
+    n_old = len(known)
+    new_index = pd.DataFrame(
+        {
+            "headline_hash": new_hashes,
+            "headline_id": np.arange(n_old, n_old + len(new_hashes), dtype=np.int64),
+        }
+    )
+    index = pd.concat([index, new_index], ignore_index=True)
+    print(f"{len(unique_hashes):,} distinct headlines, {len(new_hashes):,} new")
+
+    # Pass 2: encode the first occurrence of each new headline
+    if len(new_hashes):
+        dim = len(encode_headlines(["dimension probe"], encoder)[0])
+        emb = _grow_embedding_file(out_dir / "embeddings.npy", len(index), dim)
+
+        def batches():
+            seen = np.zeros(len(new_hashes), dtype=bool)
+            ids, texts = [], []
+            for df in _iter_headline_batches(ravenpack_path, read_batch_size):
+                h = hash_headlines(df["headline"])
+                pos = np.searchsorted(new_hashes, h)
+                pos[pos >= len(new_hashes)] = 0
+                hit = new_hashes[pos] == h
+                first = np.zeros(len(h), dtype=bool)
+                _, first_idx = np.unique(pos[hit], return_index=True)
+                first[np.flatnonzero(hit)[first_idx]] = True
+                first &= ~seen[pos]
+                seen[pos[first]] = True
+                ids.extend(n_old + pos[first])
+                texts.extend(df["headline"].fillna("").str.strip().to_numpy()[first])
+                while len(ids) >= encode_batch_size:
+                    yield (
+                        np.asarray(ids[:encode_batch_size]),
+                        texts[:encode_batch_size],
+                        encoder,
+                    )
+                    ids, texts = ids[encode_batch_size:], texts[encode_batch_size:]
+            if ids:
+                yield np.asarray(ids), texts, encoder
+
+        done = 0
+        pool = ProcessPoolExecutor(max_workers=n_jobs) if n_jobs > 1 else nullcontext()
+        with pool as executor:
+            results = (
+                _bounded_map(executor, _encode_batch, batches(), max_pending=2 * n_jobs)
+                if executor is not None
+                else map(_encode_batch, batches())
+            )
+            for ids, vectors in results:
+                emb[ids] = vectors
+                done += len(ids)
+                if done % (50 * encode_batch_size) < len(ids):
+                    print(f"  encoded {done:,}/{len(new_hashes):,}")
+        emb.flush()
+        del emb
+
+    # Index is written last so an interrupted run is simply redone
+    index.to_parquet(out_dir / "headline_index.parquet", index=False)
+
+    story_map = pd.DataFrame({"rp_story_id": story_ids, "headline_hash": story_hashes})
+    story_map = story_map.drop_duplicates("rp_story_id").merge(
+        index, on="headline_hash", how="left"
+    )
+    pq.write_table(
+        pa.Table.from_pandas(
+            story_map[["rp_story_id", "headline_id"]], preserve_index=False
+        ),
+        out_dir / "story_headline.parquet",
+    )
+    print(f"Saved headline embeddings -> {out_dir}")
+    return out_dir
+
+
+def main(encoder: Optional[str] = None):
+    embed_headlines(encoder=encoder or config("EMBEDDING_MODEL", default="hashing"))
+
+
+if __name__ == "__main__":
+    main()
@@ -3,101 +3,206 @@ Generate simple exploratory charts to verify data pulls.
 
 Outputs interactive HTML charts to _output/.
 These are sanity-check plots, not final analysis.
+
+Charts read the daily summary cube (see `summary_cube.py`), never the raw
+Parquet files. Distributions are drawn as pre-binned bars from exact counts,
+and long daily series are thinned with Largest-Triangle-Three-Buckets
+(`misc_tools.lttb_downsample`), so the HTML files only embed a few thousand
+points and load plotly.js from the CDN.
+
+Every chart is registered in CHARTS with the cube tables and columns it
+reads. A chart is only re-rendered when the footer fingerprint of those
+inputs (see `parquet_fingerprint.py`) or this file changed since its last
+render; the remaining charts are rendered in a process pool.
 """
 
+import hashlib
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor
 from pathlib import Path
+from typing import Dict, List, Optional
 
 import pandas as pd
 import plotly.express as px
+import plotly.graph_objects as go
 
+from misc_tools import lttb_downsample
+from parquet_fingerprint import inputs_fingerprint
 from settings import config
+from summary_cube import CUBE_DIR, load_cube, sentiment_bin_edges
 
 DATA_DIR = Path(config("DATA_DIR"))
 OUTPUT_DIR = Path(config("OUTPUT_DIR"))
 
 OUTPUT_DIR.mkdir(parents=True, exist_ok=True)
 
+MAX_LINE_POINTS = 1500
+FINGERPRINT_FILE = OUTPUT_DIR / "_chart_fingerprints.json"
+
+
+# ------------------------------------------------------------
+# Helpers
+# ------------------------------------------------------------
+def line_chart(
+    df: pd.DataFrame, x: str, y: str, title: str, max_points=MAX_LINE_POINTS
+):
+    """Line chart of a series thinned to at most `max_points` points with LTTB."""
+    df = df.dropna(subset=[x, y])
+    keep = lttb_downsample(df[x].to_numpy(), df[y].to_numpy(), max_points)
+    return px.line(df.iloc[keep], x=x, y=y, title=title)
+
+
+def binned_bar_chart(hist: pd.DataFrame, x_title: str, title: str):
+    """Bar chart of pre-binned counts (columns left, right, count)."""
+    fig = go.Figure(
+        go.Bar(
+            x=(hist["left"] + hist["right"]) / 2,
+            y=hist["count"],
+            width=hist["right"] - hist["left"],
+        )
+    )
+    fig.update_layout(title=title, xaxis_title=x_title, yaxis_title="count", bargap=0)
+    return fig
+
+
+def save_chart(fig, name: str) -> Path:
+    out = OUTPUT_DIR / name
+    fig.write_html(out, include_plotlyjs="cdn")
+    print(f"Saved {out}")
+    return out
+
 
 # ------------------------------------------------------------
 # CRSP: Average market cap over time
 # ------------------------------------------------------------
 def chart_crsp_market_cap():
-    path = DATA_DIR / "CRSP_DAILY_PAPER_UNIVERSE.parquet"
-    df = pd.read_parquet(path, columns=["date", "market_cap"])
-
-    daily = (
-        df.groupby("date", as_index=False)["market_cap"]
-        .mean()
-        .rename(columns={"market_cap": "avg_market_cap"})
+    daily = load_cube("crsp_daily").rename(
+        columns={"market_cap_mean": "avg_market_cap"}
     )
 
-    fig = px.line(
+    fig = line_chart(
         daily,
         x="date",
         y="avg_market_cap",
         title="CRSP: Average Market Capitalization (Daily)",
     )
-
-    out = OUTPUT_DIR / "crsp_avg_market_cap.html"
-    fig.write_html(out)
-    print(f"Saved {out}")
+    save_chart(fig, "crsp_avg_market_cap.html")
 
 
 # ------------------------------------------------------------
 # RavenPack: Daily article counts
 # ------------------------------------------------------------
 def chart_ravenpack_volume():
-    path = DATA_DIR / "ravenpack_djpr.parquet"
-    df = pd.read_parquet(path, columns=["timestamp_utc"])
-
-    df["date"] = pd.to_datetime(df["timestamp_utc"]).dt.normalize()
-    daily = (
-        df.groupby("date")
-        .size()
-        .reset_index(name="article_count")
-    )
+    daily = load_cube("ravenpack_daily").rename(columns={"n_articles": "article_count"})
 
-    fig = px.line(
+    fig = line_chart(
         daily,
         x="date",
         y="article_count",
         title="RavenPack: Daily Article Volume (US, Single-Firm)",
     )
-
-    out = OUTPUT_DIR / "ravenpack_daily_volume.html"
-    fig.write_html(out)
-    print(f"Saved {out}")
+    save_chart(fig, "ravenpack_daily_volume.html")
 
 
 # ------------------------------------------------------------
 # RavenPack x CRSP: Event sentiment distribution
 # ------------------------------------------------------------
 def chart_sentiment_distribution():
-    path = DATA_DIR / "ravenpack_crsp_merged.parquet"
-    df = pd.read_parquet(path, columns=["event_sentiment_score"])
-
-    df = df[df["event_sentiment_score"].notna()]
+    hist = load_cube("sentiment_hist").groupby("bin", as_index=False)["count"].sum()
+    hist = sentiment_bin_edges().merge(hist, on="bin", how="left").fillna({"count": 0})
+
+    # Exact counts over the full sample (no sampling needed)
+    fig = binned_bar_chart(
+        hist,
+        x_title="event_sentiment_score",
+        title="RavenPack Event Sentiment Score Distribution",
+    )
+    save_chart(fig, "ravenpack_sentiment_distribution.html")
 
-    # SAMPLE to keep HTML size reasonable
-    if len(df) > 2_000_000:
-        df = df.sample(2_000_000, random_state=0)
 
-    fig = px.histogram(
-        df,
-        x="event_sentiment_score",
-        nbins=100,
-        title="RavenPack Event Sentiment Score Distribution (Sampled)",
+# ------------------------------------------------------------
+# Registry
+# ------------------------------------------------------------
+# name -> render function, {cube table: columns read}, output file
+CHARTS = {
+    "crsp_avg_market_cap": {
+        "render": chart_crsp_market_cap,
+        "inputs": {"crsp_daily": ["date", "market_cap_mean"]},
+        "output": "crsp_avg_market_cap.html",
+    },
+    "ravenpack_daily_volume": {
+        "render": chart_ravenpack_volume,
+        "inputs": {"ravenpack_daily": ["date", "n_articles"]},
+        "output": "ravenpack_daily_volume.html",
+    },
+    "ravenpack_sentiment_distribution": {
+        "render": chart_sentiment_distribution,
+        "inputs": {"sentiment_hist": ["bin", "count"]},
+        "output": "ravenpack_sentiment_distribution.html",
+    },
+}
+
+
+def chart_fingerprint(name: str) -> str:
+    """Fingerprint of a chart's input columns and of this module."""
+    inputs = {CUBE_DIR / table: cols for table, cols in CHARTS[name]["inputs"].items()}
+    code = hashlib.sha256(Path(__file__).read_bytes()).hexdigest()
+    return f"{code[:16]}-{inputs_fingerprint(inputs)}"
+
+
+def _render(name: str) -> str:
+    CHARTS[name]["render"]()
+    return name
+
+
+def generate_charts(
+    names: Optional[List[str]] = None,
+    force: bool = False,
+    max_workers: Optional[int] = None,
+) -> List[str]:
+    """
+    Render the charts (all registered ones by default) whose inputs changed,
+    in parallel. Returns the names of the rendered charts.
+    """
+    names = list(CHARTS) if names is None else names
+    previous: Dict[str, str] = (
+        json.loads(FINGERPRINT_FILE.read_text()) if FINGERPRINT_FILE.exists() else {}
     )
 
-    out = OUTPUT_DIR / "ravenpack_sentiment_distribution.html"
-    fig.write_html(out, include_plotlyjs="cdn")  # also reduces file size
-    print(f"Saved {out}")
+    fingerprints = {name: chart_fingerprint(name) for name in names}
+    todo = [
+        name
+        for name in names
+        if force
+        or previous.get(name) != fingerprints[name]
+        or not (OUTPUT_DIR / CHARTS[name]["output"]).exists()
+    ]
+    for name in names:
+        if name not in todo:
+            print(f"Skipping {name} (inputs unchanged)")
+
+    rendered: List[str] = []
+    try:
+        if len(todo) == 1:
+            rendered.append(_render(todo[0]))
+        elif todo:
+            workers = min(len(todo), max_workers or os.cpu_count() or 1)
+            with ProcessPoolExecutor(max_workers=workers) as pool:
+                rendered.extend(pool.map(_render, todo))
+    finally:
+        # Record the charts that did render, even if another one failed
+        previous.update({name: fingerprints[name] for name in rendered})
+        FINGERPRINT_FILE.write_text(json.dumps(previous, indent=1, sort_keys=True))
+    return rendered
 
 
 # ------------------------------------------------------------
 # Main
 # ------------------------------------------------------------
+def main():
+    generate_charts()
+
+
 if __name__ == "__main__":
-    chart_crsp_market_cap()
-    chart_ravenpack_volume()
-    chart_sentiment_distribution()
\ No newline at end of file
+    main()
@@ -0,0 +1,248 @@
+"""
+Streaming sparse document-term matrix (DTM) of RavenPack headlines for the
+bag-of-words baselines.
+
+Headlines are read one calendar year at a time (one row per rp_story_id),
+tokenized across a process pool, and appended as a CSR chunk per year:
+
+    _data/headline_dtm/<mode>/
+        dtm_<year>.npz            scipy CSR counts, one row per story
+        stories_<year>.parquet    rp_story_id, rp_entity_id, timestamp_utc (row order)
+        vocabulary.parquet        token -> term_id (vocabulary mode only)
+
+Two column spaces are supported:
+ - mode="vocab": the vocabulary grows as new tokens appear. Term ids are only
+   ever appended, so chunks written earlier stay valid and a re-run only
+   builds missing years.
+ - mode="hashing": tokens are hashed into `HASHING_FEATURES` columns, so
+   no vocabulary has to be kept and years can be built independently.
+
+`load_headline_dtm` stacks the yearly chunks into one matrix aligned with
+`load_headline_dtm_stories`.
+"""
+
+from __future__ import annotations
+
+import os
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import List, Optional, Sequence, Tuple
+
+import numpy as np
+import pandas as pd
+import pyarrow.parquet as pq
+import scipy.sparse as sp
+
+from embed_headlines import tokenize_headline
+from settings import config
+
+DATA_DIR = Path(config("DATA_DIR"))
+DTM_DIR = DATA_DIR / "headline_dtm"
+
+HASHING_FEATURES = 2**20
+
+
+def headline_terms(text: str, ngram_max: int = 1) -> List[str]:
+    """
+    Word n-grams of a headline, from unigrams up to `ngram_max`.
+
+    >>> headline_terms("Fed cuts rates", ngram_max=2)
+    ['fed', 'cuts', 'rates', 'fed cuts', 'cuts rates']
+    """
+    words = tokenize_headline(text)
+    terms = list(words)
+    for n in range(2, ngram_max + 1):
+        terms += [" ".join(words[i : i + n]) for i in range(len(words) - n + 1)]
+    return terms
+
+
+def _tokenize_chunk(args: Tuple[Sequence[str], int, Optional[int]]):
+    """
+    Worker: flatten the terms of a chunk of headlines.
+
+    Returns (indptr, terms) in vocabulary mode and (indptr, column ids) when
+    `n_features` is given (hashing mode).
+    """
+    headlines, ngram_max, n_features = args
+    indptr = np.zeros(len(headlines) + 1, dtype=np.int64)
+    terms: List[str] = []
+    for i, text in enumerate(headlines):
+        terms.extend(headline_terms(text, ngram_max))
+        indptr[i + 1] = len(terms)
+    terms = np.asarray(terms, dtype=object)
+    if n_features is None:
+        return indptr, terms
+    cols = pd.util.hash_array(terms) % np.uint64(n_features)
+    return indptr, cols.astype(np.int64)
+
+
+def _csr_from_columns(indptr: np.ndarray, cols: np.ndarray, n_cols: int):
+    """Counts matrix from per-row column ids (duplicates are summed)."""
+    data = np.ones(len(cols), dtype=np.int32)
+    m = sp.csr_matrix((data, cols, indptr), shape=(len(indptr) - 1, n_cols))
+    m.sum_duplicates()
+    return m
+
+
+def load_vocabulary(out_dir: Path) -> pd.DataFrame:
+    """
+    Load token -> term_id, or an empty vocabulary.
+    """
+    path = Path(out_dir) / "vocabulary.parquet"
+    if path.exists():
+        return pd.read_parquet(path)
+    return pd.DataFrame(
+        {"token": pd.Series(dtype=object), "term_id": pd.Series(dtype="int64")}
+    )
+
+
+def _read_year_headlines(path: Path, year: int) -> pd.DataFrame:
+    table = pq.read_table(
+        path,
+        columns=["rp_story_id", "rp_entity_id", "timestamp_utc", "headline"],
+        filters=[
+            ("timestamp_utc", ">=", pd.Timestamp(f"{year}-01-01")),
+            ("timestamp_utc", "<", pd.Timestamp(f"{year + 1}-01-01")),
+        ],
+    )
+    df = table.to_pandas().drop_duplicates(subset=["rp_story_id"])
+    return df.sort_values(["timestamp_utc", "rp_story_id"]).reset_index(drop=True)
+
+
+def build_headline_dtm(
+    ravenpack_path: Optional[Path] = None,
+    mode: str = "vocab",
+    start_year: int = 2000,
+    end_year: int = 2019,
+    ngram_max: int = 1,
+    n_features: int = HASHING_FEATURES,
+    chunk_size: int = 50_000,
+    n_jobs: Optional[int] = None,
+    force: bool = False,
+    dtm_dir: Path = DTM_DIR,
+) -> Path:
+    """
+    Build (or extend) the yearly DTM chunks.
+
+    Years whose chunk already exists are skipped unless force=True. Forcing a
+    rebuild in vocabulary mode starts a fresh vocabulary, so it should cover
+    every year that is later loaded together.
+    """
+    if mode not in {"vocab", "hashing"}:
+        raise ValueError("mode must be 'vocab' or 'hashing'")
+    if ravenpack_path is None:
+        ravenpack_path = DATA_DIR / "ravenpack_djpr.parquet"
+    if n_jobs is None:
+        n_jobs = os.cpu_count() or 1
+
+    out_dir = Path(dtm_dir) / mode
+    out_dir.mkdir(parents=True, exist_ok=True)
+
+    vocab = {}
+    if mode == "vocab" and not force:
+        v = load_vocabulary(out_dir)
+        vocab = dict(zip(v["token"], v["term_id"]))
+    hash_space = n_features if mode == "hashing" else None
+
+    with ProcessPoolExecutor(max_workers=n_jobs) as executor:
+        for year in range(start_year, end_year + 1):
+            dtm_path = out_dir / f"dtm_{year}.npz"
+            if dtm_path.exists() and not force:
+                print(f"Skipping {year} (already exists): {dtm_path}")
+                continue
+
+            df = _read_year_headlines(ravenpack_path, year)
+            headlines = df["headline"].tolist()
+            chunks = [
+                (headlines[i : i + chunk_size], ngram_max, hash_space)
+                for i in range(0, len(headlines), chunk_size)
+            ]
+
+            blocks = []
+            for indptr, terms in executor.map(_tokenize_chunk, chunks):
+                if mode == "hashing":
+                    blocks.append(_csr_from_columns(indptr, terms, n_features))
+                    continue
+                codes, uniques = pd.factorize(terms)
+                ids = np.empty(len(uniques), dtype=np.int64)
+                for j, token in enumerate(uniques):
+                    term_id = vocab.get(token)
+                    if term_id is None:
+                        term_id = vocab[token] = len(vocab)
+                    ids[j] = term_id
+                blocks.append((indptr, ids[codes]))
+
+            if mode == "vocab":
+                blocks = [_csr_from_columns(p, c, len(vocab)) for p, c in blocks]
+            n_cols = n_features if mode == "hashing" else len(vocab)
+            dtm = (
+                sp.vstack(blocks, format="csr")
+                if blocks
+                else sp.csr_matrix((0, n_cols))
+            )
+
+            if mode == "vocab":
+                # Persist the vocabulary before the chunk that relies on it
+                pd.DataFrame(
+                    {"token": list(vocab.keys()), "term_id": list(vocab.values())}
+                ).to_parquet(out_dir / "vocabulary.parquet", index=False)
+            df[["rp_story_id", "rp_entity_id", "timestamp_utc"]].to_parquet(
+                out_dir / f"stories_{year}.parquet", index=False
+            )
+            sp.save_npz(dtm_path, dtm)
+            print(
+                f"{year}: {dtm.shape[0]:,} stories, {dtm.nnz:,} nonzeros, {n_cols:,} terms"
+            )
+
+    print(f"Saved headline DTM chunks -> {out_dir}")
+    return out_dir
+
+
+def _chunk_years(out_dir: Path, years: Optional[Sequence[int]]) -> List[int]:
+    if years is not None:
+        return list(years)
+    return sorted(int(p.stem.split("_")[1]) for p in Path(out_dir).glob("dtm_*.npz"))
+
+
+def load_headline_dtm(
+    mode: str = "vocab", years: Optional[Sequence[int]] = None, dtm_dir: Path = DTM_DIR
+) -> sp.csr_matrix:
+    """
+    Stack yearly chunks into one CSR matrix. Older vocabulary chunks are
+    widened to the current vocabulary size (new terms are zero there).
+    """
+    out_dir = Path(dtm_dir) / mode
+    blocks = [
+        sp.load_npz(out_dir / f"dtm_{y}.npz") for y in _chunk_years(out_dir, years)
+    ]
+    if mode == "vocab":
+        n_cols = len(load_vocabulary(out_dir))
+    else:
+        n_cols = max((b.shape[1] for b in blocks), default=HASHING_FEATURES)
+    blocks = [
+        sp.csr_matrix((b.data, b.indices, b.indptr), shape=(b.shape[0], n_cols))
+        for b in blocks
+    ]
+    return sp.vstack(blocks, format="csr") if blocks else sp.csr_matrix((0, n_cols))
+
+
+def load_headline_dtm_stories(
+    mode: str = "vocab", years: Optional[Sequence[int]] = None, dtm_dir: Path = DTM_DIR
+) -> pd.DataFrame:
+    """
+    Story ids in the row order of `load_headline_dtm` (same `years`).
+    """
+    out_dir = Path(dtm_dir) / mode
+    frames = [
+        pd.read_parquet(out_dir / f"stories_{y}.parquet")
+        for y in _chunk_years(out_dir, years)
+    ]
+    return pd.concat(frames, ignore_index=True)
+
+
+def main():
+    build_headline_dtm()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,250 @@
+"""
+Headline novelty and near-duplicate detection per firm with MinHash-LSH.
+
+RavenPack's `event_similarity_days` only covers detected events, while the
+same (or nearly the same) headline is often re-released across sources and
+days. Comparing every pair of headlines per firm is quadratic, so instead:
+
+ 1. Each headline becomes a set of word unigrams and bigrams, summarised by a
+    MinHash signature of `NUM_PERM` 32-bit values. The share of equal
+    signature values estimates the Jaccard similarity of two headlines.
+ 2. Signatures are cut into `BANDS` bands. Two headlines of the same firm
+    that agree on a whole band land in the same LSH bucket and become
+    candidates.
+ 3. Within each bucket, stories are ordered by time and each story is checked
+    against its few most recent predecessors. A candidate within
+    `WINDOW_DAYS` whose estimated Jaccard is at least `SIMILARITY_THRESHOLD`
+    marks the story as a near-duplicate.
+
+The sample is processed one calendar year at a time in a single streaming
+pass. Stories from the last `WINDOW_DAYS` of the previous year are carried
+into the next year as context, so the sliding window crosses year ends.
+
+Firms are identified by permno when available and by rp_entity_id otherwise.
+Output: one row per (rp_story_id, firm) with `is_near_duplicate`,
+`days_since_similar` (NaN when nothing similar is in the window) and the
+matching `similar_story_id`.
+"""
+
+from __future__ import annotations
+
+from itertools import pairwise
+from pathlib import Path
+from typing import Optional
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from embed_headlines import tokenize_headline
+from settings import config
+
+DATA_DIR = Path(config("DATA_DIR"))
+
+NUM_PERM = 64
+BANDS = 16
+SIMILARITY_THRESHOLD = 0.8
+WINDOW_DAYS = 30
+MAX_CANDIDATES = 3
+
+_NS_PER_DAY = 86_400 * 10**9
+
+# Multiply-shift hash family: h_k(x) = (a_k * x + b_k) >> 32 (mod 2**64)
+_rng = np.random.default_rng(20220101)
+_PERM_A = _rng.integers(1, 2**63, size=NUM_PERM, dtype=np.uint64) | np.uint64(1)
+_PERM_B = _rng.integers(0, 2**63, size=NUM_PERM, dtype=np.uint64)
+
+
+def headline_shingles(text: str) -> list:
+    """
+    Word unigrams and bigrams of a headline.
+
+    >>> headline_shingles("IBM beats estimates")
+    ['ibm', 'beats', 'estimates', 'ibm beats', 'beats estimates']
+    """
+    words = tokenize_headline(text)
+    return words + [f"{a} {b}" for a, b in pairwise(words)]
+
+
+def minhash_signatures(headlines, chunk_size: int = 20_000) -> np.ndarray:
+    """
+    MinHash signatures, shape (n, NUM_PERM), dtype uint32.
+
+    Headlines without any token get an all-ones signature and are never
+    reported as similar to anything.
+    """
+    headlines = list(headlines)
+    sig = np.full((len(headlines), NUM_PERM), np.iinfo(np.uint32).max, np.uint32)
+    with np.errstate(over="ignore"):
+        for start in range(0, len(headlines), chunk_size):
+            rows, tokens = [], []
+            for i, text in enumerate(headlines[start : start + chunk_size]):
+                grams = headline_shingles(text)
+                rows.extend([i] * len(grams))
+                tokens.extend(grams)
+            if not tokens:
+                continue
+            rows = np.asarray(rows, dtype=np.int64)
+            x = pd.util.hash_array(np.asarray(tokens, dtype=object))
+            h = ((x[:, None] * _PERM_A + _PERM_B) >> np.uint64(32)).astype(np.uint32)
+            starts = np.flatnonzero(np.r_[True, rows[1:] != rows[:-1]])
+            sig[start + rows[starts]] = np.minimum.reduceat(h, starts, axis=0)
+    return sig
+
+
+def band_keys(sig: np.ndarray, bands: int = BANDS) -> np.ndarray:
+    """
+    One 64-bit bucket key per (story, band), shape (n, bands).
+    """
+    n, num_perm = sig.shape
+    rows = num_perm // bands
+    keys = np.zeros((n, bands), dtype=np.uint64)
+    with np.errstate(over="ignore"):
+        for r in range(rows):
+            keys = keys * np.uint64(0x100000001B3) ^ sig[:, r::rows][:, :bands]
+    return keys
+
+
+def find_similar_predecessors(
+    firm: np.ndarray,
+    time_ns: np.ndarray,
+    sig: np.ndarray,
+    window_days: float = WINDOW_DAYS,
+    threshold: float = SIMILARITY_THRESHOLD,
+    max_candidates: int = MAX_CANDIDATES,
+    bands: int = BANDS,
+):
+    """
+    For each story, the most recent earlier story of the same firm whose
+    estimated Jaccard similarity is at least `threshold`.
+
+    Rows must be sorted by time. Returns (days_since, match_index), with NaN
+    and -1 where no similar predecessor lies within `window_days`.
+    """
+    n = len(time_ns)
+    days_since = np.full(n, np.nan)
+    match = np.full(n, -1, dtype=np.int64)
+    if n == 0:
+        return days_since, match
+
+    keys = band_keys(sig, bands)
+    empty = (sig == np.iinfo(np.uint32).max).all(axis=1)
+    position = np.arange(n)
+    window_ns = window_days * _NS_PER_DAY
+    for b in range(bands):
+        # Sort by bucket, then by time (position breaks timestamp ties)
+        order = np.lexsort((position, keys[:, b], firm))
+        k = keys[order, b]
+        f = firm[order]
+        for s in range(1, max_candidates + 1):
+            cur, prev = order[s:], order[:-s]
+            same = (k[s:] == k[:-s]) & (f[s:] == f[:-s]) & ~empty[order[s:]]
+            cur, prev = cur[same], prev[same]
+            gap = time_ns[cur] - time_ns[prev]
+            ok = gap <= window_ns
+            cur, prev, gap = cur[ok], prev[ok], gap[ok]
+            sim = (sig[cur] == sig[prev]).mean(axis=1)
+            ok = sim >= threshold
+            cur, prev, days = cur[ok], prev[ok], gap[ok] / _NS_PER_DAY
+            better = np.isnan(days_since[cur]) | (days < days_since[cur])
+            days_since[cur[better]] = days[better]
+            match[cur[better]] = prev[better]
+    return days_since, match
+
+
+def _firm_keys(df: pd.DataFrame) -> pd.Series:
+    permno = pd.to_numeric(df["permno"], errors="coerce")
+    return ("P" + permno.astype("Int64").astype(str)).where(
+        permno.notna(), "E" + df["rp_entity_id"].astype(str)
+    )
+
+
+def _read_year(path: Path, year: int) -> pd.DataFrame:
+    start = pd.Timestamp(f"{year}-01-01")
+    end = pd.Timestamp(f"{year + 1}-01-01")
+    table = pq.read_table(
+        path,
+        columns=["rp_story_id", "rp_entity_id", "permno", "timestamp_utc", "headline"],
+        filters=[("timestamp_utc", ">=", start), ("timestamp_utc", "<", end)],
+    )
+    df = table.to_pandas()
+    df["firm"] = _firm_keys(df)
+    df = df.drop_duplicates(subset=["rp_story_id", "firm"])
+    return df.sort_values("timestamp_utc", kind="stable").reset_index(drop=True)
+
+
+def build_headline_novelty(
+    ravenpack_with_permno_path: Optional[Path] = None,
+    out_path: Optional[Path] = None,
+    start_year: int = 2000,
+    end_year: int = 2019,
+    window_days: float = WINDOW_DAYS,
+    threshold: float = SIMILARITY_THRESHOLD,
+) -> Path:
+    """
+    Stream the sample year by year and save story-level novelty features.
+    """
+    if ravenpack_with_permno_path is None:
+        ravenpack_with_permno_path = DATA_DIR / "ravenpack_djpr_with_permno.parquet"
+    if out_path is None:
+        out_path = DATA_DIR / "headline_novelty.parquet"
+
+    out_path.parent.mkdir(parents=True, exist_ok=True)
+    context = None  # tail of the previous year, with its signatures
+    writer: pq.ParquetWriter | None = None
+    try:
+        for year in range(start_year, end_year + 1):
+            df = _read_year(ravenpack_with_permno_path, year)
+            sig = minhash_signatures(df["headline"])
+
+            n_context = 0
+            if context is not None:
+                ctx_df, ctx_sig = context
+                n_context = len(ctx_df)
+                df = pd.concat([ctx_df, df], ignore_index=True)
+                sig = np.concatenate([ctx_sig, sig])
+
+            time_ns = df["timestamp_utc"].to_numpy("datetime64[ns]").view("int64")
+            firm = pd.factorize(df["firm"])[0]
+            days_since, match = find_similar_predecessors(
+                firm, time_ns, sig, window_days=window_days, threshold=threshold
+            )
+
+            out = df.iloc[n_context:][
+                ["rp_story_id", "rp_entity_id", "permno", "timestamp_utc"]
+            ].copy()
+            out["is_near_duplicate"] = ~np.isnan(days_since[n_context:])
+            out["days_since_similar"] = days_since[n_context:]
+            similar = df["rp_story_id"].to_numpy(dtype=object)[match[n_context:]]
+            out["similar_story_id"] = pd.array(
+                np.where(match[n_context:] >= 0, similar, None), dtype="string"
+            )
+
+            table = pa.Table.from_pandas(out, preserve_index=False)
+            if writer is None:
+                writer = pq.ParquetWriter(out_path, table.schema)
+            writer.write_table(table)
+            print(
+                f"{year}: {len(out):,} stories, "
+                f"{out['is_near_duplicate'].mean():.3f} near-duplicates"
+            )
+
+            if len(df):
+                cutoff = time_ns[-1] - window_days * _NS_PER_DAY
+                tail = time_ns >= cutoff
+                context = (df.loc[tail].reset_index(drop=True), sig[tail])
+    finally:
+        if writer is not None:
+            writer.close()
+
+    print(f"Saved headline novelty -> {out_path}")
+    return out_path
+
+
+def main():
+    build_headline_novelty()
+
+
+if __name__ == "__main__":
+    main()
@@ -4,13 +4,36 @@ from pathlib import Path
 from typing import Optional
 
 import pandas as pd
-import wrds
 
+from arrow_cache import read_parquet_cached
+from load_data import load
+from misc_tools import isin_to_cusip, validate_isin
+from parquet_layout import write_parquet
+from pull_ravenpack import (
+    END_DATE,
+    START_DATE,
+    combine_year_parquets_to_single,
+    year_file_path,
+    year_range,
+)
 from settings import config
+from summary_cube import update_sentiment_cube, update_sentiment_cube_from_files
 
 DATA_DIR = Path(config("DATA_DIR"))
 WRDS_USERNAME = config("WRDS_USERNAME")
 
+# Per-year intermediate files (one doit subtask per year and stage)
+WITH_PERMNO_YEAR_DIR = DATA_DIR / "ravenpack_with_permno_years"
+MERGED_YEAR_DIR = DATA_DIR / "ravenpack_crsp_merged_years"
+
+
+def with_permno_year_path(year: int) -> Path:
+    return WITH_PERMNO_YEAR_DIR / f"ravenpack_djpr_with_permno_{year}.parquet"
+
+
+def merged_year_path(year: int) -> Path:
+    return MERGED_YEAR_DIR / f"ravenpack_crsp_merged_{year}.parquet"
+
 
 def build_raven_crsp_crosswalk(out_path: Optional[Path] = None) -> Path:
     """
@@ -21,6 +44,10 @@ def build_raven_crsp_crosswalk(out_path: Optional[Path] = None) -> Path:
       match: a.ncusip = substr(b.isin,3,8)
 
     Output: unique (permno, rp_entity_id)
+
+    The same join is rebuilt locally with `link_isins_to_ncusips` (dropping
+    ISINs with a bad check digit) and the links on which the two disagree
+    are reported; the WRDS result is the one saved.
     """
     if out_path is None:
         out_path = DATA_DIR / "raven_crsp_crosswalk.parquet"
@@ -41,14 +68,25 @@ def build_raven_crsp_crosswalk(out_path: Optional[Path] = None) -> Path:
     ;
     """
 
+    import wrds
+
     db = wrds.Connection(wrds_username=WRDS_USERNAME)
     try:
         xw = db.raw_sql(sql)
+        dse = db.raw_sql(
+            "SELECT DISTINCT permno, ncusip FROM crsp.dse "
+            "WHERE ncusip IS NOT NULL AND ncusip <> ''"
+        )
+        company_names = db.raw_sql(
+            "SELECT DISTINCT rp_entity_id, isin FROM rpna.wrds_rpa_company_names "
+            "WHERE isin IS NOT NULL AND isin <> ''"
+        )
     finally:
         db.close()
 
     # Safety: make sure we don't duplicate on rp_entity_id in later merge
     xw = xw.drop_duplicates(subset=["permno", "rp_entity_id"]).reset_index(drop=True)
+    report_crosswalk_differences(xw, link_isins_to_ncusips(dse, company_names))
 
     out_path.parent.mkdir(parents=True, exist_ok=True)
     xw.to_parquet(out_path, index=False)
@@ -56,6 +94,73 @@ def build_raven_crsp_crosswalk(out_path: Optional[Path] = None) -> Path:
     return out_path
 
 
+def load_raven_crsp_crosswalk(data_dir=DATA_DIR, use_cache=None) -> pd.DataFrame:
+    """
+    Load the (permno, rp_entity_id) crosswalk (through its memory-mapped
+    Arrow cache, see arrow_cache.py).
+    """
+    path = Path(data_dir) / "raven_crsp_crosswalk.parquet"
+    return read_parquet_cached(path, use_cache=use_cache)
+
+
+def link_isins_to_ncusips(
+    dse: pd.DataFrame, company_names: pd.DataFrame, validate: bool = True
+) -> pd.DataFrame:
+    """
+    Local version of the crosswalk join in `build_raven_crsp_crosswalk`.
+
+    dse: permno, ncusip (historical 8-character CUSIPs)
+    company_names: rp_entity_id, isin
+
+    Matches ncusip to characters 3-10 of the ISIN. With validate=True, ISINs
+    whose check digit is wrong are dropped before matching. Output: unique
+    (permno, rp_entity_id).
+    """
+    names = company_names.dropna(subset=["rp_entity_id", "isin"])
+    names = names[names["rp_entity_id"] != ""]
+    if validate:
+        names = names[validate_isin(names["isin"])]
+    names = names.assign(ncusip=isin_to_cusip(names["isin"], digits=8))
+
+    dse = dse.dropna(subset=["ncusip"])
+    dse = dse[dse["ncusip"] != ""]
+
+    xw = dse[["permno", "ncusip"]].merge(names[["ncusip", "rp_entity_id"]], on="ncusip")
+    return (
+        xw[["permno", "rp_entity_id"]]
+        .drop_duplicates(subset=["permno", "rp_entity_id"])
+        .reset_index(drop=True)
+    )
+
+
+def report_crosswalk_differences(
+    wrds_xw: pd.DataFrame, local_xw: pd.DataFrame
+) -> pd.Series:
+    """
+    Number of (permno, rp_entity_id) links in both crosswalks or only one.
+    """
+    keys = ["permno", "rp_entity_id"]
+    both = pd.merge(
+        wrds_xw[keys].astype({"permno": "int64"}),
+        local_xw[keys].astype({"permno": "int64"}),
+        on=keys,
+        how="outer",
+        indicator=True,
+    )
+    counts = (
+        both["_merge"]
+        .value_counts()
+        .rename({"left_only": "wrds_only", "right_only": "local_only"})
+        .reindex(["both", "wrds_only", "local_only"], fill_value=0)
+    )
+    print(
+        f"Crosswalk check: {counts['both']:,} links in both, "
+        f"{counts['wrds_only']:,} only from WRDS, "
+        f"{counts['local_only']:,} only local"
+    )
+    return counts
+
+
 def attach_permno_to_ravenpack(
     ravenpack_path: Optional[Path] = None,
     crosswalk_path: Optional[Path] = None,
@@ -72,7 +177,8 @@ def attach_permno_to_ravenpack(
         out_path = DATA_DIR / "ravenpack_djpr_with_permno.parquet"
 
     rp = pd.read_parquet(ravenpack_path)
-    xw = pd.read_parquet(crosswalk_path)
+    # Read once per yearly subtask, so it goes through the Arrow cache
+    xw = read_parquet_cached(crosswalk_path)
 
     # Ensure crosswalk is unique by rp_entity_id to avoid row explosion.
     # If an rp_entity_id maps to multiple permnos (rare, but possible),
@@ -82,7 +188,7 @@ def attach_permno_to_ravenpack(
     rp2 = rp.merge(xw1, on="rp_entity_id", how="left")
 
     out_path.parent.mkdir(parents=True, exist_ok=True)
-    rp2.to_parquet(out_path, index=False)
+    write_parquet(rp2, out_path, "ravenpack")
 
     print(f"Saved RavenPack with permno -> {out_path}")
     print(f"Share matched to permno: {rp2['permno'].notna().mean():.3f}")
@@ -94,12 +200,14 @@ def merge_ravenpack_with_crsp_daily(
     crsp_daily_path: Optional[Path] = None,
     out_path: Optional[Path] = None,
     how: str = "left",
+    year: Optional[int] = None,
 ) -> Path:
     """
     Merge RavenPack (now with permno) to CRSP daily file on (permno, date).
 
     how="left" keeps all RavenPack rows and brings CRSP fields when available (recommended).
     how="inner" keeps only rows that match CRSP daily (stricter).
+    With `year`, only that calendar year of CRSP is read (for a per-year input).
     """
     if ravenpack_with_permno_path is None:
         ravenpack_with_permno_path = DATA_DIR / "ravenpack_djpr_with_permno.parquet"
@@ -112,7 +220,15 @@ def merge_ravenpack_with_crsp_daily(
         raise ValueError("how must be 'left' or 'inner'")
 
     rp = pd.read_parquet(ravenpack_with_permno_path)
-    crsp = pd.read_parquet(crsp_daily_path)
+    # Only CRSP rows of the firms (and year) in rp can match; the rest are
+    # pruned by row group
+    crsp = load(
+        "crsp_daily",
+        start=f"{year}-01-01" if year is not None else None,
+        end=f"{year}-12-31" if year is not None else None,
+        permnos=rp["permno"].dropna().unique(),
+        path=crsp_daily_path,
+    )
 
     # RavenPack timestamp -> trading date key (normalize to midnight)
     rp = rp.copy()
@@ -124,14 +240,69 @@ def merge_ravenpack_with_crsp_daily(
     merged = rp.merge(crsp, on=["permno", "date"], how=how)
 
     out_path.parent.mkdir(parents=True, exist_ok=True)
-    merged.to_parquet(out_path, index=False)
+    write_parquet(merged, out_path, "ravenpack")
 
     print(f"Saved merged RavenPack x CRSP ({how}) -> {out_path}")
     print(f"Rows: {len(merged):,}")
+
+    # Per-year merges run in parallel; their combine step updates the cube
+    if year is None:
+        update_sentiment_cube(merged)
     return out_path
 
 
+def attach_and_merge_year(year: int, step: str = "all") -> None:
+    """
+    Per-year version of attach_permno_to_ravenpack / merge_ravenpack_with_crsp_daily
+    (step="attach", "merge" or "all").
+    """
+    if step in {"attach", "all"}:
+        attach_permno_to_ravenpack(
+            ravenpack_path=year_file_path(year), out_path=with_permno_year_path(year)
+        )
+    if step in {"merge", "all"}:
+        merge_ravenpack_with_crsp_daily(
+            ravenpack_with_permno_path=with_permno_year_path(year),
+            out_path=merged_year_path(year),
+            how="left",
+            year=year,
+        )
+
+
+def combine_linked_years() -> None:
+    """
+    Combine the per-year attach and merge outputs into the single files.
+    """
+    years = year_range(START_DATE, END_DATE)
+    combine_year_parquets_to_single(
+        out_path=DATA_DIR / "ravenpack_djpr_with_permno.parquet",
+        year_files=[with_permno_year_path(y) for y in years],
+    )
+    combine_year_parquets_to_single(
+        out_path=DATA_DIR / "ravenpack_crsp_merged.parquet",
+        year_files=[merged_year_path(y) for y in years],
+    )
+    update_sentiment_cube_from_files([merged_year_path(y) for y in years])
+
+
+def main(step: Optional[str] = None, year: Optional[int] = None) -> None:
+    """
+    doit runs step="crosswalk", then step="attach" / "merge" with a year per
+    task, then step="combine"; with step="all" everything runs in one go on
+    the combined RavenPack file. From the command line: --STEP=merge --YEAR=2005.
+    """
+    step = step or config("STEP", default="all")
+    if step == "crosswalk":
+        build_raven_crsp_crosswalk()
+    elif step in {"attach", "merge"}:
+        attach_and_merge_year(year or int(config("YEAR")), step=step)
+    elif step == "combine":
+        combine_linked_years()
+    else:
+        build_raven_crsp_crosswalk()
+        attach_permno_to_ravenpack()
+        merge_ravenpack_with_crsp_daily(how="left")
+
+
 if __name__ == "__main__":
-    build_raven_crsp_crosswalk()
-    attach_permno_to_ravenpack()
-    merge_ravenpack_with_crsp_daily(how="left")
\ No newline at end of file
+    main()
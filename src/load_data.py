@@ -0,0 +1,195 @@
+"""
+One loader for every project dataset, with predicate and projection pushdown.
+
+    load("crsp_daily", columns=["permno", "date", "ret"], start="2005", end="2005-12-31")
+    load("ravenpack_djpr", entity_ids=["ABCDEF"], start="2010-01-01", end="2010-06-30")
+    load("ravenpack_crsp_merged", permnos=[10107], columns=["date", "ret"])
+
+Filters are pushed into `pyarrow.dataset`: only the requested columns are
+decoded, and row groups (or hive partitions, for directory datasets) whose
+footer statistics cannot match the date range or ids are skipped without
+being read. How much is skipped depends on the layout: the files written
+with `parquet_layout.py` are clustered by firm, so a one-firm query only
+reads a few of their row groups.
+
+`start` and `end` are inclusive; a date-only `end` includes that whole day
+for timestamp columns. `permnos` and `entity_ids` are lists of permno and
+rp_entity_id values.
+
+Unfiltered loads of the small, often re-read datasets (CRSP, the crosswalk
+and the Russell 1000 list) go through the memory-mapped Arrow cache of
+`arrow_cache.py`.
+"""
+
+from __future__ import annotations
+
+from pathlib import Path
+from typing import Iterable, List, Optional
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.dataset as ds
+
+from arrow_cache import read_table_cached
+from settings import config
+
+DATA_DIR = Path(config("DATA_DIR"))
+
+# name -> file (or directory) in DATA_DIR, date column, whether unfiltered
+# loads use the Arrow cache
+DATASETS = {
+    "crsp_daily": {
+        "path": "CRSP_DAILY_PAPER_UNIVERSE.parquet",
+        "date_col": "date",
+        "cache": True,
+    },
+    "russell_1000": {
+        "path": "RUSSELL_1000_CONSTITUENTS.parquet",
+        "date_col": None,
+        "cache": True,
+    },
+    "raven_crsp_crosswalk": {
+        "path": "raven_crsp_crosswalk.parquet",
+        "date_col": None,
+        "cache": True,
+    },
+    "ravenpack_djpr": {
+        "path": "ravenpack_djpr.parquet",
+        "date_col": "timestamp_utc",
+        "cache": False,
+    },
+    "ravenpack_djpr_with_permno": {
+        "path": "ravenpack_djpr_with_permno.parquet",
+        "date_col": "timestamp_utc",
+        "cache": False,
+    },
+    "ravenpack_crsp_merged": {
+        "path": "ravenpack_crsp_merged.parquet",
+        "date_col": "date",
+        "cache": False,
+    },
+    "ravenpack_firm_day": {
+        "path": "ravenpack_firm_day.parquet",
+        "date_col": "trading_date",
+        "cache": False,
+    },
+}
+
+
+def dataset_path(dataset: str, data_dir: Path = DATA_DIR) -> Path:
+    if dataset not in DATASETS:
+        raise KeyError(f"Unknown dataset {dataset!r}; choose from {list(DATASETS)}")
+    return Path(data_dir) / DATASETS[dataset]["path"]
+
+
+def _bound(value, field: pa.Field) -> pa.Scalar:
+    """`value` as a scalar of the date column's type."""
+    ts = pd.Timestamp(value)
+    if pa.types.is_timestamp(field.type):
+        if field.type.tz is not None and ts.tz is None:
+            ts = ts.tz_localize(field.type.tz)
+        elif field.type.tz is None and ts.tz is not None:
+            ts = ts.tz_convert(None)
+        return pa.scalar(ts, type=field.type)
+    if pa.types.is_date(field.type):
+        return pa.scalar(ts.date(), type=field.type)
+    return pa.scalar(str(value)).cast(field.type)
+
+
+def _id_filter(name: str, values: Iterable, schema: pa.Schema) -> ds.Expression:
+    if name not in schema.names:
+        raise KeyError(f"Column {name!r} is not in this dataset")
+    value_set = pa.array(list(values))
+    return ds.field(name).isin(value_set.cast(schema.field(name).type))
+
+
+def build_filter(
+    schema: pa.Schema,
+    date_col: Optional[str],
+    start=None,
+    end=None,
+    permnos: Optional[Iterable] = None,
+    entity_ids: Optional[Iterable] = None,
+) -> Optional[ds.Expression]:
+    """Dataset filter expression for the date range and ids (None if no filter)."""
+    conditions: List[ds.Expression] = []
+    if start is not None or end is not None:
+        if date_col is None:
+            raise ValueError("This dataset has no date column to filter on")
+        field = schema.field(date_col)
+        if start is not None:
+            conditions.append(ds.field(date_col) >= _bound(start, field))
+        if end is not None:
+            end_ts = pd.Timestamp(end)
+            if pa.types.is_timestamp(field.type) and end_ts == end_ts.normalize():
+                next_day = end_ts + pd.Timedelta(days=1)
+                conditions.append(ds.field(date_col) < _bound(next_day, field))
+            else:
+                conditions.append(ds.field(date_col) <= _bound(end_ts, field))
+    if permnos is not None:
+        conditions.append(_id_filter("permno", permnos, schema))
+    if entity_ids is not None:
+        conditions.append(_id_filter("rp_entity_id", entity_ids, schema))
+
+    if not conditions:
+        return None
+    expr = conditions[0]
+    for condition in conditions[1:]:
+        expr = expr & condition
+    return expr
+
+
+def load_table(
+    dataset: str,
+    columns: Optional[List[str]] = None,
+    start=None,
+    end=None,
+    permnos: Optional[Iterable] = None,
+    entity_ids: Optional[Iterable] = None,
+    path: Optional[Path] = None,
+    data_dir: Path = DATA_DIR,
+) -> pa.Table:
+    """Arrow version of `load`."""
+    path = Path(path) if path is not None else dataset_path(dataset, data_dir)
+    spec = DATASETS[dataset]
+    unfiltered = (
+        start is None and end is None and permnos is None and entity_ids is None
+    )
+    if unfiltered and spec["cache"] and path.is_file():
+        return read_table_cached(path, columns=columns)
+
+    data = ds.dataset(
+        path, format="parquet", partitioning="hive" if path.is_dir() else None
+    )
+    flt = build_filter(data.schema, spec["date_col"], start, end, permnos, entity_ids)
+    return data.to_table(columns=columns, filter=flt)
+
+
+def load(
+    dataset: str,
+    columns: Optional[List[str]] = None,
+    start=None,
+    end=None,
+    permnos: Optional[Iterable] = None,
+    entity_ids: Optional[Iterable] = None,
+    path: Optional[Path] = None,
+    data_dir: Path = DATA_DIR,
+) -> pd.DataFrame:
+    """
+    Load `columns` (all by default) of a project dataset, keeping rows with
+    the date column in [start, end] and permno in `permnos` / rp_entity_id in
+    `entity_ids`. `path` overrides the dataset's location in `data_dir`.
+    """
+    return load_table(
+        dataset, columns, start, end, permnos, entity_ids, path, data_dir
+    ).to_pandas()
+
+
+if __name__ == "__main__":
+    for name in DATASETS:
+        p = dataset_path(name)
+        if p.exists():
+            schema = ds.dataset(p, format="parquet").schema
+            print(f"{name}: {p.name} ({len(schema.names)} columns)")
+        else:
+            print(f"{name}: not found ({p.name})")
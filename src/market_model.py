@@ -0,0 +1,349 @@
+"""
+Rolling market-model betas and abnormal returns around news.
+
+For every (permno, trading date) the market model
+
+    ret = alpha + beta * mkt + e
+
+is estimated by OLS over the firm's trailing `window` trading days. Nothing
+is fitted per firm or per date: the panel is sorted by (permno, date) once,
+and the windowed sums of 1, x, y, xy and x^2 are differences of global
+cumulative sums, clipped at the firm's first row. That is O(n) for the whole
+panel, against O(n * window) for `rolling().apply` regressions. Days where
+the return or the market is missing are left out of the sums. By default the
+estimates on date t use the window ending on t - 1 (`lag=1`), so they are
+out of sample for that day.
+
+The market series is the equal- or value-weighted return of the CRSP
+universe; value weights are the firm's market cap on its previous trading
+day, as in `backtest.py`.
+
+Abnormal returns are ret - alpha - beta * mkt. For an event on trading date
+t and a window [a, b] (in trading days relative to t), the cumulative
+abnormal return uses the parameters as of the first day of the window, so
+they are estimated only on days before the window:
+
+    CAR = sum(ret) - n_days * alpha - beta * sum(mkt) over t + a, ..., t + b
+
+News events on non-trading days are rolled forward to the next trading date,
+as in `aggregate_ravenpack`.
+"""
+
+from __future__ import annotations
+
+from pathlib import Path
+from typing import List, Optional, Sequence, Tuple
+
+import numpy as np
+import pandas as pd
+
+from aggregate_ravenpack import trading_date_codes
+from load_data import load
+from misc_tools import groupby_weighted_average
+from parquet_layout import write_parquet
+from settings import config
+
+DATA_DIR = Path(config("DATA_DIR"))
+
+WINDOW = 250
+MIN_PERIODS = 120
+EVENT_WINDOWS: List[Tuple[int, int]] = [(0, 0), (0, 1), (-1, 1), (0, 2), (2, 5)]
+
+
+########################################################################################
+## Market series
+########################################################################################
+
+
+def market_returns(
+    crsp: pd.DataFrame,
+    weighting: str = "value",
+    ret_col: str = "ret",
+    cap_col: str = "market_cap",
+) -> pd.Series:
+    """
+    Daily equal- or value-weighted return of the stocks in `crsp` (permno,
+    date, `ret_col` and, for value weights, `cap_col`), indexed by date.
+    """
+    if weighting not in {"equal", "value"}:
+        raise ValueError("weighting must be 'equal' or 'value'")
+
+    df = crsp[["permno", "date", ret_col]].rename(columns={ret_col: "ret"})
+    if weighting == "equal":
+        df = df.dropna(subset=["ret"])
+        return df.groupby("date")["ret"].mean().rename("mkt")
+
+    # Previous trading day's market cap of the same firm
+    df = df.assign(cap=crsp[cap_col].to_numpy(dtype=np.float64))
+    df = df.sort_values(["permno", "date"], kind="stable")
+    df["weight"] = df.groupby("permno")["cap"].shift(1)
+    df = df.dropna(subset=["ret", "weight"])
+    mkt = groupby_weighted_average(
+        data_col="ret", weight_col="weight", by_col="date", data=df
+    )
+    return mkt.rename("mkt")
+
+
+########################################################################################
+## Rolling OLS
+########################################################################################
+
+
+def _firm_start(firm: np.ndarray) -> np.ndarray:
+    """Index of the first row of each row's firm (rows sorted by firm)."""
+    n = len(firm)
+    new_firm = np.r_[True, firm[1:] != firm[:-1]] if n else np.zeros(0, dtype=bool)
+    return np.maximum.accumulate(np.where(new_firm, np.arange(n), 0))
+
+
+def rolling_window_sums(
+    firm: np.ndarray, values: np.ndarray, window: int
+) -> np.ndarray:
+    """
+    Sums of `values` (rows x columns) over each row's trailing `window` rows
+    of the same firm, from cumulative sums. Rows must be sorted by firm.
+
+    >>> rolling_window_sums(np.array([1, 1, 1, 2, 2]),
+    ...                     np.array([[1.0], [2.0], [3.0], [4.0], [5.0]]), 2).ravel()
+    array([1., 3., 5., 4., 9.])
+    """
+    n = len(firm)
+    cs = np.zeros((n + 1, values.shape[1]))
+    np.cumsum(values, axis=0, out=cs[1:])
+    rows = np.arange(n)
+    lo = np.maximum(rows - window + 1, _firm_start(firm))
+    return cs[rows + 1] - cs[lo]
+
+
+def rolling_ols(
+    firm: np.ndarray,
+    x: np.ndarray,
+    y: np.ndarray,
+    window: int = WINDOW,
+    min_periods: int = MIN_PERIODS,
+    lag: int = 1,
+) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Rolling OLS of y on x within each firm: (alpha, beta, n_obs) per row,
+    estimated on the firm's `window` rows ending `lag` rows earlier. Pairs
+    with a missing x or y are skipped; estimates need `min_periods` pairs.
+
+    >>> firm = np.array([7, 7, 7, 7])
+    >>> x = np.array([0.01, -0.02, 0.03, 0.00])
+    >>> alpha, beta, n = rolling_ols(firm, x, 0.001 + 2 * x, window=3,
+    ...                              min_periods=2, lag=0)
+    >>> beta.round(6), alpha.round(6), n
+    (array([nan,  2.,  2.,  2.]), array([  nan, 0.001, 0.001, 0.001]), array([1, 2, 3, 3]))
+    """
+    firm = np.asarray(firm)
+    x = np.asarray(x, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+    ok = ~(np.isnan(x) | np.isnan(y))
+    xv = np.where(ok, x, 0.0)
+    yv = np.where(ok, y, 0.0)
+    values = np.column_stack([ok.astype(np.float64), xv, yv, xv * yv, xv * xv])
+    n, sx, sy, sxy, sxx = rolling_window_sums(firm, values, window).T
+
+    sxx_c = sxx - sx * sx / np.where(n > 0, n, 1)
+    sxy_c = sxy - sx * sy / np.where(n > 0, n, 1)
+    fit = (n >= min_periods) & (sxx_c > 1e-14 * np.maximum(sxx, 1e-300))
+    with np.errstate(divide="ignore", invalid="ignore"):
+        beta = np.where(fit, sxy_c / sxx_c, np.nan)
+        alpha = np.where(fit, (sy - beta * sx) / n, np.nan)
+    n_obs = n.round().astype(np.int64)
+
+    if lag:
+        rows = np.arange(len(firm))
+        src = rows - lag
+        same = (src >= 0) & (src >= _firm_start(firm))
+        src = np.where(same, src, 0)
+        alpha = np.where(same, alpha[src], np.nan)
+        beta = np.where(same, beta[src], np.nan)
+        n_obs = np.where(same, n_obs[src], 0)
+    return alpha, beta, n_obs
+
+
+def rolling_market_model(
+    crsp: pd.DataFrame,
+    mkt: pd.Series,
+    window: int = WINDOW,
+    min_periods: int = MIN_PERIODS,
+    lag: int = 1,
+    ret_col: str = "ret",
+) -> pd.DataFrame:
+    """
+    permno, date, ret, mkt, alpha, beta, n_obs and the abnormal return `ar`
+    of every row of `crsp`, sorted by (permno, date).
+    """
+    panel = crsp[["permno", "date", ret_col]].rename(columns={ret_col: "ret"})
+    panel = panel.sort_values(["permno", "date"], kind="stable", ignore_index=True)
+    panel["mkt"] = mkt.reindex(panel["date"]).to_numpy()
+
+    alpha, beta, n_obs = rolling_ols(
+        panel["permno"].to_numpy(),
+        panel["mkt"].to_numpy(),
+        panel["ret"].to_numpy(),
+        window=window,
+        min_periods=min_periods,
+        lag=lag,
+    )
+    panel["alpha"] = alpha
+    panel["beta"] = beta
+    panel["n_obs"] = n_obs
+    panel["ar"] = panel["ret"] - alpha - beta * panel["mkt"]
+    return panel
+
+
+########################################################################################
+## Event windows
+########################################################################################
+
+
+def window_name(start: int, end: int) -> str:
+    """
+    >>> window_name(-1, 1), window_name(0, 5)
+    ('car_m1_p1', 'car_0_p5')
+    """
+
+    def day(k: int) -> str:
+        return f"m{-k}" if k < 0 else f"p{k}" if k > 0 else "0"
+
+    return f"car_{day(start)}_{day(end)}"
+
+
+def event_cars(
+    events: pd.DataFrame,
+    panel: pd.DataFrame,
+    windows: Sequence[Tuple[int, int]] = EVENT_WINDOWS,
+    date_col: str = "date",
+) -> pd.DataFrame:
+    """
+    Cumulative abnormal returns of `events` (permno, `date_col`) over each
+    [start, end] window of trading days, from a `rolling_market_model`
+    panel. Adds one `car_*` and one `n_*` (days with a return) column per
+    window; CARs are NaN when the firm has no return in the window or no
+    estimate on its first day.
+    """
+    calendar = np.unique(panel["date"].to_numpy().astype("datetime64[D]"))
+    # Keys permno * n_days + offset + code stay within the firm for every window
+    offset = max(max(abs(a), abs(b)) for a, b in windows)
+    n_days = len(calendar) + 2 * offset + 1
+
+    code = np.searchsorted(calendar, panel["date"].to_numpy().astype("datetime64[D]"))
+    key = panel["permno"].to_numpy(dtype=np.int64) * n_days + code + offset
+    if np.any(np.diff(key) < 0):
+        raise ValueError("panel must be sorted by (permno, date)")
+
+    ok = ~(np.isnan(panel["ret"].to_numpy()) | np.isnan(panel["mkt"].to_numpy()))
+    cum = np.zeros((len(panel) + 1, 3))
+    np.cumsum(
+        np.column_stack(
+            [
+                ok.astype(np.float64),
+                np.where(ok, panel["ret"].to_numpy(), 0.0),
+                np.where(ok, panel["mkt"].to_numpy(), 0.0),
+            ]
+        ),
+        axis=0,
+        out=cum[1:],
+    )
+    alpha = np.r_[panel["alpha"].to_numpy(dtype=np.float64), np.nan]
+    beta = np.r_[panel["beta"].to_numpy(dtype=np.float64), np.nan]
+
+    out = events.copy()
+    event_code = trading_date_codes(events[date_col], calendar)
+    valid = event_code >= 0
+    event_key = events["permno"].to_numpy(dtype=np.int64) * n_days + event_code + offset
+    # Sorted lookups are much faster (cache-friendly) than random ones
+    order = np.argsort(event_key, kind="stable")
+    sorted_key = event_key[order]
+    lo = np.empty(len(events), dtype=np.int64)
+    hi = np.empty(len(events), dtype=np.int64)
+    for start, end in windows:
+        lo[order] = np.searchsorted(key, sorted_key + start)
+        hi[order] = np.searchsorted(key, sorted_key + end, side="right")
+        n, s_ret, s_mkt = (cum[hi] - cum[lo]).T
+        # Parameters of the firm's first row in the window (NaN if it has none)
+        first = np.where(hi > lo, lo, len(panel))
+        car = s_ret - n * alpha[first] - beta[first] * s_mkt
+        name = window_name(start, end)
+        out[name] = np.where(valid & (n > 0), car, np.nan)
+        out[name.replace("car_", "n_", 1)] = np.where(valid, n, 0).astype(np.int64)
+    return out
+
+
+########################################################################################
+## Pipeline
+########################################################################################
+
+
+def build_market_model(
+    crsp_daily_path: Optional[Path] = None,
+    weighting: str = "value",
+    window: int = WINDOW,
+    min_periods: int = MIN_PERIODS,
+    out_path: Optional[Path] = None,
+) -> Path:
+    """
+    Save the rolling market model and abnormal returns of every CRSP
+    permno-day.
+    """
+    if out_path is None:
+        out_path = DATA_DIR / "market_model_daily.parquet"
+
+    crsp = load(
+        "crsp_daily",
+        columns=["permno", "date", "ret", "market_cap"],
+        path=crsp_daily_path,
+    )
+    crsp["permno"] = crsp["permno"].astype("int64")
+    mkt = market_returns(crsp, weighting=weighting)
+    panel = rolling_market_model(crsp, mkt, window=window, min_periods=min_periods)
+
+    out_path.parent.mkdir(parents=True, exist_ok=True)
+    write_parquet(panel, out_path, "crsp")
+    print(
+        f"Saved {weighting}-weighted market model ({len(panel):,} rows) -> {out_path}"
+    )
+    print(f"Share with a beta: {panel['beta'].notna().mean():.3f}")
+    return out_path
+
+
+def build_news_event_cars(
+    firm_day_path: Optional[Path] = None,
+    model_path: Optional[Path] = None,
+    windows: Sequence[Tuple[int, int]] = EVENT_WINDOWS,
+    out_path: Optional[Path] = None,
+) -> Path:
+    """
+    Save the CARs around every firm-day of the RavenPack news panel.
+    """
+    if firm_day_path is None:
+        firm_day_path = DATA_DIR / "ravenpack_firm_day.parquet"
+    if model_path is None:
+        model_path = DATA_DIR / "market_model_daily.parquet"
+    if out_path is None:
+        out_path = DATA_DIR / "news_event_cars.parquet"
+
+    events = load(
+        "ravenpack_firm_day", columns=["permno", "trading_date"], path=firm_day_path
+    )
+    events["permno"] = events["permno"].astype("int64")
+    panel = pd.read_parquet(model_path)
+    cars = event_cars(events, panel, windows=windows, date_col="trading_date")
+
+    out_path.parent.mkdir(parents=True, exist_ok=True)
+    write_parquet(cars, out_path, "firm_day")
+    print(f"Saved CARs of {len(cars):,} news firm-days -> {out_path}")
+    return out_path
+
+
+def main(weighting: Optional[str] = None):
+    build_market_model(
+        weighting=weighting or config("MARKET_WEIGHTING", default="value")
+    )
+    build_news_event_cars()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,15 +1,21 @@
 """Collection of miscelaneous tools useful in a variety of situations
 (not specific to the current project)
+
+Only numpy and pandas are imported with the module. matplotlib, polars,
+dateutil and pyarrow are imported inside the functions that need them, so
+that importing one pandas helper stays cheap (see test_import_time.py).
 """
 
+from __future__ import annotations
+
 import datetime
+from typing import TYPE_CHECKING
 
-import matplotlib.dates as mdates
 import numpy as np
 import pandas as pd
-import polars as pl
-from dateutil.relativedelta import relativedelta
-from matplotlib import pyplot as plt
+
+if TYPE_CHECKING:
+    import polars as pl
 
 ########################################################################################
 ## Pandas Helpers
@@ -142,6 +148,8 @@ def dataframe_set_difference(dff, df, library="pandas", show="rows_and_numbers")
     rows = data_frame_set_difference(dff, df)
     ```
     """
+    import polars as pl
+
     if library == "pandas":
         # Reset index to ensure the row numbers are captured as a column
         # This is important for tracking the original row numbers after operations
@@ -204,6 +212,8 @@ def freq_counts(df, col=None, with_count=True, with_cum_freq=True):
     ).pipe(freq_counts, col="bus_tenor_bin")
     ```
     """
+    import polars as pl
+
     s = df[col]
     ret = (
         s.value_counts(sort=True)
@@ -236,6 +246,79 @@ def move_columns_to_front(df, cols=[]):
         move_column_inplace(df, col, pos=0)
 
 
+def groupby_weighted_stats(
+    data_col=None, weight_col=None, by_col=None, data=None, ddof=1
+):
+    """
+    Grouped weighted mean, variance and standard deviation of one or more columns.
+
+    Sums of w and w*x (and the count of non-missing x) are accumulated per
+    group with `np.bincount`, then the weighted squared deviations from each
+    group's mean in a second pass. The input frame is not modified.
+    Rows with a missing value or weight are skipped for that column. The
+    variance uses the same small-sample correction as `groupby_weighted_std`:
+
+        sum(w * (x - mean)**2) / (((n - ddof) / n) * sum(w))
+
+    where n is the number of non-missing observations in the group. With
+    `by_col=None` the whole frame is one group.
+
+    Returns a DataFrame indexed by group, with (column, statistic) columns.
+
+    Examples
+    --------
+
+    ```
+    >>> df_nccb = pd.DataFrame({
+    ...     'trade_direction': ['RECEIVED', 'RECEIVED', 'RECEIVED', 'RECEIVED',
+    ...         'DELIVERED', 'DELIVERED', 'DELIVERED', 'DELIVERED'],
+    ...     'rate': [2, 2, 2, 3, 2, 2, 2, 3],
+    ...     'start_leg_amount': [300, 300, 300, 0, 200, 200, 200, 200]},
+    ... )
+    >>> stats = groupby_weighted_stats(data=df_nccb, data_col='rate',
+    ...     weight_col='start_leg_amount', by_col='trade_direction')
+    >>> stats['rate'].round(4).to_dict(orient='index')
+    {'DELIVERED': {'mean': 2.25, 'var': 0.25, 'std': 0.5}, 'RECEIVED': {'mean': 2.0, 'var': 0.0, 'std': 0.0}}
+
+    ```
+    """
+    data_cols = [data_col] if isinstance(data_col, str) else list(data_col)
+    weights = data[weight_col].to_numpy(dtype=float)
+
+    if by_col is None:
+        codes = np.zeros(len(data), dtype=np.int64)
+        index = pd.RangeIndex(1)
+    else:
+        grouped = data.groupby(by_col, sort=True)
+        codes = grouped.ngroup().to_numpy()
+        index = grouped.size().index
+    valid_group = codes >= 0
+    n_groups = len(index)
+
+    columns = {}
+    for col in data_cols:
+        x = data[col].to_numpy(dtype=float)
+        ok = valid_group & ~np.isnan(x) & ~np.isnan(weights)
+        c, w, x = codes[ok], weights[ok], x[ok]
+
+        n = np.bincount(c, minlength=n_groups)
+        sw = np.bincount(c, weights=w, minlength=n_groups)
+        swx = np.bincount(c, weights=w * x, minlength=n_groups)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            mean = swx / sw
+            # Deviations from each group's own mean, so that groups at very
+            # different levels keep their precision
+            dev = x - mean[c]
+            ss = np.bincount(c, weights=w * dev * dev, minlength=n_groups)
+            var = ss / (((n - ddof) / n) * sw)
+        var[n <= ddof] = np.nan
+        columns[(col, "mean")] = mean
+        columns[(col, "var")] = var
+        columns[(col, "std")] = np.sqrt(var)
+
+    return pd.DataFrame(columns, index=index)
+
+
 def weighted_average(data_col=None, weight_col=None, data=None):
     """Simple calculation of weighted average.
 
@@ -251,15 +334,10 @@ def weighted_average(data_col=None, weight_col=None, data=None):
 
     ```
     """
-
-    def weights_function(row):
-        return data.loc[row.index, weight_col]
-
-    def wm(row):
-        return np.average(row, weights=weights_function(row))
-
-    result = wm(data[data_col])
-    return result
+    stats = groupby_weighted_stats(
+        data_col=data_col, weight_col=weight_col, data=data, ddof=0
+    )
+    return float(stats[(data_col, "mean")].iloc[0])
 
 
 def groupby_weighted_average(
@@ -273,8 +351,7 @@ def groupby_weighted_average(
     """
     Faster method for calculating grouped weighted average.
 
-    From:
-    https://stackoverflow.com/a/44683506
+    Thin wrapper around `groupby_weighted_stats`; `data` is not modified.
 
     Examples
     --------
@@ -294,11 +371,10 @@ def groupby_weighted_average(
     ```
 
     """
-    data["_data_times_weight"] = data[data_col] * data[weight_col]
-    data["_weight_where_notnull"] = data[weight_col] * pd.notnull(data[data_col])
-    g = data.groupby(by_col)
-    result = g["_data_times_weight"].sum() / g["_weight_where_notnull"].sum()
-    del data["_data_times_weight"], data["_weight_where_notnull"]
+    stats = groupby_weighted_stats(
+        data_col=data_col, weight_col=weight_col, by_col=by_col, data=data, ddof=0
+    )
+    result = stats[(data_col, "mean")].rename(None)
 
     if transform:
         result.name = f"__{data_col}"
@@ -351,19 +427,10 @@ def groupby_weighted_std(
     ```
 
     """
-
-    def weighted_sd(input_df):
-        weights = input_df[weight_col]
-        vals = input_df[data_col]
-
-        weighted_avg = np.average(vals, weights=weights)
-
-        numer = np.sum(weights * (vals - weighted_avg) ** 2)
-        denom = ((vals.count() - ddof) / vals.count()) * np.sum(weights)
-
-        return np.sqrt(numer / denom)
-
-    return data.groupby(by_col).apply(weighted_sd)
+    stats = groupby_weighted_stats(
+        data_col=data_col, weight_col=weight_col, by_col=by_col, data=data, ddof=ddof
+    )
+    return stats[(data_col, "std")].rename(None)
 
 
 def weighted_quantile(
@@ -425,20 +492,399 @@ def weighted_quantile(
     return np.interp(quantiles, weighted_quantiles, values)
 
 
+def groupby_weighted_quantile(
+    data_col=None,
+    weight_col=None,
+    by_col=None,
+    data=None,
+    quantiles=0.5,
+    old_style=False,
+):
+    """Grouped version of `weighted_quantile` for any number of quantiles.
+
+    Rows are sorted once by (group, value). Cumulative weights are computed
+    within each group segment and all quantiles of all groups are
+    interpolated in one vectorized pass, with the same interpolation rule as
+    `weighted_quantile`. Rows with a missing value or weight are ignored.
+    Without a weight column, all rows get a weight of one.
+
+    Returns a Series when `quantiles` is a scalar, otherwise a DataFrame with
+    one column per quantile.
+
+    Examples
+    --------
+
+    ```
+    >>> df = pd.DataFrame({
+    ...     'date': ['a', 'a', 'a', 'b', 'b'],
+    ...     'rate': [3, 1, 2, 5, 4],
+    ...     'volume': [1, 1, 2, 1, 3]},
+    ... )
+    >>> groupby_weighted_quantile(data=df, data_col='rate', weight_col='volume',
+    ...     by_col='date', quantiles=[0.25, 0.5]).to_numpy().tolist()
+    [[1.3333333333333333, 2.0], [4.0, 4.25]]
+    >>> weighted_quantile([3, 1, 2], [0.25, 0.5], sample_weight=[1, 1, 2]).tolist()
+    [1.3333333333333333, 2.0]
+
+    ```
+    """
+    scalar = np.ndim(quantiles) == 0
+    q = np.atleast_1d(np.asarray(quantiles, dtype=float))
+    assert np.all(q >= 0) and np.all(q <= 1), "quantiles should be in [0, 1]"
+
+    values = data[data_col].to_numpy(dtype=float)
+    if weight_col is None:
+        weights = np.ones(len(values))
+    else:
+        weights = data[weight_col].to_numpy(dtype=float)
+    grouped = data.groupby(by_col, sort=True)
+    group = grouped.ngroup().to_numpy()
+    keep = (group >= 0) & ~np.isnan(values) & ~np.isnan(weights)
+    index = grouped.size().index
+
+    order = np.lexsort((values[keep], group[keep]))
+    group = group[keep][order]
+    values = values[keep][order]
+    weights = weights[keep][order]
+
+    out = np.full((len(index), len(q)), np.nan)
+    n = len(values)
+    if n:
+        seg_start = np.flatnonzero(np.r_[True, group[1:] != group[:-1]])
+        seg_last = np.r_[seg_start[1:], n] - 1
+        seg_len = seg_last - seg_start + 1
+
+        cum = np.cumsum(weights)
+        total = np.add.reduceat(weights, seg_start)
+        before = cum[seg_start] - weights[seg_start]
+        cw = cum - np.repeat(before, seg_len) - 0.5 * weights
+        with np.errstate(divide="ignore", invalid="ignore"):
+            if old_style:
+                # To be convenient with numpy.percentile
+                cw -= np.repeat(cw[seg_start], seg_len)
+                cw /= np.repeat(cw[seg_last], seg_len)
+            else:
+                cw /= np.repeat(total, seg_len)
+
+            # For each (group, quantile): number of rows with cw <= q
+            count = np.add.reduceat(
+                (cw[:, None] <= q[None, :]).astype(np.int64), seg_start, axis=0
+            )
+            lo = np.clip(
+                seg_start[:, None] + count - 1, seg_start[:, None], seg_last[:, None]
+            )
+            hi = np.clip(
+                seg_start[:, None] + count, seg_start[:, None], seg_last[:, None]
+            )
+            frac = np.where(hi > lo, (q[None, :] - cw[lo]) / (cw[hi] - cw[lo]), 0.0)
+            result = values[lo] + frac * (values[hi] - values[lo])
+        result[~np.isfinite(cw[seg_last])] = np.nan
+        out[group[seg_start]] = result
+
+    if scalar:
+        return pd.Series(out[:, 0], index=index)
+    return pd.DataFrame(out, index=index, columns=q)
+
+
+def _group_codes(data, by_col):
+    """Integer group code of each row (-1 for missing keys) and number of groups."""
+    grouped = data.groupby(by_col, sort=False)
+    return grouped.ngroup().to_numpy(), grouped.ngroups
+
+
+def _as_column_list(columns):
+    return [columns] if isinstance(columns, str) else list(columns)
+
+
+def groupby_rank(data=None, columns=None, by_col=None, method="average", pct=False):
+    """Ranks within each group, like `data.groupby(by_col)[columns].rank()`.
+
+    Each column is sorted once by (group, value); ranks come from positions
+    within the group segment and within runs of tied values. `method` is one
+    of "average", "min", "max", "first" or "dense", with the same meaning as
+    in pandas. Missing values keep a missing rank.
+
+    >>> df = pd.DataFrame({'date': [1, 1, 1, 2, 2], 'x': [3.0, 1.0, 3.0, 5.0, 4.0]})
+    >>> groupby_rank(df, 'x', 'date')['x'].tolist()
+    [2.5, 1.0, 2.5, 2.0, 1.0]
+    """
+    if method not in {"average", "min", "max", "first", "dense"}:
+        raise ValueError(f"Unknown rank method: {method}")
+    codes, _ = _group_codes(data, by_col)
+    out = {}
+    for col in _as_column_list(columns):
+        x = data[col].to_numpy(dtype=float)
+        rows = np.flatnonzero((codes >= 0) & ~np.isnan(x))
+        order = rows[np.lexsort((x[rows], codes[rows]))]
+        g, v = codes[order], x[order]
+        n = len(order)
+
+        new_group = np.r_[True, g[1:] != g[:-1]] if n else np.zeros(0, dtype=bool)
+        new_run = new_group | np.r_[True, v[1:] != v[:-1]] if n else new_group
+        idx = np.arange(n)
+        group_first = np.maximum.accumulate(np.where(new_group, idx, 0))
+        run_first = np.maximum.accumulate(np.where(new_run, idx, 0))
+        run_last = np.r_[np.flatnonzero(new_run)[1:], n] - 1
+        run_last = run_last[np.cumsum(new_run) - 1]
+        group_size = np.diff(np.r_[np.flatnonzero(new_group), n])[
+            np.cumsum(new_group) - 1
+        ]
+
+        if method == "average":
+            rank = (run_first + run_last) / 2 - group_first + 1
+        elif method == "min":
+            rank = run_first - group_first + 1.0
+        elif method == "max":
+            rank = run_last - group_first + 1.0
+        elif method == "first":
+            rank = idx - group_first + 1.0
+        else:
+            dense = np.cumsum(new_run)
+            rank = (dense - dense[group_first] + 1).astype(float)
+        if pct:
+            if method == "dense":
+                group_max = np.zeros(len(rank))
+                np.maximum.at(group_max, group_first, rank)
+                rank = rank / group_max[group_first]
+            else:
+                rank = rank / group_size
+
+        result = np.full(len(x), np.nan)
+        result[order] = rank
+        out[col] = result
+    return pd.DataFrame(out, index=data.index)
+
+
+def _group_moments(data, columns, by_col, ddof):
+    codes, n_groups = _group_codes(data, by_col)
+    for col in _as_column_list(columns):
+        x = data[col].to_numpy(dtype=float)
+        ok = (codes >= 0) & ~np.isnan(x)
+        c = codes[ok]
+        n = np.bincount(c, minlength=n_groups)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            mean = np.bincount(c, weights=x[ok], minlength=n_groups) / n
+            dev = x[ok] - mean[c]
+            var = np.bincount(c, weights=dev * dev, minlength=n_groups) / (n - ddof)
+        var[n <= ddof] = np.nan
+        mean_row = np.full(len(x), np.nan)
+        std_row = np.full(len(x), np.nan)
+        mean_row[ok] = mean[c]
+        std_row[ok] = np.sqrt(var[c])
+        yield col, x, mean_row, std_row
+
+
+def groupby_demean(data=None, columns=None, by_col=None):
+    """Subtract the group mean from each column (missing values stay missing).
+
+    >>> df = pd.DataFrame({'date': [1, 1, 2, 2], 'x': [1.0, 3.0, 5.0, None]})
+    >>> groupby_demean(df, 'x', 'date')['x'].tolist()
+    [-1.0, 1.0, 0.0, nan]
+    """
+    out = {
+        col: x - mean
+        for col, x, mean, _ in _group_moments(data, columns, by_col, ddof=0)
+    }
+    return pd.DataFrame(out, index=data.index)
+
+
+def groupby_zscore(data=None, columns=None, by_col=None, ddof=1):
+    """Standardize each column within groups: (x - group mean) / group std.
+
+    >>> df = pd.DataFrame({'date': [1, 1, 1, 2, 2], 'x': [1.0, 2.0, 3.0, 4.0, 6.0]})
+    >>> groupby_zscore(df, 'x', 'date')['x'].round(4).tolist()
+    [-1.0, 0.0, 1.0, -0.7071, 0.7071]
+    """
+    # Groups with a single value (or equal values) have a NaN (or 0) std
+    with np.errstate(divide="ignore", invalid="ignore"):
+        out = {
+            col: (x - mean) / std
+            for col, x, mean, std in _group_moments(data, columns, by_col, ddof=ddof)
+        }
+    return pd.DataFrame(out, index=data.index)
+
+
+def groupby_winsorize(data=None, columns=None, by_col=None, lower=0.01, upper=0.99):
+    """Clip each column to its within-group `lower` and `upper` quantiles.
+
+    Quantiles are interpolated like `numpy.percentile` and computed for all
+    groups at once with `groupby_weighted_quantile`.
+
+    >>> df = pd.DataFrame({'date': [1] * 5, 'x': [1.0, 2.0, 3.0, 4.0, 100.0]})
+    >>> groupby_winsorize(df, 'x', 'date', lower=0.0, upper=0.75)['x'].tolist()
+    [1.0, 2.0, 3.0, 4.0, 4.0]
+    >>> groupby_winsorize(pd.DataFrame({'date': [1], 'x': [7.0]}), 'x', 'date')['x'].tolist()
+    [7.0]
+    """
+    codes, _ = _group_codes(data, by_col)
+    keys = pd.Series(codes, index=data.index, name="_group")
+    frame = data[_as_column_list(columns)].assign(_group=keys)
+    out = {}
+    for col in _as_column_list(columns):
+        bounds = groupby_weighted_quantile(
+            data_col=col,
+            by_col="_group",
+            data=frame,
+            quantiles=[lower, upper],
+            old_style=True,
+        )
+        bounds = bounds.reindex(codes)
+        low = bounds.iloc[:, 0].to_numpy()
+        high = bounds.iloc[:, 1].to_numpy()
+        # A group with one non-missing value has 0/0 old-style quantiles;
+        # like numpy.percentile, its bounds are the value itself. Groups of
+        # equal values interpolate to that value and are left as is too.
+        x = data[col].to_numpy(dtype=float)
+        single = np.isnan(low) & ~np.isnan(x)
+        low = np.where(single, x, low)
+        high = np.where(single, x, high)
+        out[col] = np.clip(x, low, high)
+    return pd.DataFrame(out, index=data.index)
+
+
 _alphabet = "0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZ*@#"
 
+# Value of each byte in the CUSIP alphabet (-1 = not allowed)
+_CUSIP_VALUES = np.full(256, -1, dtype=np.int16)
+_CUSIP_VALUES[np.frombuffer(_alphabet.encode(), dtype=np.uint8)] = np.arange(
+    len(_alphabet)
+)
+
+
+def identifiers_to_bytes(ids, width):
+    """Fixed-width uint8 array of shape (n, width) from an array of strings.
+
+    Identifiers are upper-cased; shorter ones are right-padded with zero bytes
+    and longer ones truncated. Missing values become all-zero rows.
+
+    >>> identifiers_to_bytes(["037833", None], 6)
+    array([[48, 51, 55, 56, 51, 51],
+           [ 0,  0,  0,  0,  0,  0]], dtype=uint8)
+    """
+    ids = pd.Series(ids, dtype=object).where(pd.notna(ids), "")
+    ids = ids.astype(str).str.upper().to_numpy(dtype=f"S{width}")
+    return ids.view(np.uint8).reshape(len(ids), width)
+
+
+def bytes_to_identifiers(chars):
+    """Object array of strings from a (n, width) uint8 array."""
+    chars = np.ascontiguousarray(chars, dtype=np.uint8)
+    out = chars.view(f"S{chars.shape[1]}").ravel().astype(str).astype(object)
+    out[out == ""] = None
+    return out
+
+
+def cusip_check_digits(chars):
+    """Check digit (as a uint8 ASCII code) of each 8-character CUSIP row.
+
+    Characters outside the CUSIP alphabet give a check digit of 0 and should
+    be screened with `validate_cusip`.
+
+    >>> bytes(cusip_check_digits(identifiers_to_bytes(["03783310", "17275R10"], 8)))
+    b'02'
+    """
+    values = _CUSIP_VALUES[chars[:, :8]].astype(np.int64)
+    values[:, 1::2] *= 2
+    total = (values // 10 + values % 10).sum(axis=1)
+    return ((10 - total % 10) % 10 + ord("0")).astype(np.uint8)
+
+
+def _isin_check_digits(chars):
+    """Luhn check digit of each 11-character ISIN body (letters count as two
+    digits, A=10 ... Z=35)."""
+    values = _CUSIP_VALUES[chars[:, :11]].astype(np.int64)
+    two_digits = values >= 10
+    # Digits of each character, most significant first; -1 marks padding
+    digits = np.stack([np.where(two_digits, values // 10, -1), values % 10], axis=2)
+    digits = digits.reshape(len(chars), -1)
+    present = digits >= 0
+    # The rightmost digit of the body is doubled (the check digit follows it)
+    from_right = np.cumsum(present[:, ::-1], axis=1)[:, ::-1] - 1
+    doubled = np.where(present & (from_right % 2 == 0), digits * 2, digits)
+    total = np.where(present, doubled // 10 + doubled % 10, 0).sum(axis=1)
+    return ((10 - total % 10) % 10 + ord("0")).astype(np.uint8)
+
+
+def validate_cusip(ids):
+    """Boolean array: 9-character CUSIPs with a correct check digit.
+
+    >>> validate_cusip(["037833100", "037833101", "17275R102", None]).tolist()
+    [True, False, True, False]
+    """
+    chars = identifiers_to_bytes(ids, 10)
+    ok = (_CUSIP_VALUES[chars[:, :8]] >= 0).all(axis=1) & (chars[:, 9] == 0)
+    return ok & (cusip_check_digits(chars) == chars[:, 8])
+
+
+def validate_isin(ids):
+    """Boolean array: 12-character ISINs with a two-letter country code and a
+    correct check digit.
+
+    >>> validate_isin(["US0378331005", "US0378331006", "CA0679011084"]).tolist()
+    [True, False, True]
+    """
+    chars = identifiers_to_bytes(ids, 13)
+    values = _CUSIP_VALUES[chars]
+    ok = ((values[:, :2] >= 10) & (values[:, :2] <= 35)).all(axis=1)
+    ok &= ((values[:, 2:11] >= 0) & (values[:, 2:11] <= 35)).all(axis=1)
+    ok &= (chars[:, 11] >= ord("0")) & (chars[:, 11] <= ord("9")) & (chars[:, 12] == 0)
+    return ok & (_isin_check_digits(chars) == chars[:, 11])
+
+
+def _like_input(ids, out):
+    if isinstance(ids, pd.Series):
+        return pd.Series(out, index=ids.index, name=ids.name)
+    return out
+
+
+def cusip8_to_cusip9(ids):
+    """Append the check digit to 8-character CUSIPs.
+
+    >>> cusip8_to_cusip9(["03783310", "17275R10"]).tolist()
+    ['037833100', '17275R102']
+    """
+    chars = identifiers_to_bytes(ids, 9)
+    chars[:, 8] = np.where(chars[:, 7] != 0, cusip_check_digits(chars), 0)
+    return _like_input(ids, bytes_to_identifiers(chars))
+
+
+def cusip_to_isin(ids, country="US"):
+    """ISIN from an 8- or 9-character CUSIP. The CUSIP check digit is
+    recomputed rather than trusted.
+
+    >>> cusip_to_isin(["03783310", "037833100"]).tolist()
+    ['US0378331005', 'US0378331005']
+    """
+    cusip = identifiers_to_bytes(ids, 8)
+    chars = np.zeros((len(cusip), 12), dtype=np.uint8)
+    chars[:, :2] = np.frombuffer(country.encode(), dtype=np.uint8)
+    chars[:, 2:10] = cusip
+    chars[:, 10] = cusip_check_digits(cusip)
+    chars[:, 11] = _isin_check_digits(chars)
+    chars[cusip[:, 7] == 0] = 0
+    return _like_input(ids, bytes_to_identifiers(chars))
+
+
+def isin_to_cusip(ids, digits=9):
+    """CUSIP (8 or 9 characters) embedded in an ISIN.
+
+    >>> isin_to_cusip(["US0378331005"], digits=8).tolist()
+    ['03783310']
+    """
+    chars = identifiers_to_bytes(ids, 12)[:, 2 : 2 + digits]
+    return _like_input(ids, bytes_to_identifiers(chars))
+
 
-@np.vectorize
 def calc_check_digit(number):
     """Calculate the check digits for the 8-digit cusip.
     This function is taken from
     https://github.com/arthurdejong/python-stdnum/blob/master/stdnum/cusip.py
+    and vectorized over byte arrays with `cusip_check_digits`.
     """
-    # convert to numeric first, then sum individual digits
-    number = "".join(
-        str((1, 2)[i % 2] * _alphabet.index(n)) for i, n in enumerate(number)
-    )
-    return str((10 - sum(int(n) for n in number)) % 10)
+    scalar = np.ndim(number) == 0
+    digits = cusip_check_digits(identifiers_to_bytes(np.atleast_1d(number), 8))
+    digits = digits.view("S1").astype(str)
+    return digits[0] if scalar else digits
 
 
 def convert_cusips_from_8_to_9_digit(cusip_8dig_series):
@@ -617,6 +1063,127 @@ def with_lagged_columns(
     return df_lagged
 
 
+# Offset aliases (start/end anchored) -> period frequency
+_PERIOD_FREQ = {
+    "MS": "M",
+    "ME": "M",
+    "BM": "M",
+    "BME": "M",
+    "BMS": "M",
+    "QS": "Q",
+    "QE": "Q",
+    "BQ": "Q",
+    "BQE": "Q",
+    "BQS": "Q",
+    "A": "Y",
+    "AS": "Y",
+    "YE": "Y",
+    "YS": "Y",
+    "BA": "Y",
+    "BY": "Y",
+    "BAS": "Y",
+    "BYS": "Y",
+    "T": "min",
+    "L": "ms",
+    "U": "us",
+    "N": "ns",
+}
+
+
+def period_codes(dates, freq=None, calendar=None):
+    """Integer period code of each date.
+
+    With `freq`, consecutive periods of that frequency get consecutive codes
+    (e.g. "MS" and "ME" both map every date to its month). With `calendar`
+    (sorted trading dates), the code is the position in the calendar; dates
+    off the calendar roll forward to the next trading date.
+
+    >>> period_codes(pd.to_datetime(["1990-01-15", "1990-02-01", "1990-04-30"]), freq="MS").tolist()
+    [240, 241, 243]
+    """
+    dates = pd.DatetimeIndex(pd.to_datetime(dates))
+    if calendar is not None:
+        calendar = np.asarray(pd.DatetimeIndex(calendar).values)
+        return np.searchsorted(calendar, dates.values, side="left").astype(np.int64)
+    if freq is None:
+        raise ValueError("Either freq or calendar is required")
+    return dates.to_period(_PERIOD_FREQ.get(freq, freq)).asi8.astype(np.int64)
+
+
+def with_period_lags(
+    df=None,
+    columns=None,
+    id_columns=None,
+    lags=1,
+    date_col="date",
+    freq=None,
+    calendar=None,
+    prefix="L",
+    lead_prefix="F",
+):
+    """
+    Add lagged and lead columns with the gap-aware semantics of
+    `with_lagged_columns(resample=True)`, without pivoting the panel.
+
+    Dates are mapped to integer period codes (see `period_codes`), rows are
+    sorted once by (id, period) and each lag k looks up the key of period
+    p - k of the same id. The value is NaN when that period is missing, so a
+    gap in the panel is never bridged. Negative lags are leads. Memory is
+    linear in the long panel: unlike the resampled version, no rows are added
+    for missing periods. (id, period) pairs must be unique.
+
+    New columns are named f"{prefix}{k}_{col}" for lags and
+    f"{lead_prefix}{k}_{col}" for leads.
+
+    Examples
+    --------
+
+    ```
+    >>> df = pd.DataFrame({
+    ...     'id': ['B', 'B', 'B', 'B'],
+    ...     'date': pd.to_datetime(['1990-03-01', '1990-04-01', '1990-06-01', '1990-07-01']),
+    ...     'value': [3, 4, 6, 7]},
+    ... )
+    >>> out = with_period_lags(df, columns='value', id_columns='id', lags=[1, -1], freq='MS')
+    >>> out[['L1_value', 'F1_value']].to_numpy().tolist()
+    [[nan, 4.0], [3.0, nan], [nan, 7.0], [6.0, nan]]
+
+    ```
+    """
+    columns = [columns] if isinstance(columns, str) else list(columns)
+    id_columns = [id_columns] if isinstance(id_columns, str) else list(id_columns)
+    lags = [lags] if np.ndim(lags) == 0 else list(lags)
+
+    period = period_codes(df[date_col], freq=freq, calendar=calendar)
+    ids = df.groupby(id_columns, sort=False, dropna=False).ngroup().to_numpy()
+
+    # key = id * stride + period, with room for the largest shift on both sides
+    max_shift = int(np.max(np.abs(lags)))
+    offset = period - period.min() + max_shift if len(period) else period
+    stride = int(offset.max()) + 1 + max_shift if len(period) else 1
+    key = ids.astype(np.int64) * stride + offset
+
+    order = np.argsort(key, kind="stable")
+    sorted_key = key[order]
+    if (sorted_key[1:] == sorted_key[:-1]).any():
+        raise ValueError("(id, period) pairs are not unique")
+
+    new_columns = {}
+    for k in lags:
+        if k == 0:
+            continue
+        target = key - k
+        pos = np.minimum(np.searchsorted(sorted_key, target), len(key) - 1)
+        found = sorted_key[pos] == target if len(key) else np.zeros(0, dtype=bool)
+        source = order[pos]
+        name = f"{prefix}{k}" if k > 0 else f"{lead_prefix}{-k}"
+        for col in columns:
+            values = df[col].take(source).set_axis(df.index)
+            new_columns[f"{name}_{col}"] = values.where(found)
+
+    return df.assign(**new_columns)
+
+
 def leave_one_out_sums(df, groupby=[], summed_col=""):
     """
     Compute leave-one-out sums,
@@ -667,6 +1234,8 @@ def get_most_recent_quarter_end(d):
 
     ```
     """
+    from dateutil.relativedelta import relativedelta
+
     quarter_month = (d.month - 1) // 3 * 3 + 1
     quarter_end = datetime.datetime(d.year, quarter_month, 1) - relativedelta(days=1)
     return quarter_end
@@ -750,6 +1319,9 @@ def add_vertical_lines_to_plot(
     alpha=0.1,
     extend_to_nearest_quarter=True,
 ):
+    import matplotlib.dates as mdates
+    from matplotlib import pyplot as plt
+
     # start_date = '2019-09-10'
     # end_date = '2022-09-01'
     if extend_to_nearest_quarter:
@@ -842,13 +1414,20 @@ def plot_weighted_median_with_distribution_bars(
 
 
     """
+    from matplotlib import pyplot as plt
+
     if ax is None:
         plt.clf()
         _, ax = plt.subplots()
 
-    median_series = data.groupby(date_col).apply(
-        lambda x: weighted_quantile(x[variable_name], 0.5, sample_weight=x[weight_col])
+    bands = groupby_weighted_quantile(
+        data_col=variable_name,
+        weight_col=weight_col,
+        by_col=date_col,
+        data=data,
+        quantiles=[0.5, *percentiles[:2]],
     )
+    median_series = bands.iloc[:, 0]
     if rolling:
         wavrs = median_series.rolling(
             rolling_window, min_periods=rolling_min_periods
@@ -858,16 +1437,8 @@ def plot_weighted_median_with_distribution_bars(
     (wavrs * rescale_factor).plot(ax=ax, label=label)
 
     if percentile_bars:
-        lower = data.groupby(date_col).apply(
-            lambda x: weighted_quantile(
-                x[variable_name], percentiles[0], sample_weight=x[weight_col]
-            )
-        )
-        upper = data.groupby(date_col).apply(
-            lambda x: weighted_quantile(
-                x[variable_name], percentiles[1], sample_weight=x[weight_col]
-            )
-        )
+        lower = bands.iloc[:, 1]
+        upper = bands.iloc[:, 2]
         if rolling:
             lower = lower.rolling(
                 rolling_window, min_periods=rolling_min_periods
@@ -905,6 +1476,91 @@ def plot_weighted_median_with_distribution_bars(
     return ax
 
 
+def histogram_bin_index(values, edges):
+    """Histogram bin of each value, or -1 for NaN and values outside the edges.
+
+    Bin i covers [edges[i], edges[i+1]); the last bin is closed, as in
+    `np.histogram`.
+
+    >>> histogram_bin_index(np.array([0.0, 0.5, 1.0, 2.0, np.nan]), np.array([0.0, 0.5, 1.0])).tolist()
+    [0, 1, 1, -1, -1]
+    """
+    values = np.asarray(values, dtype=float)
+    edges = np.asarray(edges, dtype=float)
+    index = np.searchsorted(edges, values, side="right") - 1
+    index[values == edges[-1]] = len(edges) - 2
+    index[(index < 0) | (index >= len(edges) - 1) | np.isnan(values)] = -1
+    return index
+
+
+def histogram_counts(values, edges):
+    """Exact counts per bin; same result as `np.histogram(values, edges)[0]`
+    except that NaNs are ignored.
+    """
+    index = histogram_bin_index(values, edges)
+    return np.bincount(index[index >= 0], minlength=len(edges) - 1)
+
+
+def streaming_histogram(path, column, edges, batch_size=1_000_000):
+    """Exact histogram of one column of a Parquet file, read batch by batch.
+
+    Only the bin counts are kept in memory. Returns left, right and count
+    per bin.
+    """
+    import pyarrow.parquet as pq
+
+    edges = np.asarray(edges, dtype=float)
+    counts = np.zeros(len(edges) - 1, dtype=np.int64)
+    pf = pq.ParquetFile(path)
+    for batch in pf.iter_batches(batch_size=batch_size, columns=[column]):
+        values = batch.column(0).to_numpy(zero_copy_only=False)
+        counts += histogram_counts(values, edges)
+    return pd.DataFrame({"left": edges[:-1], "right": edges[1:], "count": counts})
+
+
+def lttb_downsample(x, y, n_out):
+    """Positions of the points kept by Largest-Triangle-Three-Buckets.
+
+    Keeps the first and last point and, from each of `n_out - 2` equal
+    buckets in between, the point forming the largest triangle with the
+    point kept in the previous bucket and the mean of the next bucket. `x`
+    must be sorted; datetimes are allowed. Returns all positions when
+    len(x) <= n_out.
+
+    >>> lttb_downsample(np.arange(6), np.array([0, 5, 0, 0, -5, 0]), 4).tolist()
+    [0, 1, 4, 5]
+    """
+    x = np.asarray(x)
+    if np.issubdtype(x.dtype, np.datetime64):
+        x = x.astype("datetime64[ns]").astype(np.int64)
+    x = x.astype(float)
+    y = np.asarray(y, dtype=float)
+    n = len(x)
+    if n_out >= n or n_out < 3:
+        return np.arange(n) if n_out >= n else np.array([0, n - 1])[:n_out]
+
+    # Bucket boundaries over the points between the first and the last
+    bounds = (1 + np.arange(n_out - 1) * (n - 2) / (n_out - 2)).astype(np.int64)
+    bounds[-1] = n - 1
+    keep = np.empty(n_out, dtype=np.int64)
+    keep[0], keep[-1] = 0, n - 1
+
+    a = 0
+    for i in range(n_out - 2):
+        lo, hi = bounds[i], bounds[i + 1]
+        if i + 2 < n_out - 1:
+            nxt = slice(bounds[i + 1], bounds[i + 2])
+            cx, cy = x[nxt].mean(), y[nxt].mean()
+        else:
+            cx, cy = x[-1], y[-1]
+        area = np.abs(
+            (x[a] - cx) * (y[lo:hi] - y[a]) - (x[a] - x[lo:hi]) * (cy - y[a])
+        )
+        a = lo + int(np.argmax(area))
+        keep[i + 1] = a
+    return keep
+
+
 def aligned_glimpse(
     df: pl.DataFrame,
     max_items: int = 10,
@@ -0,0 +1,88 @@
+"""
+Cheap fingerprints of Parquet files from their footers.
+
+A fingerprint hashes, for the requested columns only, the Arrow type and,
+per row group, the row count, value count, encoded sizes and the min / max /
+null-count statistics. Nothing but the footer is read, so fingerprinting a
+multi-GB file takes milliseconds, and rewriting a file with the same content
+(or changing only other columns) keeps its fingerprint.
+
+Column chunks written without statistics fall back to the file size and
+modification time. Edits that keep every size and statistic unchanged are
+not detected; use `dataset_diff.py` when that matters.
+
+A directory is fingerprinted as the sorted set of its `*.parquet` files
+(e.g. the yearly slices of a summary cube table).
+"""
+
+from __future__ import annotations
+
+import hashlib
+from pathlib import Path
+from typing import Iterable, Mapping, Optional, Sequence
+
+import pyarrow.parquet as pq
+
+
+def _file_parts(path: Path, columns: Optional[Sequence[str]]) -> Iterable[str]:
+    metadata = pq.read_metadata(path)
+    schema = metadata.schema.to_arrow_schema()
+    names = schema.names if columns is None else list(columns)
+    missing = [c for c in names if c not in schema.names]
+    if missing:
+        raise KeyError(f"Columns {missing} not in {path}")
+    yield f"rows={metadata.num_rows}"
+    yield from (f"{c}:{schema.field(c).type}" for c in names)
+
+    wanted = set(names)
+    has_stats = True
+    for rg in range(metadata.num_row_groups):
+        row_group = metadata.row_group(rg)
+        yield f"rg{rg}={row_group.num_rows}"
+        for c in range(row_group.num_columns):
+            chunk = row_group.column(c)
+            if chunk.path_in_schema.split(".")[0] not in wanted:
+                continue
+            st = chunk.statistics
+            yield (
+                f"{chunk.path_in_schema}:{chunk.num_values}:"
+                f"{chunk.total_compressed_size}:{chunk.total_uncompressed_size}"
+            )
+            if st is None:
+                has_stats = False
+                continue
+            yield f"{st.null_count if st.has_null_count else None}"
+            yield f"{st.min!r}:{st.max!r}" if st.has_min_max else "-"
+
+    if not has_stats:
+        stat = Path(path).stat()
+        yield f"file={stat.st_size}-{stat.st_mtime_ns}"
+
+
+def parquet_fingerprint(path: Path, columns: Optional[Sequence[str]] = None) -> str:
+    """
+    Hex digest of the footer of a Parquet file (or of every `*.parquet` file
+    in a directory), restricted to `columns` (all columns by default).
+    """
+    path = Path(path)
+    files = sorted(path.glob("*.parquet")) if path.is_dir() else [path]
+    if not files:
+        raise FileNotFoundError(f"No Parquet files in {path}")
+
+    h = hashlib.sha256()
+    for f in files:
+        h.update(f"{f.name}\n".encode())
+        for part in _file_parts(f, columns):
+            h.update(f"{part}\n".encode())
+    return h.hexdigest()
+
+
+def inputs_fingerprint(inputs: Mapping[Path, Optional[Sequence[str]]]) -> str:
+    """
+    Combined fingerprint of several {path: columns} inputs.
+    """
+    h = hashlib.sha256()
+    for path in sorted(inputs, key=str):
+        columns = inputs[path]
+        h.update(f"{path}:{parquet_fingerprint(path, columns)}\n".encode())
+    return h.hexdigest()
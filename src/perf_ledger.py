@@ -0,0 +1,294 @@
+"""
+Per-task performance ledger for the doit pipeline.
+
+`dodo.py` wraps every task between `start_task` and `finish_task` (two
+Python actions that run in the same process as the task's own actions,
+also under `doit -P process`). For each successful execution one row is
+added to the `task_runs` table of `.doit-perf.sqlite`, next to
+`.doit-db.sqlite`:
+
+ - wall_s, cpu_s: wall-clock and user+system CPU time, including the
+   subprocesses the task started;
+ - peak_rss_mb: peak resident memory of the task (its own, measured after
+   resetting the kernel high-water mark, or of its largest subprocess when
+   that exceeds every earlier subprocess of the worker);
+ - bytes_read, bytes_written: from /proc/self/io (rchar/wchar), which also
+   counts reaped subprocesses;
+ - rows_in, rows_out: Parquet rows of the task's file_dep and targets,
+   read from the footers.
+
+Memory and I/O need Linux /proc; elsewhere those columns are NULL. With
+`-P thread` concurrent tasks share one process and their numbers mix.
+
+After each task the run is compared with the median of that task's previous
+runs, and a warning is printed when it is much slower or larger. Print the
+trend of every task (or one task) with:
+
+    python ./src/perf_ledger.py
+    python ./src/perf_ledger.py --TASK=pull:ravenpack_firm_day
+"""
+
+from __future__ import annotations
+
+import resource
+import sqlite3
+import time
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional
+
+import pandas as pd
+
+from settings import config
+
+BASE_DIR = Path(config("BASE_DIR"))
+LEDGER_PATH = BASE_DIR / ".doit-perf.sqlite"
+
+# A run is flagged when a metric exceeds REGRESSION_RATIO times the median
+# of the task's previous REGRESSION_WINDOW runs
+REGRESSION_RATIO = 1.5
+REGRESSION_WINDOW = 5
+# ... and by at least this much (so that sub-second tasks are not flagged)
+REGRESSION_MIN_INCREASE = {
+    "wall_s": 5.0,
+    "cpu_s": 5.0,
+    "peak_rss_mb": 256.0,
+    "bytes_read": 256 * 2**20,
+}
+
+_COLUMNS = {
+    "run_id": "TEXT",
+    "task": "TEXT",
+    "started_at": "TEXT",
+    "wall_s": "REAL",
+    "cpu_s": "REAL",
+    "peak_rss_mb": "REAL",
+    "bytes_read": "INTEGER",
+    "bytes_written": "INTEGER",
+    "rows_in": "INTEGER",
+    "rows_out": "INTEGER",
+}
+
+# Snapshots taken by start_task, keyed by task name
+_RUNNING: Dict[str, dict] = {}
+
+
+########################################################################################
+## Measurements
+########################################################################################
+
+
+def _proc_io() -> Optional[Dict[str, int]]:
+    try:
+        lines = Path("/proc/self/io").read_text().splitlines()
+    except OSError:
+        return None
+    return {k: int(v) for k, v in (line.split(": ") for line in lines if line)}
+
+
+def _reset_peak_rss() -> bool:
+    """Reset the kernel's peak-RSS mark of this process (Linux only)."""
+    try:
+        Path("/proc/self/clear_refs").write_text("5")
+        return True
+    except OSError:
+        return False
+
+
+def _peak_rss_kb() -> Optional[int]:
+    try:
+        status = Path("/proc/self/status").read_text()
+    except OSError:
+        return None
+    for line in status.splitlines():
+        if line.startswith("VmHWM:"):
+            return int(line.split()[1])
+    return None
+
+
+def _cpu_seconds() -> float:
+    total = 0.0
+    for who in (resource.RUSAGE_SELF, resource.RUSAGE_CHILDREN):
+        usage = resource.getrusage(who)
+        total += usage.ru_utime + usage.ru_stime
+    return total
+
+
+def parquet_rows(paths: Iterable) -> Optional[int]:
+    """Total rows of the existing Parquet files among `paths` (footers only)."""
+    import pyarrow.parquet as pq
+
+    files = [
+        Path(p) for p in paths if str(p).endswith(".parquet") and Path(p).is_file()
+    ]
+    if not files:
+        return None
+    return sum(pq.read_metadata(f).num_rows for f in files)
+
+
+########################################################################################
+## Ledger
+########################################################################################
+
+
+def connect(ledger_path: Path = LEDGER_PATH) -> sqlite3.Connection:
+    conn = sqlite3.connect(ledger_path)
+    columns = ", ".join(f"{name} {kind}" for name, kind in _COLUMNS.items())
+    conn.execute(f"CREATE TABLE IF NOT EXISTS task_runs ({columns})")
+    conn.execute(
+        "CREATE INDEX IF NOT EXISTS task_runs_task ON task_runs (task, started_at)"
+    )
+    return conn
+
+
+def start_task(task: str, run_id: str) -> None:
+    """doit action placed before a task's own actions."""
+    _reset_peak_rss()
+    _RUNNING[task] = {
+        "run_id": run_id,
+        "started_at": datetime.now().isoformat(timespec="seconds"),
+        "t0": time.perf_counter(),
+        "cpu0": _cpu_seconds(),
+        "io0": _proc_io(),
+        "child_rss0": resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss,
+    }
+
+
+def finish_task(
+    task: str,
+    run_id: str,
+    inputs: Iterable = (),
+    outputs: Iterable = (),
+    ledger_path: Path = LEDGER_PATH,
+) -> None:
+    """
+    doit action placed after a task's own actions; records the run.
+    `inputs` and `outputs` are the task's file_dep and targets (doit reserves
+    those argument names).
+    """
+    start = _RUNNING.pop(task, None)
+    if start is None or start["run_id"] != run_id:
+        return
+
+    io1 = _proc_io()
+    io0 = start["io0"]
+    child_rss = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+    peaks = [_peak_rss_kb()]
+    if child_rss > start["child_rss0"]:
+        peaks.append(child_rss)
+    peaks = [p for p in peaks if p is not None]
+
+    row = {
+        "run_id": run_id,
+        "task": task,
+        "started_at": start["started_at"],
+        "wall_s": time.perf_counter() - start["t0"],
+        "cpu_s": _cpu_seconds() - start["cpu0"],
+        "peak_rss_mb": max(peaks) / 1024 if peaks else None,
+        "bytes_read": io1["rchar"] - io0["rchar"] if io0 and io1 else None,
+        "bytes_written": io1["wchar"] - io0["wchar"] if io0 and io1 else None,
+        "rows_in": parquet_rows(inputs),
+        "rows_out": parquet_rows(outputs),
+    }
+
+    conn = connect(ledger_path)
+    try:
+        for message in check_regression(conn, row):
+            print(message)
+        with conn:
+            conn.execute(
+                f"INSERT INTO task_runs ({', '.join(_COLUMNS)}) "
+                f"VALUES ({', '.join('?' * len(_COLUMNS))})",
+                [row[c] for c in _COLUMNS],
+            )
+    finally:
+        conn.close()
+
+
+def check_regression(
+    conn: sqlite3.Connection,
+    row: dict,
+    window: int = REGRESSION_WINDOW,
+    ratio: float = REGRESSION_RATIO,
+) -> List[str]:
+    """
+    Warnings for the metrics of `row` that exceed `ratio` times the median of
+    the task's previous `window` runs (and the median plus
+    REGRESSION_MIN_INCREASE).
+    """
+    previous = pd.read_sql_query(
+        "SELECT * FROM task_runs WHERE task = ? ORDER BY started_at DESC LIMIT ?",
+        conn,
+        params=(row["task"], window),
+    )
+    messages = []
+    for metric, min_increase in REGRESSION_MIN_INCREASE.items():
+        baseline = previous[metric].median()
+        value = row[metric]
+        if value is None or pd.isna(baseline):
+            continue
+        if value > ratio * baseline and value - baseline >= min_increase:
+            messages.append(
+                f"PERF REGRESSION {row['task']}: {metric} = {value:,.2f} "
+                f"vs median {baseline:,.2f} of the last {len(previous)} runs"
+            )
+    return messages
+
+
+def load_ledger(ledger_path: Path = LEDGER_PATH) -> pd.DataFrame:
+    conn = connect(ledger_path)
+    try:
+        return pd.read_sql_query(
+            "SELECT * FROM task_runs ORDER BY task, started_at", conn
+        )
+    finally:
+        conn.close()
+
+
+def task_trend(
+    ledger: pd.DataFrame, task: Optional[str] = None, last: int = 10
+) -> pd.DataFrame:
+    """
+    The last `last` runs of each task with the change of wall time and peak
+    memory relative to the task's previous run.
+    """
+    if task is not None:
+        ledger = ledger[ledger["task"] == task]
+    ledger = ledger.sort_values(["task", "started_at"], kind="stable")
+    g = ledger.groupby("task")
+    trend = ledger.assign(
+        wall_change=g["wall_s"].pct_change(fill_method=None),
+        rss_change=g["peak_rss_mb"].pct_change(fill_method=None),
+    )
+    trend = trend.groupby("task").tail(last)
+    columns = [
+        "task",
+        "started_at",
+        "wall_s",
+        "wall_change",
+        "cpu_s",
+        "peak_rss_mb",
+        "rss_change",
+        "bytes_read",
+        "bytes_written",
+        "rows_in",
+        "rows_out",
+    ]
+    trend = trend[columns].reset_index(drop=True)
+    counts = ["bytes_read", "bytes_written", "rows_in", "rows_out"]
+    trend[counts] = trend[counts].astype("Int64")
+    return trend
+
+
+if __name__ == "__main__":
+    trend = task_trend(load_ledger(), task=config("TASK", default=None))
+    if trend.empty:
+        print(f"No task runs recorded in {LEDGER_PATH}")
+    with pd.option_context("display.max_rows", None, "display.width", 200):
+        for task, runs in trend.groupby("task", sort=True):
+            print(f"\n{task}")
+            print(
+                runs.drop(columns="task").to_string(
+                    index=False, float_format="{:,.2f}".format
+                )
+            )
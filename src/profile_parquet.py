@@ -0,0 +1,392 @@
+"""
+Compact profiles of the pipeline's Parquet datasets.
+
+Most of a profile comes straight from the Parquet footer, without reading
+any data pages:
+
+ - row and row-group counts;
+ - per-column min, max and null counts (row-group statistics, combined);
+ - rows per year of the dataset's date column. Each row group whose date
+   statistics fall within a single year is counted from the footer. Only the
+   date column of row groups spanning a year end is actually read.
+
+Distinct counts and quantiles come from mergeable streaming sketches, built
+in one pass over the row groups:
+
+ - HyperLogLog (2**HLL_PRECISION registers of uint8) on 64-bit hashes, for
+   every column;
+ - a merging t-digest (centroid means and weights) for numeric columns.
+
+The result is a small JSON file per dataset in DATA_DIR/profiles that chartbook
+pages and notebooks can read with `load_profile` instead of loading the data.
+"""
+
+from __future__ import annotations
+
+import json
+from datetime import UTC, datetime
+from pathlib import Path
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+
+from settings import config
+
+DATA_DIR = Path(config("DATA_DIR"))
+PROFILE_DIR = DATA_DIR / "profiles"
+
+# dataset name -> (file in DATA_DIR, date column), as in chartbook.toml
+DATASETS = {
+    "crsp_daily": ("CRSP_DAILY_PAPER_UNIVERSE.parquet", "date"),
+    "ravenpack_djpr": ("ravenpack_djpr.parquet", "timestamp_utc"),
+    "ravenpack_crsp_merged": ("ravenpack_crsp_merged.parquet", "date"),
+    "ravenpack_firm_day": ("ravenpack_firm_day.parquet", "trading_date"),
+}
+
+HLL_PRECISION = 14
+TDIGEST_DELTA = 200
+PROFILE_QUANTILES = [0.0, 0.01, 0.05, 0.25, 0.5, 0.75, 0.95, 0.99, 1.0]
+
+
+########################################################################################
+## HyperLogLog
+########################################################################################
+
+
+def hll_empty(precision: int = HLL_PRECISION) -> np.ndarray:
+    return np.zeros(2**precision, dtype=np.uint8)
+
+
+def _bit_length(x: np.ndarray) -> np.ndarray:
+    """Bit length of uint64 values (0 for 0), exact via 32-bit halves."""
+    hi = (x >> np.uint64(32)).astype(np.float64)
+    lo = (x & np.uint64(0xFFFFFFFF)).astype(np.float64)
+    return np.where(hi > 0, 32 + np.frexp(hi)[1], np.frexp(lo)[1])
+
+
+def hll_update(registers: np.ndarray, hashes: np.ndarray) -> np.ndarray:
+    """
+    Add 64-bit hashes to the registers (in place) and return them.
+    """
+    p = int(np.log2(len(registers)))
+    hashes = np.asarray(hashes, dtype=np.uint64)
+    idx = (hashes >> np.uint64(64 - p)).astype(np.int64)
+    rest = hashes << np.uint64(p)
+    rho = np.minimum(64 - _bit_length(rest) + 1, 64 - p + 1).astype(np.uint8)
+    np.maximum.at(registers, idx, rho)
+    return registers
+
+
+def hll_merge(a: np.ndarray, b: np.ndarray) -> np.ndarray:
+    return np.maximum(a, b)
+
+
+def hll_estimate(registers: np.ndarray) -> float:
+    """
+    Cardinality estimate, with the small-range (linear counting) correction.
+    """
+    m = len(registers)
+    alpha = 0.7213 / (1 + 1.079 / m)
+    estimate = alpha * m * m / np.sum(np.ldexp(1.0, -registers.astype(np.int64)))
+    zeros = int(np.sum(registers == 0))
+    if estimate <= 2.5 * m and zeros > 0:
+        estimate = m * np.log(m / zeros)
+    return float(estimate)
+
+
+########################################################################################
+## t-digest
+########################################################################################
+
+
+def tdigest_empty() -> Tuple[np.ndarray, np.ndarray]:
+    return np.zeros(0), np.zeros(0)
+
+
+def _tdigest_compress(
+    means: np.ndarray, weights: np.ndarray, delta: float = TDIGEST_DELTA
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Merge sorted points into centroids whose k-scale span is about one unit,
+    k(q) = delta / (2 pi) * arcsin(2q - 1), so centroids are small in the tails.
+    """
+    if len(means) == 0:
+        return means, weights
+    order = np.argsort(means, kind="stable")
+    means, weights = means[order], weights[order]
+    total = weights.sum()
+    q_mid = (np.cumsum(weights) - 0.5 * weights) / total
+    k = delta / (2 * np.pi) * np.arcsin(2 * q_mid - 1)
+    cluster = np.floor(k - k[0]).astype(np.int64)
+    cluster = np.unique(cluster, return_inverse=True)[1]
+    w = np.bincount(cluster, weights=weights)
+    m = np.bincount(cluster, weights=weights * means) / w
+    return m, w
+
+
+def tdigest_update(
+    digest: Tuple[np.ndarray, np.ndarray],
+    values: np.ndarray,
+    delta: float = TDIGEST_DELTA,
+) -> Tuple[np.ndarray, np.ndarray]:
+    values = np.asarray(values, dtype=np.float64)
+    values = values[np.isfinite(values)]
+    means = np.concatenate([digest[0], values])
+    weights = np.concatenate([digest[1], np.ones(len(values))])
+    return _tdigest_compress(means, weights, delta)
+
+
+def tdigest_merge(a, b, delta: float = TDIGEST_DELTA):
+    return _tdigest_compress(
+        np.concatenate([a[0], b[0]]), np.concatenate([a[1], b[1]]), delta
+    )
+
+
+def tdigest_quantiles(
+    digest: Tuple[np.ndarray, np.ndarray],
+    quantiles: Sequence[float],
+    vmin: Optional[float] = None,
+    vmax: Optional[float] = None,
+) -> np.ndarray:
+    """
+    Interpolate quantiles between centroid centres; `vmin`/`vmax` (exact
+    extremes, e.g. from the footer) pin the ends.
+    """
+    means, weights = digest
+    if len(means) == 0:
+        return np.full(len(quantiles), np.nan)
+    total = weights.sum()
+    centres = np.cumsum(weights) - 0.5 * weights
+    lo = means[0] if vmin is None else vmin
+    hi = means[-1] if vmax is None else vmax
+    x = np.r_[0.0, centres, total]
+    y = np.r_[lo, means, hi]
+    return np.interp(np.asarray(quantiles) * total, x, y)
+
+
+########################################################################################
+## Footer statistics
+########################################################################################
+
+
+def _jsonable(value):
+    if value is None:
+        return None
+    if isinstance(value, (pd.Timestamp, datetime)):
+        return value.isoformat()
+    if isinstance(value, bytes):
+        return value.decode("utf-8", errors="replace")
+    if isinstance(value, (np.integer, np.floating)):
+        return value.item()
+    if isinstance(value, float) and not np.isfinite(value):
+        return None
+    if isinstance(value, (int, float, str, bool)):
+        return value
+    return str(value)
+
+
+def footer_column_stats(metadata: pq.FileMetaData) -> Dict[str, dict]:
+    """
+    Combine row-group statistics into per-column min, max and null counts.
+    Values are None when some row group has no statistics for the column.
+    """
+    stats: Dict[str, dict] = {}
+    for rg in range(metadata.num_row_groups):
+        row_group = metadata.row_group(rg)
+        for c in range(row_group.num_columns):
+            chunk = row_group.column(c)
+            s = stats.setdefault(
+                chunk.path_in_schema,
+                {"min": None, "max": None, "null_count": 0, "has_min_max": True},
+            )
+            st = chunk.statistics
+            if st is None or not st.has_null_count or s["null_count"] is None:
+                s["null_count"] = None
+            else:
+                s["null_count"] += st.null_count
+            if st is None or not st.has_min_max:
+                # An all-null row group has no min/max but does not matter
+                if st is None or st.null_count != row_group.num_rows:
+                    s["has_min_max"] = False
+                continue
+            s["min"] = st.min if s["min"] is None else min(s["min"], st.min)
+            s["max"] = st.max if s["max"] is None else max(s["max"], st.max)
+    for s in stats.values():
+        if not s.pop("has_min_max"):
+            s["min"] = s["max"] = None
+    return stats
+
+
+def coverage_by_year(pf: pq.ParquetFile, date_col: str) -> Tuple[Dict[str, int], int]:
+    """
+    Rows per year of `date_col`, mostly from row-group statistics.
+
+    Returns (counts, number of row groups whose dates had to be read).
+    """
+    metadata = pf.metadata
+    names = pf.schema_arrow.names
+    if date_col not in names:
+        return {}, 0
+    col_idx = names.index(date_col)
+
+    counts: Dict[str, int] = {}
+    n_read = 0
+    for rg in range(metadata.num_row_groups):
+        row_group = metadata.row_group(rg)
+        st = row_group.column(col_idx).statistics
+        if (
+            st is not None
+            and st.has_min_max
+            and st.has_null_count
+            and st.null_count == 0
+            and pd.Timestamp(st.min).year == pd.Timestamp(st.max).year
+        ):
+            year = str(pd.Timestamp(st.min).year)
+            counts[year] = counts.get(year, 0) + row_group.num_rows
+            continue
+        n_read += 1
+        dates = pf.read_row_group(rg, columns=[date_col]).column(0).to_pandas()
+        years = pd.to_datetime(dates).dt.year
+        for year, n in years.value_counts(dropna=False).items():
+            key = "null" if pd.isna(year) else str(int(year))
+            counts[key] = counts.get(key, 0) + int(n)
+    counts = dict(sorted(counts.items()))
+    return counts, n_read
+
+
+########################################################################################
+## Profiles
+########################################################################################
+
+
+def _sketch_values(array: pa.ChunkedArray | pa.Array):
+    """
+    (hashes of non-null values, numeric values or None).
+
+    Nulls are dropped in Arrow before converting, so the values keep the
+    column's type: an int64 batch with a null would otherwise become float64
+    and hash differently from the same values in a batch without nulls.
+    """
+    series = pc.drop_null(array).to_pandas()
+    series = series[series.notna()]
+    is_numeric = pd.api.types.is_numeric_dtype(
+        series
+    ) and not pd.api.types.is_bool_dtype(series)
+    if pd.api.types.is_datetime64_any_dtype(series):
+        values = series.to_numpy("datetime64[ns]").view("int64")
+        return pd.util.hash_array(values), None
+    hashes = pd.util.hash_array(series.to_numpy())
+    return hashes, series.to_numpy(dtype=np.float64) if is_numeric else None
+
+
+def profile_parquet(
+    path: Path,
+    date_col: Optional[str] = None,
+    sketch_columns: Optional[List[str]] = None,
+    quantiles: Sequence[float] = PROFILE_QUANTILES,
+    batch_size: int = 1_000_000,
+) -> dict:
+    """
+    Build the profile of one Parquet file (see the module docstring).
+    """
+    path = Path(path)
+    pf = pq.ParquetFile(path)
+    metadata = pf.metadata
+    schema = pf.schema_arrow
+    if sketch_columns is None:
+        sketch_columns = list(schema.names)
+
+    footer = footer_column_stats(metadata)
+    coverage, n_read = ({}, 0) if date_col is None else coverage_by_year(pf, date_col)
+
+    hll = {c: hll_empty() for c in sketch_columns}
+    digests = {c: tdigest_empty() for c in sketch_columns}
+    for batch in pf.iter_batches(batch_size=batch_size, columns=sketch_columns):
+        for c in sketch_columns:
+            hashes, numeric = _sketch_values(batch.column(c))
+            hll_update(hll[c], hashes)
+            if numeric is not None:
+                digests[c] = tdigest_update(digests[c], numeric)
+
+    columns = {}
+    for field in schema:
+        stats = footer.get(field.name, {})
+        entry = {
+            "type": str(field.type),
+            "null_count": stats.get("null_count"),
+            "min": _jsonable(stats.get("min")),
+            "max": _jsonable(stats.get("max")),
+        }
+        if field.name in hll:
+            entry["distinct_approx"] = round(hll_estimate(hll[field.name]))
+        if field.name in digests and len(digests[field.name][0]):
+            vmin, vmax = stats.get("min"), stats.get("max")
+            numeric_ends = all(
+                isinstance(v, (int, float)) and not isinstance(v, bool)
+                for v in (vmin, vmax)
+            )
+            q = tdigest_quantiles(
+                digests[field.name],
+                quantiles,
+                vmin=vmin if numeric_ends else None,
+                vmax=vmax if numeric_ends else None,
+            )
+            entry["quantiles"] = {str(k): _jsonable(v) for k, v in zip(quantiles, q)}
+        columns[field.name] = entry
+
+    stat = path.stat()
+    return {
+        "path": str(path),
+        "file_size": stat.st_size,
+        "file_mtime": stat.st_mtime,
+        "created_utc": datetime.now(UTC).isoformat(timespec="seconds"),
+        "num_rows": metadata.num_rows,
+        "num_row_groups": metadata.num_row_groups,
+        "date_col": date_col,
+        "coverage_by_year": coverage,
+        "coverage_row_groups_read": n_read,
+        "columns": columns,
+    }
+
+
+def save_profile(dataset: str, profile_dir: Path = PROFILE_DIR, **kwargs) -> Path:
+    """
+    Profile one of `DATASETS` and write DATA_DIR/profiles/<dataset>.json.
+    """
+    filename, date_col = DATASETS[dataset]
+    profile = profile_parquet(DATA_DIR / filename, date_col=date_col, **kwargs)
+    profile["dataset"] = dataset
+
+    out_path = Path(profile_dir) / f"{dataset}.json"
+    out_path.parent.mkdir(parents=True, exist_ok=True)
+    out_path.write_text(json.dumps(profile, indent=1))
+    print(
+        f"Saved profile of {dataset} ({profile['num_rows']:,} rows, "
+        f"{profile['coverage_row_groups_read']} row groups read for coverage) -> {out_path}"
+    )
+    return out_path
+
+
+def load_profile(dataset: str, profile_dir: Path = PROFILE_DIR) -> dict:
+    """
+    Read a saved profile.
+    """
+    return json.loads((Path(profile_dir) / f"{dataset}.json").read_text())
+
+
+def main(dataset: Optional[str] = None):
+    """Profile one dataset (or every one in DATASETS that exists)."""
+    dataset = dataset or config("PROFILE_DATASET", default=None)
+    for name in [dataset] if dataset else DATASETS:
+        if (DATA_DIR / DATASETS[name][0]).exists():
+            save_profile(name)
+        else:
+            print(f"Skipping {name} (not found)")
+
+
+if __name__ == "__main__":
+    main()
@@ -17,10 +17,11 @@ for 3-day cumulative return labels).
 from pathlib import Path
 
 import numpy as np
-import pandas as pd
-import wrds
 
+from arrow_cache import read_parquet_cached
+from parquet_layout import write_parquet
 from settings import config
+from summary_cube import update_crsp_cube
 
 DATA_DIR = Path(config("DATA_DIR"))
 WRDS_USERNAME = config("WRDS_USERNAME")
@@ -66,6 +67,8 @@ def pull_CRSP_daily_file(
         msenames.shrcd IN (10, 11) -- Ordinary Common Shares
     """
 
+    import wrds
+
     db = wrds.Connection(wrds_username=wrds_username)
     print("Executing query... this may take time due to daily data volume.")
     df = db.raw_sql(query, date_cols=["date"])
@@ -143,10 +146,13 @@ def apply_delisting_returns(df):
     return df
 
 
-def load_CRSP_daily_file(data_dir=DATA_DIR):
-    """Load saved daily CRSP stock data from parquet file."""
+def load_CRSP_daily_file(data_dir=DATA_DIR, columns=None, use_cache=None):
+    """
+    Load saved daily CRSP stock data from parquet file (through its
+    memory-mapped Arrow cache, see arrow_cache.py).
+    """
     path = Path(data_dir) / "CRSP_DAILY_PAPER_UNIVERSE.parquet"
-    df = pd.read_parquet(path)
+    df = read_parquet_cached(path, columns=columns, use_cache=use_cache)
     return df
 
 
@@ -165,10 +171,16 @@ def get_russell_1000_proxy(df):
     return df_russell
 
 
-if __name__ == "__main__":
+def main():
     df_daily = pull_CRSP_daily_file()
     df_universe = get_russell_1000_proxy(df_daily)
 
     path = Path(DATA_DIR) / "CRSP_DAILY_PAPER_UNIVERSE.parquet"
-    df_universe.to_parquet(path)
+    write_parquet(df_universe, path, "crsp")
     print(f"Saved {len(df_universe)} rows to {path}")
+
+    update_crsp_cube(df_universe)
+
+
+if __name__ == "__main__":
+    main()
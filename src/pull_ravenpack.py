@@ -5,9 +5,11 @@ from pathlib import Path
 from typing import List, Optional, Tuple
 
 import pandas as pd
+import pyarrow as pa
 import pyarrow.parquet as pq
-import wrds
+from parquet_layout import write_parquet, write_sorted_from_files
 from settings import config
+from summary_cube import update_ravenpack_cube
 
 DATA_DIR = Path(config("DATA_DIR"))
 WRDS_USERNAME = config("WRDS_USERNAME")
@@ -67,7 +69,7 @@ def year_bounds_for_project(year: int) -> Tuple[str, str]:
     return (f"{year}-01-01", f"{year}-12-31")
 
 
-def _year_file_path(year: int) -> Path:
+def year_file_path(year: int) -> Path:
     return YEAR_DIR / f"ravenpack_djpr_{year}.parquet"
 
 
@@ -126,6 +128,8 @@ def pull_ravenpack_single_firm_year(
     ;
     """
 
+    import wrds
+
     db = wrds.Connection(wrds_username=WRDS_USERNAME)
     try:
         df = db.raw_sql(sql, date_cols=["timestamp_utc"])
@@ -137,6 +141,46 @@ def pull_ravenpack_single_firm_year(
     return df
 
 
+def pull_ravenpack_year(
+    year: int,
+    event_only: bool = False,
+    limit: Optional[int] = None,
+    max_retries: int = 3,
+    retry_sleep_seconds: int = 10,
+) -> Path:
+    """
+    Pull one year into YEAR_DIR (overwriting it), retrying up to max_retries.
+    """
+    YEAR_DIR.mkdir(parents=True, exist_ok=True)
+    out_y = year_file_path(year)
+    y_start, y_end = year_bounds_for_project(year)
+
+    attempt = 0
+    while True:
+        attempt += 1
+        try:
+            print(f"Pulling RavenPack {year} ({y_start} to {y_end}) [attempt {attempt}] ...")
+            df_y = pull_ravenpack_single_firm_year(
+                year=year,
+                start_date=y_start,
+                end_date=y_end,
+                limit=limit,            # None = full year
+                event_only=event_only,  # False = true superset
+            )
+
+            df_y["year"] = year
+            write_parquet(df_y, out_y, "ravenpack")
+            print(f"  saved {len(df_y):,} rows -> {out_y}")
+            return out_y
+
+        except Exception as e:
+            print(f"  ERROR pulling {year}: {e}")
+            if attempt >= max_retries:
+                raise
+            print(f"  retrying in {retry_sleep_seconds}s ...")
+            time.sleep(retry_sleep_seconds)
+
+
 def pull_missing_years_to_parquet(
     event_only: bool = False,
     limit: Optional[int] = None,
@@ -154,51 +198,42 @@ def pull_missing_years_to_parquet(
     saved: List[Path] = []
 
     for y in years:
-        out_y = _year_file_path(y)
+        out_y = year_file_path(y)
 
         if out_y.exists() and not force:
             print(f"Skipping {y} (already exists): {out_y}")
             saved.append(out_y)
             continue
 
-        y_start, y_end = year_bounds_for_project(y)
-
-        attempt = 0
-        while True:
-            attempt += 1
-            try:
-                print(f"Pulling RavenPack {y} ({y_start} to {y_end}) [attempt {attempt}] ...")
-                df_y = pull_ravenpack_single_firm_year(
-                    year=y,
-                    start_date=y_start,
-                    end_date=y_end,
-                    limit=limit,            # None = full year
-                    event_only=event_only,  # False = true superset
-                )
-
-                df_y["year"] = y
-                df_y.to_parquet(out_y, index=False)
-                print(f"  saved {len(df_y):,} rows -> {out_y}")
-                saved.append(out_y)
-                break
-
-            except Exception as e:
-                print(f"  ERROR pulling {y}: {e}")
-                if attempt >= max_retries:
-                    raise
-                print(f"  retrying in {retry_sleep_seconds}s ...")
-                time.sleep(retry_sleep_seconds)
+        saved.append(
+            pull_ravenpack_year(
+                y,
+                event_only=event_only,
+                limit=limit,
+                max_retries=max_retries,
+                retry_sleep_seconds=retry_sleep_seconds,
+            )
+        )
 
     return saved
 
 
+def _conform_table(table: pa.Table, schema: pa.Schema) -> pa.Table:
+    """Add missing columns as nulls, order and cast them as in `schema`."""
+    for field in schema:
+        if field.name not in table.column_names:
+            table = table.append_column(field, pa.nulls(table.num_rows, field.type))
+    return table.select(schema.names).cast(schema)
+
+
 def combine_year_parquets_to_single(
     out_path: Path | None = None,
     year_files: Optional[List[Path]] = None,
 ) -> Path:
     """
-    Combine yearly parquet files into ONE parquet file efficiently using pyarrow ParquetWriter.
-    This avoids loading everything into memory.
+    Combine yearly parquet files into ONE parquet file sorted by
+    (rp_entity_id, timestamp_utc) (see parquet_layout.py). The files are read
+    one range of entities at a time, which avoids loading everything into memory.
     """
     if out_path is None:
         out_path = DATA_DIR / "ravenpack_djpr.parquet"
@@ -209,19 +244,15 @@ def combine_year_parquets_to_single(
     if not year_files:
         raise FileNotFoundError(f"No yearly parquet files found in {YEAR_DIR}")
 
-    writer: pq.ParquetWriter | None = None
-    try:
-        for p in year_files:
-            table = pq.read_table(p)
-            if writer is None:
-                writer = pq.ParquetWriter(out_path, table.schema, compression="snappy")
-            writer.write_table(table)
-            print(f"Appended {p.name} ({table.num_rows:,} rows)")
-    finally:
-        if writer is not None:
-            writer.close()
-
-    print(f"Wrote combined parquet -> {out_path}")
+    # Years can disagree on types (e.g. an all-null column, or int64 vs
+    # float64 permno after a left merge), so write with a unified schema.
+    schema = pa.unify_schemas(
+        [pq.read_schema(p) for p in year_files], promote_options="permissive"
+    )
+    rows = write_sorted_from_files(
+        year_files, out_path, "ravenpack", schema=schema, conform=_conform_table
+    )
+    print(f"Wrote combined parquet ({rows:,} rows) -> {out_path}")
     return out_path
 
 
@@ -245,15 +276,36 @@ def save_ravenpack_parquet(
         max_retries=max_retries,
         retry_sleep_seconds=retry_sleep_seconds,
     )
-    return combine_year_parquets_to_single(out_path=out_path, year_files=year_files)
+    out_path = combine_year_parquets_to_single(out_path=out_path, year_files=year_files)
+    update_ravenpack_cube(year_files)
+    return out_path
+
+
+def main(step: Optional[str] = None, year: Optional[int] = None) -> None:
+    """
+    doit runs one year per task (step="pull", year=2005), then
+    step="combine"; with step="all" everything runs in one go. From the
+    command line: --STEP=pull --YEAR=2005.
+    """
+    step = step or config("STEP", default="all")
+    if step == "pull":
+        pull_ravenpack_year(year or int(config("YEAR")))
+    elif step == "combine":
+        year_files = [year_file_path(y) for y in year_range(START_DATE, END_DATE)]
+        combine_year_parquets_to_single(
+            out_path=DATA_DIR / "ravenpack_djpr.parquet", year_files=year_files
+        )
+        update_ravenpack_cube(year_files)
+    else:
+        save_ravenpack_parquet(
+            out_path=DATA_DIR / "ravenpack_djpr.parquet",
+            event_only=False,  # superset
+            limit=None,        # set to e.g. 10000 for a test run
+            force=False,       # only pull missing years
+            max_retries=3,
+            retry_sleep_seconds=10,
+        )
 
 
 if __name__ == "__main__":
-    save_ravenpack_parquet(
-        out_path=DATA_DIR / "ravenpack_djpr.parquet",
-        event_only=False,  # superset
-        limit=None,        # set to e.g. 10000 for a test run
-        force=False,       # only pull missing years
-        max_retries=3,
-        retry_sleep_seconds=10,
-    )
\ No newline at end of file
+    main()
@@ -6,7 +6,6 @@ from pathlib import Path
 from typing import List, Optional, Tuple
 
 import pandas as pd
-import wrds
 from settings import config
 
 DATA_DIR = Path(config("DATA_DIR"))
@@ -120,6 +119,8 @@ def pull_ravenpack_single_firm_year(
     ;
     """
 
+    import wrds
+
     db = wrds.Connection(wrds_username=WRDS_USERNAME)
     try:
         df = db.raw_sql(sql, date_cols=["timestamp_utc"])
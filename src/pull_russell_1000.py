@@ -14,8 +14,8 @@ import io
 from pathlib import Path
 
 import pandas as pd
-import requests
 
+from arrow_cache import read_parquet_cached
 from settings import config
 
 DATA_DIR = Path(config("DATA_DIR"))
@@ -30,6 +30,8 @@ def pull_russell_1000_constituents():
     # URL for the iShares Russell 1000 ETF (IWB) holdings
     url = "https://www.ishares.com/us/products/239707/ishares-russell-1000-etf/1467271812596.ajax?fileType=csv&fileName=IWB_holdings&dataType=fund"
 
+    import requests
+
     response = requests.get(url)
     response.raise_for_status()
 
@@ -57,10 +59,13 @@ def pull_russell_1000_constituents():
     return df
 
 
-def load_russell_1000_constituents(data_dir=DATA_DIR):
-    """Load saved Russell 1000 constituents from parquet file."""
+def load_russell_1000_constituents(data_dir=DATA_DIR, use_cache=None):
+    """
+    Load saved Russell 1000 constituents from parquet file (through its
+    memory-mapped Arrow cache, see arrow_cache.py).
+    """
     path = Path(data_dir) / "RUSSELL_1000_CONSTITUENTS.parquet"
-    df = pd.read_parquet(path)
+    df = read_parquet_cached(path, use_cache=use_cache)
     return df
 
 
@@ -70,7 +75,7 @@ def _demo():
     print(df.head())
 
 
-if __name__ == "__main__":
+def main():
     df = pull_russell_1000_constituents()
     print(f"Successfully retrieved {len(df)} tickers.")
     print(f"First 10 tickers: {df['Ticker'].head(10).tolist()}")
@@ -78,3 +83,7 @@ if __name__ == "__main__":
     path = Path(DATA_DIR) / "RUSSELL_1000_CONSTITUENTS.parquet"
     df.to_parquet(path)
     print(f"Saved to {path}")
+
+
+if __name__ == "__main__":
+    main()
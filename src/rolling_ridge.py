@@ -0,0 +1,400 @@
+"""
+Rolling-window ridge/OLS return prediction from headline embeddings.
+
+Chen, Kelly, and Xiu (2022) re-estimate their models on rolling windows.
+Refitting from scratch for every window recomputes X'X and X'y over years of
+overlapping data. Instead, this module:
+
+ 1. Builds a story-level panel: rp_story_id, permno, trading_date,
+    headline_id and the label `ret_lead1` (the firm's CRSP return on the
+    trading day after the news trading date).
+ 2. Computes sufficient statistics once per period (month by default):
+    n, sum(x), sum(y), X'X, X'y and y'y. Rows of X are read from the
+    memory-mapped embedding matrix in small chunks.
+ 3. Walks forward through time. The window statistics are updated by adding
+    the newest period and subtracting the one that left the window, and a
+    ridge (or OLS, alpha=0) regression with an unpenalised intercept is
+    solved from them.
+ 4. Predicts the period right after each window (out of sample).
+
+The ridge penalty can be tuned per window by blocked k-fold cross-validation
+over the window's periods. Each fold needs one eigendecomposition of its
+training Gram matrix; the whole penalty grid is then evaluated in closed
+form from that decomposition and the held-out fold's statistics, so a grid
+of 50 penalties costs about as much as a single fit.
+
+Each period's rows are touched twice in total (statistics and prediction),
+regardless of the window length.
+"""
+
+from __future__ import annotations
+
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional, Sequence, Tuple
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from aggregate_ravenpack import load_trading_calendar, trading_date_codes
+from embed_headlines import load_headline_embeddings, load_story_headline_ids
+from load_data import load
+from settings import config
+
+DATA_DIR = Path(config("DATA_DIR"))
+
+LABEL_COL = "ret_lead1"
+
+# Penalty grid searched by cross-validation
+ALPHA_GRID = np.logspace(-2, 6, 50)
+
+
+def build_prediction_panel(
+    ravenpack_with_permno_path: Optional[Path] = None,
+    crsp_daily_path: Optional[Path] = None,
+    encoder: str = "hashing",
+    out_path: Optional[Path] = None,
+) -> Path:
+    """
+    Story-level training panel: one row per (rp_story_id, permno) with the
+    story's headline_id and the next-trading-day CRSP return.
+    """
+    if ravenpack_with_permno_path is None:
+        ravenpack_with_permno_path = DATA_DIR / "ravenpack_djpr_with_permno.parquet"
+    if crsp_daily_path is None:
+        crsp_daily_path = DATA_DIR / "CRSP_DAILY_PAPER_UNIVERSE.parquet"
+    if out_path is None:
+        out_path = DATA_DIR / "prediction_panel.parquet"
+
+    calendar = load_trading_calendar(crsp_daily_path)
+
+    rp = pd.read_parquet(
+        ravenpack_with_permno_path, columns=["rp_story_id", "permno", "timestamp_utc"]
+    )
+    rp = rp.dropna(subset=["permno"]).drop_duplicates(["rp_story_id", "permno"])
+    rp["permno"] = rp["permno"].astype("int64")
+    rp["date_code"] = trading_date_codes(rp["timestamp_utc"], calendar)
+    rp = rp[rp["date_code"] >= 0]
+    rp = rp.merge(load_story_headline_ids(encoder), on="rp_story_id", how="inner")
+
+    crsp = load(
+        "crsp_daily",
+        columns=["permno", "date", "ret"],
+        permnos=rp["permno"].unique(),
+        path=crsp_daily_path,
+    )
+    crsp["permno"] = crsp["permno"].astype("int64")
+    crsp["date_code"] = np.searchsorted(
+        calendar, crsp["date"].to_numpy().astype("datetime64[D]")
+    )
+    # Label for news on trading date t is the return on trading date t + 1
+    crsp["date_code"] -= 1
+    crsp = crsp.rename(columns={"ret": LABEL_COL})[["permno", "date_code", LABEL_COL]]
+
+    panel = rp.merge(crsp, on=["permno", "date_code"], how="inner")
+    panel = panel.dropna(subset=[LABEL_COL])
+    panel["trading_date"] = calendar[panel["date_code"].to_numpy()]
+    panel = panel.sort_values(["trading_date", "permno", "rp_story_id"])
+    panel = panel[["rp_story_id", "permno", "trading_date", "headline_id", LABEL_COL]]
+
+    out_path.parent.mkdir(parents=True, exist_ok=True)
+    panel.to_parquet(out_path, index=False)
+    print(f"Saved prediction panel -> {out_path}")
+    print(f"Rows: {len(panel):,}")
+    return out_path
+
+
+def _iter_design_chunks(
+    embeddings: np.ndarray, headline_ids: np.ndarray, chunk_size: int
+) -> Iterator[Tuple[np.ndarray, np.ndarray]]:
+    """
+    Yield (positions, X) chunks, reading memmap rows in id order for locality.
+    """
+    order = np.argsort(headline_ids, kind="stable")
+    for start in range(0, len(order), chunk_size):
+        pos = order[start : start + chunk_size]
+        yield pos, np.asarray(embeddings[headline_ids[pos]], dtype=np.float64)
+
+
+def block_statistics(
+    embeddings: np.ndarray,
+    headline_ids: np.ndarray,
+    y: np.ndarray,
+    chunk_size: int = 20_000,
+) -> Dict[str, np.ndarray]:
+    """
+    Sufficient statistics of one block of rows: n, sx, sy, xx, xy, yy.
+    """
+    p = embeddings.shape[1]
+    stats = {
+        "n": np.zeros(()),
+        "sx": np.zeros(p),
+        "sy": np.zeros(()),
+        "xx": np.zeros((p, p)),
+        "xy": np.zeros(p),
+        "yy": np.zeros(()),
+    }
+    y = np.asarray(y, dtype=np.float64)
+    for pos, X in _iter_design_chunks(embeddings, headline_ids, chunk_size):
+        yc = y[pos]
+        stats["n"] += len(pos)
+        stats["sx"] += X.sum(axis=0)
+        stats["sy"] += yc.sum()
+        stats["xx"] += X.T @ X
+        stats["xy"] += X.T @ yc
+        stats["yy"] += yc @ yc
+    return stats
+
+
+def add_statistics(a: Dict[str, np.ndarray], b: Dict[str, np.ndarray], sign=1.0):
+    """
+    a + sign * b, key by key.
+    """
+    return {k: a[k] + sign * b[k] for k in a}
+
+
+def centered_gram(stats: Dict[str, np.ndarray]):
+    """
+    Centered X'X and X'y, so the intercept is not penalised.
+    """
+    n = stats["n"]
+    mx = stats["sx"] / n
+    my = stats["sy"] / n
+    xx = stats["xx"] - n * np.outer(mx, mx)
+    xy = stats["xy"] - n * mx * my
+    return xx, xy, mx, my
+
+
+def solve_ridge(stats: Dict[str, np.ndarray], alpha: float = 1.0):
+    """
+    Ridge (alpha > 0) or OLS (alpha = 0) coefficients from sufficient
+    statistics. Returns (intercept, beta).
+
+    >>> rng = np.random.default_rng(0)
+    >>> X = rng.normal(size=(200, 3))
+    >>> y = 0.5 + X @ np.array([1.0, -2.0, 0.0])
+    >>> stats = {"n": np.float64(200), "sx": X.sum(0), "sy": y.sum(),
+    ...          "xx": X.T @ X, "xy": X.T @ y, "yy": y @ y}
+    >>> intercept, beta = solve_ridge(stats, alpha=0.0)
+    >>> bool(np.isclose(intercept, 0.5)), bool(np.allclose(beta, [1.0, -2.0, 0.0]))
+    (True, True)
+    """
+    xx, xy, mx, my = centered_gram(stats)
+    if alpha > 0:
+        beta = np.linalg.solve(xx + alpha * np.eye(len(xy)), xy)
+    else:
+        beta = np.linalg.lstsq(xx, xy, rcond=None)[0]
+    return my - mx @ beta, beta
+
+
+def ridge_path(stats: Dict[str, np.ndarray], alphas: Sequence[float]):
+    """
+    Ridge coefficients for every penalty in `alphas` from one
+    eigendecomposition of the centered Gram matrix.
+
+    With X'X = V diag(d) V', beta(alpha) = V diag(1 / (d + alpha)) V'X'y.
+    Returns (intercepts, betas) with shapes (L,) and (p, L).
+    """
+    xx, xy, mx, my = centered_gram(stats)
+    d, V = np.linalg.eigh(xx)
+    d = np.clip(d, 0.0, None)
+    alphas = np.asarray(alphas, dtype=np.float64)
+    denom = d[:, None] + alphas[None, :]
+    scale = np.divide(1.0, denom, out=np.zeros_like(denom), where=denom > 1e-12)
+    betas = V @ ((V.T @ xy)[:, None] * scale)
+    return my - mx @ betas, betas
+
+
+def prediction_sse(
+    stats: Dict[str, np.ndarray], intercepts: np.ndarray, betas: np.ndarray
+) -> np.ndarray:
+    """
+    Sum of squared errors of each (intercept, beta) column on the rows
+    summarised by `stats`, without touching those rows again.
+    """
+    a = np.asarray(intercepts)
+    return (
+        stats["yy"]
+        - 2 * a * stats["sy"]
+        - 2 * (stats["xy"] @ betas)
+        + stats["n"] * a**2
+        + 2 * a * (stats["sx"] @ betas)
+        + np.einsum("pl,pl->l", betas, stats["xx"] @ betas)
+    )
+
+
+def ridge_cv(
+    blocks: List[Dict[str, np.ndarray]],
+    alphas: Sequence[float] = ALPHA_GRID,
+    n_folds: int = 5,
+    alpha: float = 1.0,
+) -> Dict[str, object]:
+    """
+    Blocked k-fold cross-validation of the ridge penalty over period blocks.
+
+    Folds are runs of consecutive blocks. Each fold is validated against a
+    fit on the remaining blocks (total minus fold statistics), using one
+    eigendecomposition for the whole grid. The chosen penalty is refit on all
+    blocks. With fewer than two non-empty blocks nothing can be validated,
+    and the fixed `alpha` is used instead (`mse` is then all NaN).
+
+    Returns a dict with `alphas`, `mse` (validation MSE per penalty),
+    `alpha`, `intercept` and `beta`.
+    """
+    if not blocks:
+        raise ValueError("ridge_cv needs at least one block")
+    alphas = np.asarray(alphas, dtype=np.float64)
+    n_folds = min(n_folds, len(blocks))
+    total = blocks[0]
+    for b in blocks[1:]:
+        total = add_statistics(total, b)
+
+    sse = np.zeros(len(alphas))
+    n_valid = 0.0
+    for fold in np.array_split(np.arange(len(blocks)), max(n_folds, 1)):
+        valid = blocks[fold[0]]
+        for i in fold[1:]:
+            valid = add_statistics(valid, blocks[i])
+        train = add_statistics(total, valid, sign=-1.0)
+        if n_folds < 2 or valid["n"] == 0 or train["n"] == 0:
+            continue
+        intercepts, betas = ridge_path(train, alphas)
+        sse += prediction_sse(valid, intercepts, betas)
+        n_valid += valid["n"]
+
+    if n_valid == 0:
+        intercept, beta = solve_ridge(total, alpha=alpha)
+        return {
+            "alphas": alphas,
+            "mse": np.full(len(alphas), np.nan),
+            "alpha": alpha,
+            "intercept": intercept,
+            "beta": beta,
+        }
+
+    mse = sse / n_valid
+    best = int(np.argmin(mse))
+    intercept, beta = solve_ridge(total, alpha=alphas[best])
+    return {
+        "alphas": alphas,
+        "mse": mse,
+        "alpha": alphas[best],
+        "intercept": intercept,
+        "beta": beta,
+    }
+
+
+def walk_forward_predictions(
+    panel: pd.DataFrame,
+    embeddings: np.ndarray,
+    window: int = 36,
+    alpha: float = 1.0,
+    freq: str = "M",
+    min_periods: Optional[int] = None,
+    label_col: str = LABEL_COL,
+    alphas: Optional[Sequence[float]] = None,
+    n_folds: int = 5,
+) -> pd.DataFrame:
+    """
+    Out-of-sample predictions from a rolling window of `window` periods.
+
+    Period statistics are computed once. The window statistics are kept as a
+    running sum: each step adds the newest period and subtracts the period
+    that falls out. Predictions for period t use only periods before t.
+
+    If `alphas` is given, the penalty of each window is chosen by `ridge_cv`
+    over the window's periods instead of using the fixed `alpha` (which is
+    still used for windows of a single period).
+    """
+    if min_periods is None:
+        min_periods = window
+
+    periods = pd.PeriodIndex(panel["trading_date"], freq=freq)
+    codes, uniques = pd.factorize(periods, sort=True)
+    ids = panel["headline_id"].to_numpy(dtype=np.int64)
+    y = panel[label_col].to_numpy(dtype=np.float64)
+    order = np.argsort(codes, kind="stable")
+    bounds = np.searchsorted(codes[order], np.arange(len(uniques) + 1))
+    rows = [order[bounds[c] : bounds[c + 1]] for c in range(len(uniques))]
+
+    print(f"Computing statistics for {len(uniques)} periods ...")
+    block = [block_statistics(embeddings, ids[r], y[r]) for r in rows]
+
+    prediction = np.full(len(panel), np.nan)
+    chosen_alpha = np.full(len(panel), np.nan)
+    window_stats = None
+    in_window = []
+    for t in range(len(uniques)):
+        if t > 0:
+            window_stats = (
+                block[t - 1]
+                if window_stats is None
+                else add_statistics(window_stats, block[t - 1])
+            )
+            in_window.append(t - 1)
+            if len(in_window) > window:
+                window_stats = add_statistics(
+                    window_stats, block[in_window.pop(0)], sign=-1.0
+                )
+        if len(in_window) < min_periods or len(rows[t]) == 0:
+            continue
+
+        if alphas is None:
+            intercept, beta = solve_ridge(window_stats, alpha=alpha)
+            chosen_alpha[rows[t]] = alpha
+        else:
+            cv = ridge_cv(
+                [block[i] for i in in_window], alphas, n_folds=n_folds, alpha=alpha
+            )
+            intercept, beta = cv["intercept"], cv["beta"]
+            chosen_alpha[rows[t]] = cv["alpha"]
+        for pos, X in _iter_design_chunks(embeddings, ids[rows[t]], 20_000):
+            prediction[rows[t][pos]] = intercept + X @ beta
+
+    out = panel[["rp_story_id", "permno", "trading_date", label_col]].copy()
+    out["period"] = periods.astype(str)
+    out["prediction"] = prediction
+    out["alpha"] = chosen_alpha
+    return out.dropna(subset=["prediction"])
+
+
+def run_walk_forward(
+    panel_path: Optional[Path] = None,
+    encoder: str = "hashing",
+    out_path: Optional[Path] = None,
+    window: int = 36,
+    alpha: float = 1.0,
+    freq: str = "M",
+    alphas: Optional[Sequence[float]] = ALPHA_GRID,
+) -> Path:
+    """
+    Walk forward over the saved panel and save out-of-sample predictions.
+    The penalty is cross-validated per window over `alphas`; pass
+    alphas=None to use the fixed `alpha`.
+    """
+    if panel_path is None:
+        panel_path = DATA_DIR / "prediction_panel.parquet"
+    if out_path is None:
+        out_path = DATA_DIR / "oos_predictions.parquet"
+
+    panel = pd.read_parquet(panel_path)
+    embeddings = load_headline_embeddings(encoder)
+    preds = walk_forward_predictions(
+        panel, embeddings, window=window, alpha=alpha, freq=freq, alphas=alphas
+    )
+
+    out_path.parent.mkdir(parents=True, exist_ok=True)
+    pq.write_table(pa.Table.from_pandas(preds, preserve_index=False), out_path)
+    print(f"Saved out-of-sample predictions -> {out_path}")
+    print(f"Rows: {len(preds):,}")
+    return out_path
+
+
+def main():
+    build_prediction_panel()
+    run_walk_forward()
+
+
+if __name__ == "__main__":
+    main()
@@ -183,9 +183,13 @@ defaults = {
 }
 
 
+# Marks "no in-line default" so that default=None can be passed explicitly
+_NO_DEFAULT = object()
+
+
 def config(
     var_name,
-    default=None,
+    default=_NO_DEFAULT,
     cast=None,
     settings_py_defaults=defaults,
     cli_vars=cli_vars,
@@ -232,6 +236,10 @@ def config(
 
     # 4. Use the default value provided in the local file. Error if not found
     try:
+        if default is _NO_DEFAULT:
+            return _config(var_name) if cast is None else _config(var_name, cast=cast)
+        if cast is None:
+            return default
         return _config(var_name, default=default, cast=cast)
     except Exception as e:
         raise ValueError(
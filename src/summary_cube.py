@@ -0,0 +1,293 @@
+"""
+Small, materialized daily summary cube used by `generate_charts.py`.
+
+Tables (one Parquet slice per calendar year, in DATA_DIR/summary_cube/<table>/):
+
+ - crsp_daily: date, n_stocks, market_cap_mean and market-cap percentiles
+   (p10, p25, p50, p75, p90) of the CRSP paper universe;
+ - ravenpack_daily: date, n_articles (rows of ravenpack_djpr per UTC day);
+ - sentiment_hist: date, bin, count. Histogram of event_sentiment_score
+   in the merged RavenPack x CRSP data over SENTIMENT_EDGES; only non-empty
+   bins are stored.
+
+The cube is written as a by-product of the pull and merge stages, from data
+that is already in memory (or from the yearly RavenPack and merged files).
+Each table keeps a `_manifest.json` with a fingerprint per year: the file
+size and mtime for yearly source files, or a content hash for in-memory
+frames. Only years whose fingerprint changed are recomputed. Running this
+module directly backfills the cube from the files in DATA_DIR.
+
+A table's manifest has a single writer at a time: the per-year doit tasks
+that run in parallel never update the cube, their combine step does (from
+the yearly files). The manifest is replaced atomically, so readers never see
+a partial file.
+"""
+
+from __future__ import annotations
+
+import json
+import os
+from pathlib import Path
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+from misc_tools import groupby_weighted_quantile, histogram_bin_index
+from settings import config
+
+DATA_DIR = Path(config("DATA_DIR"))
+CUBE_DIR = DATA_DIR / "summary_cube"
+RAVENPACK_YEAR_DIR = DATA_DIR / "ravenpack_years"
+
+MARKET_CAP_PERCENTILES = [0.1, 0.25, 0.5, 0.75, 0.9]
+SENTIMENT_EDGES = np.linspace(-1.0, 1.0, 101)
+
+
+########################################################################################
+## Storage
+########################################################################################
+
+
+def manifest_path(table: str, cube_dir: Path = CUBE_DIR) -> Path:
+    return Path(cube_dir) / table / "_manifest.json"
+
+
+def _load_manifest(table: str, cube_dir: Path) -> Dict[str, str]:
+    path = manifest_path(table, cube_dir)
+    return json.loads(path.read_text()) if path.exists() else {}
+
+
+def frame_fingerprint(df: pd.DataFrame) -> str:
+    """Content hash of a frame (order-independent over rows)."""
+    with np.errstate(over="ignore"):
+        h = pd.util.hash_pandas_object(df, index=False).to_numpy().sum()
+    return f"{len(df)}-{int(h):016x}"
+
+
+def file_fingerprint(path: Path) -> str:
+    stat = Path(path).stat()
+    return f"{stat.st_size}-{stat.st_mtime_ns}"
+
+
+def update_cube_table(
+    table: str,
+    slices: Iterable[Tuple[int, str, Callable[[], pd.DataFrame]]],
+    cube_dir: Path = CUBE_DIR,
+) -> List[int]:
+    """
+    Write the yearly slices whose fingerprint changed.
+
+    `slices` yields (year, fingerprint, build) where build() returns the
+    summary rows of that year. Returns the years that were rewritten.
+    """
+    table_dir = Path(cube_dir) / table
+    table_dir.mkdir(parents=True, exist_ok=True)
+    manifest = _load_manifest(table, cube_dir)
+
+    updated = []
+    for year, fingerprint, build in slices:
+        path = table_dir / f"{year}.parquet"
+        if manifest.get(str(year)) == fingerprint and path.exists():
+            continue
+        build().to_parquet(path, index=False)
+        manifest[str(year)] = fingerprint
+        updated.append(year)
+
+    path = manifest_path(table, cube_dir)
+    if updated or not path.exists():
+        manifest = dict(sorted(manifest.items()))
+        tmp_path = path.with_suffix(f".{os.getpid()}.tmp")
+        tmp_path.write_text(json.dumps(manifest, indent=1))
+        os.replace(tmp_path, path)
+    print(f"Summary cube {table}: updated years {updated or 'none'}")
+    return updated
+
+
+def load_cube(table: str, cube_dir: Path = CUBE_DIR) -> pd.DataFrame:
+    """
+    All yearly slices of a cube table, sorted by date.
+    """
+    files = sorted((Path(cube_dir) / table).glob("*.parquet"))
+    if not files:
+        raise FileNotFoundError(f"No summary cube slices for {table} in {cube_dir}")
+    df = pd.concat([pd.read_parquet(f) for f in files], ignore_index=True)
+    return df.sort_values("date", kind="stable").reset_index(drop=True)
+
+
+########################################################################################
+## Summaries
+########################################################################################
+
+
+def crsp_daily_summary(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Stocks per day, mean and percentiles of market cap.
+    """
+    df = df[["date", "market_cap"]]
+    g = df.groupby("date")["market_cap"]
+    out = pd.DataFrame({"n_stocks": g.size(), "market_cap_mean": g.mean()})
+    pct = groupby_weighted_quantile(
+        data_col="market_cap",
+        by_col="date",
+        data=df,
+        quantiles=MARKET_CAP_PERCENTILES,
+        old_style=True,
+    )
+    pct.columns = [f"market_cap_p{round(q * 100)}" for q in pct.columns]
+    return out.join(pct).reset_index()
+
+
+def ravenpack_daily_counts(timestamps: pd.Series) -> pd.DataFrame:
+    """
+    Number of RavenPack rows per UTC day.
+    """
+    days = pd.to_datetime(timestamps).to_numpy().astype("datetime64[D]")
+    days, counts = np.unique(days[~np.isnat(days)], return_counts=True)
+    return pd.DataFrame(
+        {"date": days.astype("datetime64[ns]"), "n_articles": counts.astype(np.int64)}
+    )
+
+
+def sentiment_histogram(
+    df: pd.DataFrame,
+    value_col: str = "event_sentiment_score",
+    date_col: str = "date",
+    edges: np.ndarray = SENTIMENT_EDGES,
+) -> pd.DataFrame:
+    """
+    Non-empty (date, bin) counts of `value_col` over `edges`; bins as in
+    `misc_tools.histogram_bin_index` (values outside the edges are dropped).
+    """
+    bins = histogram_bin_index(df[value_col].to_numpy(dtype=float), edges)
+    ok = bins >= 0
+    days = pd.to_datetime(df[date_col]).to_numpy().astype("datetime64[D]")[ok]
+    bins = bins[ok]
+    n_bins = len(edges) - 1
+
+    day_codes, day_values = pd.factorize(days, sort=True)
+    keys, counts = np.unique(day_codes * n_bins + bins, return_counts=True)
+    return pd.DataFrame(
+        {
+            "date": np.asarray(day_values)[keys // n_bins].astype("datetime64[ns]"),
+            "bin": (keys % n_bins).astype(np.int16),
+            "count": counts.astype(np.int64),
+        }
+    )
+
+
+def sentiment_bin_edges() -> pd.DataFrame:
+    """Left and right edge of each histogram bin."""
+    return pd.DataFrame(
+        {
+            "bin": np.arange(len(SENTIMENT_EDGES) - 1, dtype=np.int16),
+            "left": SENTIMENT_EDGES[:-1],
+            "right": SENTIMENT_EDGES[1:],
+        }
+    )
+
+
+########################################################################################
+## Incremental updates (called from the pull and merge stages)
+########################################################################################
+
+
+def _yearly_frame_slices(
+    df: pd.DataFrame, date_col: str, build: Callable[[pd.DataFrame], pd.DataFrame]
+):
+    years = pd.to_datetime(df[date_col]).dt.year
+    for year, sub in df.groupby(years, sort=True):
+        yield int(year), frame_fingerprint(sub), lambda sub=sub: build(sub)
+
+
+def update_crsp_cube(df: pd.DataFrame, cube_dir: Path = CUBE_DIR) -> List[int]:
+    """
+    Update crsp_daily from the CRSP paper universe (needs date, market_cap).
+    """
+    df = df[["date", "market_cap"]]
+    return update_cube_table(
+        "crsp_daily", _yearly_frame_slices(df, "date", crsp_daily_summary), cube_dir
+    )
+
+
+def _yearly_file_slices(
+    year_files: Iterable[Path],
+    columns: List[str],
+    build: Callable[[pd.DataFrame], pd.DataFrame],
+):
+    """Slices of yearly files named <stage>_<year>.parquet, reading `columns`."""
+    for path in year_files:
+        year = int(Path(path).stem.rsplit("_", 1)[1])
+        yield (
+            year,
+            file_fingerprint(path),
+            lambda path=path: build(pd.read_parquet(path, columns=columns)),
+        )
+
+
+def update_ravenpack_cube(
+    year_files: Optional[Iterable[Path]] = None, cube_dir: Path = CUBE_DIR
+) -> List[int]:
+    """
+    Update ravenpack_daily from the yearly RavenPack files
+    (ravenpack_djpr_<year>.parquet), reading only `timestamp_utc`.
+    """
+    if year_files is None:
+        year_files = sorted(RAVENPACK_YEAR_DIR.glob("ravenpack_djpr_*.parquet"))
+    slices = _yearly_file_slices(
+        year_files,
+        ["timestamp_utc"],
+        lambda df: ravenpack_daily_counts(df["timestamp_utc"]),
+    )
+    return update_cube_table("ravenpack_daily", slices, cube_dir)
+
+
+def update_sentiment_cube(merged: pd.DataFrame, cube_dir: Path = CUBE_DIR) -> List[int]:
+    """
+    Update sentiment_hist from the merged RavenPack x CRSP data
+    (needs date, event_sentiment_score).
+    """
+    df = merged[["date", "event_sentiment_score"]]
+    return update_cube_table(
+        "sentiment_hist",
+        _yearly_frame_slices(df, "date", sentiment_histogram),
+        cube_dir,
+    )
+
+
+def update_sentiment_cube_from_files(
+    year_files: Iterable[Path], cube_dir: Path = CUBE_DIR
+) -> List[int]:
+    """
+    Update sentiment_hist from the yearly merged files
+    (ravenpack_crsp_merged_<year>.parquet), reading only the two columns.
+    """
+    slices = _yearly_file_slices(
+        year_files, ["date", "event_sentiment_score"], sentiment_histogram
+    )
+    return update_cube_table("sentiment_hist", slices, cube_dir)
+
+
+def build_summary_cube(cube_dir: Path = CUBE_DIR) -> Path:
+    """
+    Backfill (or refresh) every cube table from the files in DATA_DIR.
+    """
+    crsp_path = DATA_DIR / "CRSP_DAILY_PAPER_UNIVERSE.parquet"
+    update_crsp_cube(
+        pd.read_parquet(crsp_path, columns=["date", "market_cap"]), cube_dir
+    )
+
+    update_ravenpack_cube(cube_dir=cube_dir)
+
+    merged_path = DATA_DIR / "ravenpack_crsp_merged.parquet"
+    merged = pd.read_parquet(merged_path, columns=["date", "event_sentiment_score"])
+    update_sentiment_cube(merged, cube_dir)
+    return Path(cube_dir)
+
+
+def main():
+    build_summary_cube()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,118 @@
+import numpy as np
+import pandas as pd
+
+from aggregate_ravenpack import (
+    aggregate_ravenpack_firm_day_partials,
+    combine_firm_day_partials,
+    combine_firm_day_years,
+    finalize_firm_day_panel,
+    partial_firm_day_aggregates,
+)
+
+
+def _records(n=200, seed=0):
+    rng = np.random.default_rng(seed)
+    records = pd.DataFrame(
+        {
+            "permno": rng.choice([10001.0, 10002.0, np.nan], n),
+            "timestamp_utc": pd.Timestamp("2005-12-20", tz="UTC")
+            + pd.to_timedelta(rng.integers(0, 20 * 24, n), unit="h"),
+            "rp_story_id": rng.choice([f"s{i}" for i in range(60)], n),
+            "event_sentiment_score": rng.choice([-0.5, 0.0, 0.25, 1.0, np.nan], n),
+            "css": rng.normal(size=n),
+            "event_similarity_days": rng.choice([0.0, 0.5, 3.0, 365.0], n),
+            "rp_group": rng.choice(["earnings", "ratings", None], n),
+        }
+    )
+    # Weekdays without the 2005-12-26 and 2006-01-02 holidays
+    calendar = pd.bdate_range("2005-12-19", "2006-01-13")
+    calendar = calendar.drop(pd.to_datetime(["2005-12-26", "2006-01-02"]))
+    return records, calendar.values.astype("datetime64[D]")
+
+
+def _expected_panel(records, calendar):
+    df = records.dropna(subset=["permno"]).copy()
+    days = df["timestamp_utc"].dt.tz_localize(None).values.astype("datetime64[D]")
+    codes = np.searchsorted(calendar, days)
+    df = df[codes < len(calendar)]
+    df["trading_date"] = calendar[codes[codes < len(calendar)]]
+    df["permno"] = df["permno"].astype("int64")
+    df["novel"] = df["event_similarity_days"] >= 1
+
+    grouped = df.groupby(["permno", "trading_date"])
+    expected = pd.DataFrame(
+        {
+            "n_records": grouped.size(),
+            "n_articles": grouped["rp_story_id"].nunique(),
+            "n_events": grouped["event_sentiment_score"].count(),
+            "n_novel": grouped["novel"].sum(),
+            "ess_mean": grouped["event_sentiment_score"].mean(),
+            "ess_min": grouped["event_sentiment_score"].min(),
+            "ess_max": grouped["event_sentiment_score"].max(),
+            "css_mean": grouped["css"].mean(),
+            "css_min": grouped["css"].min(),
+            "css_max": grouped["css"].max(),
+        }
+    )
+    groups = pd.crosstab([df["permno"], df["trading_date"]], df["rp_group"])
+    groups.columns = [f"n_group_{c}" for c in groups.columns]
+    expected = expected.join(groups).fillna({c: 0 for c in groups.columns})
+    expected[groups.columns] = expected[groups.columns].astype("int64")
+    return expected.reset_index()
+
+
+def test_batched_partials_match_direct_groupby(tmp_path):
+    records, calendar = _records()
+    path = tmp_path / "ravenpack_djpr_with_permno.parquet"
+    records.to_parquet(path, index=False)
+
+    # Batches of 37 rows split the records of some stories
+    partials = aggregate_ravenpack_firm_day_partials(path, calendar, batch_size=37)
+    panel = finalize_firm_day_panel(partials)
+
+    expected = _expected_panel(records, calendar)
+    pd.testing.assert_frame_equal(panel, expected, check_dtype=False)
+
+
+def test_empty_partials_give_empty_panel():
+    records, calendar = _records()
+    unlinked = records.assign(permno=np.nan)
+    panel = finalize_firm_day_panel(
+        combine_firm_day_partials([partial_firm_day_aggregates(unlinked, calendar)])
+    )
+    assert panel.empty
+    assert panel.columns[:6].tolist() == [
+        "permno",
+        "trading_date",
+        "n_records",
+        "n_articles",
+        "n_events",
+        "n_novel",
+    ]
+    assert panel["ess_mean"].dtype == "float64"
+
+
+def test_yearly_partials_combine_to_single_pass(tmp_path):
+    records, calendar = _records()
+    # The records of a RavenPack story share its timestamp, hence its year
+    story_time = records.groupby("rp_story_id")["timestamp_utc"].transform("first")
+    records["timestamp_utc"] = story_time
+    years = records["timestamp_utc"].dt.year
+    assert years.nunique() == 2
+
+    # As doit runs it: one saved partials file per year, then a combine step
+    partial_paths = []
+    for year, sub in records.groupby(years):
+        path = tmp_path / f"ravenpack_djpr_with_permno_{year}.parquet"
+        sub.to_parquet(path, index=False)
+        partials = aggregate_ravenpack_firm_day_partials(path, calendar, batch_size=29)
+        partial_paths.append(tmp_path / f"ravenpack_firm_day_partials_{year}.parquet")
+        partials.to_parquet(partial_paths[-1], index=False)
+    out_path = combine_firm_day_years(partial_paths, tmp_path / "firm_day.parquet")
+
+    single_path = tmp_path / "ravenpack_djpr_with_permno.parquet"
+    records.to_parquet(single_path, index=False)
+    single = finalize_firm_day_panel(
+        aggregate_ravenpack_firm_day_partials(single_path, calendar)
+    )
+    pd.testing.assert_frame_equal(pd.read_parquet(out_path), single, check_dtype=False)
@@ -0,0 +1,48 @@
+import pandas as pd
+
+from arrow_cache import cache_path, read_parquet_cached
+from parquet_fingerprint import parquet_fingerprint
+
+
+def test_cache_is_reused_and_invalidated(tmp_path):
+    path = tmp_path / "crsp.parquet"
+    df = pd.DataFrame(
+        {
+            "permno": [1, 1, 2],
+            "date": pd.to_datetime(["2005-01-03", "2005-01-04", "2005-01-03"]),
+            "ret": [0.01, None, -0.02],
+        }
+    )
+    df.to_parquet(path, index=False)
+
+    pd.testing.assert_frame_equal(read_parquet_cached(path), df)
+    cached = cache_path(path)
+    mtime = cached.stat().st_mtime_ns
+
+    # Unchanged source: the cache is kept
+    pd.testing.assert_frame_equal(
+        read_parquet_cached(path, columns=["ret"]), df[["ret"]]
+    )
+    assert cached.stat().st_mtime_ns == mtime
+
+    # New content: the cache is rebuilt
+    changed = df.assign(ret=[0.5, 0.0, 0.1])
+    changed.to_parquet(path, index=False)
+    pd.testing.assert_frame_equal(read_parquet_cached(path), changed)
+
+    pd.testing.assert_frame_equal(read_parquet_cached(path, use_cache=False), changed)
+
+
+def test_cache_detects_edits_the_footer_does_not_show(tmp_path):
+    path = tmp_path / "crsp.parquet"
+    df = pd.DataFrame({"permno": [1, 1, 1, 1], "ret": [-0.02, 0.001, 0.002, 0.03]})
+    df.to_parquet(path, index=False)
+    pd.testing.assert_frame_equal(read_parquet_cached(path), df)
+    fingerprint, size = parquet_fingerprint(path), path.stat().st_size
+
+    # Two values swapped: same statistics, same size, different data
+    swapped = df.assign(ret=[-0.02, 0.002, 0.001, 0.03])
+    swapped.to_parquet(path, index=False)
+    assert parquet_fingerprint(path) == fingerprint
+    assert path.stat().st_size == size
+    pd.testing.assert_frame_equal(read_parquet_cached(path), swapped)
@@ -0,0 +1,75 @@
+import numpy as np
+import pandas as pd
+
+from backtest import assign_quantiles, quantile_portfolio_backtest
+
+
+def test_assign_quantiles_keeps_ties_together():
+    date_code = np.array([0, 0, 0, 0, 0, 0, 1, 1, 1])
+    signal = np.array([1.0, 2.0, 2.0, 2.0, 3.0, 4.0, 5.0, 6.0, 7.0])
+    q = assign_quantiles(date_code, signal, n_quantiles=3)
+    assert q.tolist() == [0, 0, 0, 0, 2, 2, 0, 1, 2]
+
+
+def test_holding_period_averages_cohorts():
+    dates = pd.bdate_range("2020-01-01", periods=4)
+    crsp = pd.DataFrame(
+        {
+            "permno": np.repeat([1, 2], 4),
+            "date": np.tile(dates, 2),
+            "ret": [0.0, 0.01, 0.02, 0.03, 0.0, -0.01, -0.02, -0.03],
+            "market_cap": 1.0,
+        }
+    )
+    # Day 0: 1 is the winner, day 1: 2 is the winner
+    signals = pd.DataFrame(
+        {
+            "permno": [1, 2, 1, 2],
+            "date": [dates[0], dates[0], dates[1], dates[1]],
+            "signal": [1.0, 0.0, 0.0, 1.0],
+        }
+    )
+    returns, turnover = quantile_portfolio_backtest(
+        signals, crsp, n_quantiles=2, holding_days=2
+    )
+    # Day 2 holds permno 1 (formed day 0) and permno 2 (formed day 1) in Q2
+    assert np.isclose(returns.loc[dates[2], "Q2"], 0.0)
+    assert np.isclose(returns.loc[dates[1], "LS"], 0.02)
+    assert turnover.dropna(how="all").empty
+
+
+def test_turnover_when_portfolios_change():
+    dates = pd.bdate_range("2020-01-01", periods=5)
+    crsp = pd.DataFrame(
+        {
+            "permno": np.repeat([1, 2, 3, 4], 5),
+            "date": np.tile(dates, 4),
+            "ret": 0.0,
+            "market_cap": 1.0,
+        }
+    )
+    # Q2 is {1, 2} on day 0 and {1, 3} on days 1 and 2
+    signals = pd.DataFrame(
+        {
+            "permno": np.tile([1, 2, 3, 4], 3),
+            "date": np.repeat(dates[:3], 4),
+            "signal": [4.0, 3.0, 2.0, 1.0] + [4.0, 2.0, 3.0, 1.0] * 2,
+        }
+    )
+
+    _, turnover = quantile_portfolio_backtest(
+        signals, crsp, n_quantiles=2, holding_days=1
+    )
+    # Half of each portfolio is replaced when day 1's cohort is traded on day 2
+    turnover = turnover.dropna(how="all")
+    assert turnover.index.tolist() == [dates[2], dates[3]]
+    np.testing.assert_allclose(turnover.loc[dates[2]], [0.5, 0.5, 1.0])
+    np.testing.assert_allclose(turnover.loc[dates[3]], [0.0, 0.0, 0.0])
+
+    # With two cohorts, each replaces half the portfolio
+    _, turnover = quantile_portfolio_backtest(
+        signals, crsp, n_quantiles=2, holding_days=2
+    )
+    turnover = turnover.dropna(how="all")
+    assert turnover.index.tolist() == [dates[3]]
+    np.testing.assert_allclose(turnover.loc[dates[3]], [0.25, 0.25, 0.5])
@@ -0,0 +1,61 @@
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from dataset_diff import diff_fingerprints, diff_parquet_datasets, fingerprint_dataset
+
+
+def _dataset(n=10):
+    # Written without pandas metadata below, as pulled files may be: integer
+    # and boolean columns with nulls then come back as float and object
+    return pd.DataFrame(
+        {
+            "rp_story_id": [f"s{i}" for i in range(n)],
+            "rp_entity_id": ["E1", "E2"] * (n // 2),
+            "timestamp_utc": pd.date_range("2005-12-30", periods=n, freq="D"),
+            # A null in the first batch only
+            "relevance": pd.array([100, 95, None, 80, 100, 75, 70, 60, 50, 40]),
+            "is_new": pd.array([True, False, None, True] + [False] * 6),
+            "css": np.linspace(-1, 1, n),
+        }
+    )
+
+
+def test_identical_data_with_different_batch_sizes(tmp_path):
+    path = tmp_path / "old.parquet"
+    table = pa.Table.from_pandas(_dataset(), preserve_index=False)
+    pq.write_table(table.replace_schema_metadata(), path)
+
+    columns = ["relevance", "is_new", "css"]
+    keys = ["rp_story_id", "rp_entity_id"]
+    small = fingerprint_dataset(path, keys, columns, batch_size=4)
+    large = fingerprint_dataset(path, keys, columns, batch_size=10)
+    np.testing.assert_array_equal(small["row"], large["row"])
+    status = diff_fingerprints(small, large)["status"]
+    assert (status == "unchanged").all() and len(status) == 10
+
+
+def test_added_removed_and_changed_keys(tmp_path):
+    old = _dataset()
+    new = old.drop(index=[0]).copy()  # removed; shifts every batch boundary
+    new.loc[5, "css"] = 5.0
+    new.loc[2, "relevance"] = 10  # a null becomes a value
+    extra = old.iloc[[9]].assign(rp_story_id="s10")
+    new = pd.concat([new, extra], ignore_index=True)
+    for name, df in [("old", old), ("new", new)]:
+        table = pa.Table.from_pandas(df, preserve_index=False)
+        pq.write_table(table.replace_schema_metadata(), tmp_path / f"{name}.parquet")
+
+    summary, keys = diff_parquet_datasets(
+        tmp_path / "old.parquet", tmp_path / "new.parquet", batch_size=4
+    )
+    assert summary.loc["total"].to_dict() == {
+        "added": 1,
+        "removed": 1,
+        "changed": 2,
+        "unchanged": 7,
+    }
+    status = keys.set_index("rp_story_id")["status"].astype(str).to_dict()
+    assert status == {"s0": "removed", "s2": "changed", "s5": "changed", "s10": "added"}
+    assert summary.loc[2005, "removed"] == 1 and summary.loc[2006, "added"] == 1
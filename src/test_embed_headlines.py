@@ -0,0 +1,51 @@
+import numpy as np
+import pandas as pd
+
+import embed_headlines as eh
+
+
+def _stub_encoder(calls):
+    def encode(texts, encoder="hashing"):
+        calls.extend(texts)
+        return np.array([[len(t), t.count("e")] for t in texts], dtype=float)
+
+    return encode
+
+
+def test_headlines_are_encoded_once_and_cached(tmp_path, monkeypatch):
+    calls = []
+    monkeypatch.setattr(eh, "encode_headlines", _stub_encoder(calls))
+    path = tmp_path / "ravenpack_djpr.parquet"
+    headlines = ["Apple beats", " Apple beats ", "Google falls", None, "Apple beats"]
+    pd.DataFrame(
+        {"rp_story_id": [f"s{i}" for i in range(5)], "headline": headlines}
+    ).to_parquet(path)
+
+    eh.embed_headlines(path, embedding_dir=tmp_path, encode_batch_size=2, n_jobs=1)
+    assert sorted(calls[1:]) == ["", "Apple beats", "Google falls"]  # after probe
+
+    story = eh.load_story_headline_ids(embedding_dir=tmp_path).set_index("rp_story_id")[
+        "headline_id"
+    ]
+    assert story["s0"] == story["s1"] == story["s4"]
+    assert story.nunique() == 3
+    emb = eh.load_headline_embeddings(embedding_dir=tmp_path)
+    assert isinstance(emb, np.memmap) and emb.dtype == np.float16
+    assert emb[story["s2"]].tolist() == [12.0, 1.0]
+    before = np.array(emb)
+
+    # A re-run encodes only the headline that is not cached yet
+    calls.clear()
+    pd.DataFrame(
+        {"rp_story_id": ["s0", "s5"], "headline": ["Apple beats", "Tesla recalls"]}
+    ).to_parquet(path)
+    eh.embed_headlines(path, embedding_dir=tmp_path, n_jobs=1)
+    assert calls[1:] == ["Tesla recalls"]
+
+    emb = eh.load_headline_embeddings(embedding_dir=tmp_path)
+    assert emb.shape == (4, 2)
+    np.testing.assert_array_equal(emb[:3], before)
+    story = eh.load_story_headline_ids(embedding_dir=tmp_path).set_index("rp_story_id")[
+        "headline_id"
+    ]
+    assert emb[story["s5"]].tolist() == [13.0, 2.0]
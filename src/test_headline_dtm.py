@@ -0,0 +1,103 @@
+from collections import Counter
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from headline_dtm import (
+    build_headline_dtm,
+    headline_terms,
+    load_headline_dtm,
+    load_headline_dtm_stories,
+    load_vocabulary,
+)
+
+
+def _ravenpack(path):
+    pd.DataFrame(
+        {
+            "rp_story_id": ["s1", "s2", "s2", "s3", "s4", "s5"],
+            "rp_entity_id": ["A", "B", "C", "A", "B", "A"],
+            "timestamp_utc": pd.to_datetime(
+                [
+                    "2005-03-01",
+                    "2005-03-02",
+                    "2005-03-02",
+                    "2005-07-01",
+                    "2006-01-05",
+                    "2006-02-01",
+                ]
+            ),
+            "headline": [
+                "Fed cuts rates, Fed signals more cuts",
+                "Apple beats estimates",
+                "Apple beats estimates",
+                None,
+                "Fed holds rates as Apple rallies",
+                "Apple beats estimates again",
+            ],
+        }
+    ).to_parquet(path)
+    return path
+
+
+def _dense_counts(headlines, vocabulary):
+    dense = np.zeros((len(headlines), len(vocabulary)), dtype=np.int64)
+    for i, text in enumerate(headlines):
+        for term, n in Counter(headline_terms(text, ngram_max=2)).items():
+            dense[i, vocabulary[term]] = n
+    return dense
+
+
+def test_yearly_vocabulary_chunks_match_dense_counts(tmp_path):
+    path = _ravenpack(tmp_path / "ravenpack_djpr.parquet")
+    kwargs = {"ngram_max": 2, "chunk_size": 2, "n_jobs": 1, "dtm_dir": tmp_path}
+
+    # 2006 is added on a second run, growing the 2005 vocabulary
+    build_headline_dtm(path, start_year=2005, end_year=2005, **kwargs)
+    build_headline_dtm(path, start_year=2005, end_year=2006, **kwargs)
+
+    dtm = load_headline_dtm(dtm_dir=tmp_path)
+    stories = load_headline_dtm_stories(dtm_dir=tmp_path)
+    assert stories["rp_story_id"].tolist() == ["s1", "s2", "s3", "s4", "s5"]
+
+    vocab = load_vocabulary(tmp_path / "vocab")
+    vocabulary = dict(zip(vocab["token"], vocab["term_id"]))
+    headlines = pd.read_parquet(path).drop_duplicates("rp_story_id")["headline"]
+    np.testing.assert_array_equal(dtm.toarray(), _dense_counts(headlines, vocabulary))
+    assert dtm[0, vocabulary["fed"]] == 2 and dtm[0, vocabulary["fed cuts"]] == 1
+
+
+def test_vocabulary_matches_count_vectorizer(tmp_path):
+    feature_extraction = pytest.importorskip("sklearn.feature_extraction.text")
+    path = _ravenpack(tmp_path / "ravenpack_djpr.parquet")
+    build_headline_dtm(
+        path, start_year=2005, end_year=2006, ngram_max=2, n_jobs=1, dtm_dir=tmp_path
+    )
+    dtm = load_headline_dtm(dtm_dir=tmp_path)
+    vocab = load_vocabulary(tmp_path / "vocab")
+
+    headlines = pd.read_parquet(path).drop_duplicates("rp_story_id")["headline"]
+    cv = feature_extraction.CountVectorizer(
+        analyzer=lambda text: headline_terms(text, ngram_max=2)
+    )
+    expected = cv.fit_transform(headlines.fillna("")).toarray()
+    columns = [cv.vocabulary_[t] for t in vocab.sort_values("term_id")["token"]]
+    np.testing.assert_array_equal(dtm.toarray(), expected[:, columns])
+
+
+def test_hashing_rows_count_every_term(tmp_path):
+    path = _ravenpack(tmp_path / "ravenpack_djpr.parquet")
+    build_headline_dtm(
+        path,
+        mode="hashing",
+        start_year=2005,
+        end_year=2006,
+        n_features=64,
+        n_jobs=1,
+        dtm_dir=tmp_path,
+    )
+    dtm = load_headline_dtm("hashing", dtm_dir=tmp_path)
+    headlines = pd.read_parquet(path).drop_duplicates("rp_story_id")["headline"]
+    assert dtm.shape == (5, 64)
+    assert dtm.sum(axis=1).A1.tolist() == [len(headline_terms(h)) for h in headlines]
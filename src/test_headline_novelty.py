@@ -0,0 +1,64 @@
+import numpy as np
+import pandas as pd
+
+from headline_novelty import (
+    build_headline_novelty,
+    find_similar_predecessors,
+    minhash_signatures,
+)
+
+HEADLINE = "Apple reports record quarterly revenue and profit"
+NEAR_DUPLICATE = "Apple reports record quarterly revenue and profit today"
+
+
+def test_near_duplicates_within_window_and_firm():
+    stories = pd.DataFrame(
+        [
+            (1, "2005-03-01", HEADLINE),
+            (1, "2005-03-04", NEAR_DUPLICATE),  # 3 days after the first
+            (2, "2005-03-05", HEADLINE),  # same text, other firm
+            (1, "2005-03-06", "Google launches a new phone in Europe"),
+            (1, "2005-04-20", HEADLINE),  # 47 days after the last similar one
+            (1, "2005-04-21", ""),  # no tokens, never similar
+            (1, "2005-04-22", ""),
+        ],
+        columns=["firm", "date", "headline"],
+    )
+    time_ns = pd.to_datetime(stories["date"]).to_numpy().view("int64")
+    sig = minhash_signatures(stories["headline"])
+
+    days_since, match = find_similar_predecessors(
+        stories["firm"].to_numpy(), time_ns, sig, window_days=30
+    )
+    expected = [np.nan, 3.0, np.nan, np.nan, np.nan, np.nan, np.nan]
+    np.testing.assert_array_equal(days_since, expected)
+    assert match.tolist() == [-1, 0, -1, -1, -1, -1, -1]
+
+
+def test_novelty_window_crosses_year_end(tmp_path):
+    path = tmp_path / "ravenpack_djpr_with_permno.parquet"
+    pd.DataFrame(
+        {
+            "rp_story_id": ["a", "b", "c", "d"],
+            "rp_entity_id": ["E1", "E1", "E2", "E1"],
+            "permno": [10001.0, 10001.0, np.nan, 10001.0],
+            "timestamp_utc": pd.to_datetime(
+                [
+                    "2005-12-30 12:00",
+                    "2006-01-02 00:00",
+                    "2006-01-02 06:00",
+                    "2006-01-03 12:00",
+                ]
+            ),
+            "headline": [HEADLINE, NEAR_DUPLICATE, HEADLINE, HEADLINE],
+        }
+    ).to_parquet(path)
+
+    out = pd.read_parquet(
+        build_headline_novelty(
+            path, tmp_path / "novelty.parquet", start_year=2005, end_year=2006
+        )
+    ).set_index("rp_story_id")
+    assert out["is_near_duplicate"].tolist() == [False, True, False, True]
+    np.testing.assert_allclose(out["days_since_similar"], [np.nan, 2.5, np.nan, 1.5])
+    assert out["similar_story_id"].fillna("").tolist() == ["", "a", "", "b"]
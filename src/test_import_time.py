@@ -0,0 +1,61 @@
+"""
+Import-time benchmark for the modules that doit imports in process.
+
+Each check runs in a fresh interpreter, so modules already imported by
+pytest do not hide the cost. Only the lazy imports are asserted: wall-clock
+time depends on the machine and its load, so a slow import is reported as a
+warning rather than a failure.
+"""
+
+import json
+import os
+import subprocess
+import sys
+import warnings
+from pathlib import Path
+
+SRC_DIR = Path(__file__).parent
+
+# Only imported inside the functions that use them
+LAZY_MODULES = ["matplotlib", "polars", "wrds", "requests"]
+MODULES = ["misc_tools", "pull_CRSP_stock", "pull_russell_1000", "pull_ravenpack"]
+
+# Seconds on top of numpy/pandas/pyarrow, which every task needs anyway (report only)
+IMPORT_BUDGET_S = 2.0
+
+SCRIPT = """
+import json, sys, time
+import numpy, pandas, pyarrow.parquet
+t0 = time.perf_counter()
+for module in {modules!r}:
+    __import__(module)
+elapsed = time.perf_counter() - t0
+print(json.dumps({{
+    "elapsed": elapsed,
+    "loaded": [m for m in {lazy!r} if m in sys.modules],
+}}))
+"""
+
+
+def _import_in_fresh_interpreter(modules):
+    env = {**os.environ, "WRDS_USERNAME": os.environ.get("WRDS_USERNAME", "x")}
+    out = subprocess.run(
+        [sys.executable, "-c", SCRIPT.format(modules=modules, lazy=LAZY_MODULES)],
+        cwd=SRC_DIR,
+        env=env,
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    return json.loads(out.stdout.strip().splitlines()[-1])
+
+
+def test_heavy_dependencies_are_imported_lazily():
+    result = _import_in_fresh_interpreter(MODULES)
+    assert result["loaded"] == []
+    print(f"Imported {', '.join(MODULES)} in {result['elapsed']:.3f}s")
+    if result["elapsed"] > IMPORT_BUDGET_S:
+        warnings.warn(
+            f"Importing {', '.join(MODULES)} took {result['elapsed']:.3f}s,"
+            f" over the {IMPORT_BUDGET_S}s budget"
+        )
@@ -0,0 +1,38 @@
+import os
+
+import pandas as pd
+
+
+def test_link_isins_to_ncusips(monkeypatch):
+    # Read at import by pull_ravenpack; no WRDS connection is made here
+    monkeypatch.setenv("WRDS_USERNAME", os.environ.get("WRDS_USERNAME", "x"))
+    from link_ravenpack_crsp import link_isins_to_ncusips, report_crosswalk_differences
+
+    # permno 1 changed CUSIP; RavenPack has the ISIN of the historical one
+    dse = pd.DataFrame(
+        {
+            "permno": [1, 1, 2, 3],
+            "ncusip": ["03783310", "03783399", "17275R10", None],
+        }
+    )
+    company_names = pd.DataFrame(
+        {
+            "rp_entity_id": ["AAAAAA", "BBBBBB", "CCCCCC", ""],
+            # BBBBBB's ISIN has a wrong check digit (US17275R1023 is valid)
+            "isin": ["US0378331005", "US17275R1024", None, "US0378331005"],
+        }
+    )
+
+    xw = link_isins_to_ncusips(dse, company_names)
+    pd.testing.assert_frame_equal(
+        xw, pd.DataFrame({"permno": [1], "rp_entity_id": ["AAAAAA"]})
+    )
+
+    # The WRDS join takes the ISIN as is and keeps the second link
+    wrds_xw = link_isins_to_ncusips(dse, company_names, validate=False)
+    assert wrds_xw.sort_values("permno")["rp_entity_id"].tolist() == [
+        "AAAAAA",
+        "BBBBBB",
+    ]
+    counts = report_crosswalk_differences(wrds_xw, xw)
+    assert counts.to_dict() == {"both": 1, "wrds_only": 1, "local_only": 0}
@@ -0,0 +1,51 @@
+import pandas as pd
+import pyarrow as pa
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+
+from load_data import build_filter, load
+
+
+def test_load_pushes_down_dates_and_ids(tmp_path):
+    rp = pd.DataFrame(
+        {
+            "rp_entity_id": ["A", "A", "B", "C"],
+            "permno": [1.0, 1.0, None, 3.0],
+            "timestamp_utc": pd.to_datetime(
+                [
+                    "2005-12-31 23:00",
+                    "2006-01-01 09:30",
+                    "2006-06-30 16:00",
+                    "2006-07-01 00:00",
+                ]
+            ),
+        }
+    )
+    path = tmp_path / "ravenpack_djpr_with_permno.parquet"
+    pq.write_table(
+        pa.Table.from_pandas(rp, preserve_index=False), path, row_group_size=1
+    )
+
+    # A date-only end includes the whole day
+    out = load(
+        "ravenpack_djpr_with_permno", start="2006-01-01", end="2006-06-30", path=path
+    )
+    assert out["rp_entity_id"].tolist() == ["A", "B"]
+
+    out = load(
+        "ravenpack_djpr_with_permno",
+        columns=["timestamp_utc"],
+        permnos=[1, 3],
+        path=path,
+    )
+    assert out.columns.tolist() == ["timestamp_utc"]
+    assert len(out) == 3
+
+    out = load("ravenpack_djpr_with_permno", entity_ids=["C"], data_dir=tmp_path)
+    assert out["permno"].tolist() == [3.0]
+
+    # Row groups that cannot match are skipped from their statistics
+    data = ds.dataset(path, format="parquet")
+    flt = build_filter(data.schema, "timestamp_utc", entity_ids=["B"])
+    (fragment,) = data.get_fragments()
+    assert len(fragment.split_by_row_group(flt)) == 1
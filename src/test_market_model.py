@@ -0,0 +1,71 @@
+import numpy as np
+import pandas as pd
+
+from market_model import event_cars, market_returns, rolling_market_model
+
+
+def _crsp(seed=0):
+    rng = np.random.default_rng(seed)
+    dates = pd.bdate_range("2005-01-03", periods=40)
+    frames = []
+    for permno, beta in [(10001, 0.5), (10002, 1.5)]:
+        mkt = rng.normal(0, 0.01, len(dates))
+        frames.append(
+            pd.DataFrame(
+                {
+                    "permno": permno,
+                    "date": dates,
+                    "ret": 0.001 + beta * mkt + rng.normal(0, 0.002, len(dates)),
+                    "market_cap": rng.uniform(1, 2, len(dates)),
+                }
+            )
+        )
+    crsp = pd.concat(frames, ignore_index=True)
+    crsp.loc[5, "ret"] = np.nan
+    return crsp.iloc[::-1].reset_index(drop=True)  # unsorted input
+
+
+def test_rolling_betas_match_per_window_ols():
+    crsp = _crsp()
+    mkt = market_returns(crsp, weighting="value")
+    panel = rolling_market_model(crsp, mkt, window=10, min_periods=5, lag=1)
+
+    for permno, firm in panel.groupby("permno"):
+        for i in range(len(firm)):
+            window = firm.iloc[max(0, i - 10) : i].dropna(subset=["ret", "mkt"])
+            row = firm.iloc[i]
+            if len(window) < 5:
+                assert np.isnan(row["beta"])
+                continue
+            beta, alpha = np.polyfit(window["mkt"], window["ret"], 1)
+            assert np.isclose(row["beta"], beta) and np.isclose(row["alpha"], alpha)
+            assert row["n_obs"] == len(window)
+
+
+def test_event_cars_sum_abnormal_returns_with_pre_window_parameters():
+    crsp = _crsp()
+    mkt = market_returns(crsp, weighting="equal")
+    panel = rolling_market_model(crsp, mkt, window=10, min_periods=5)
+    events = pd.DataFrame(
+        {
+            "permno": [10001, 10002, 10002],
+            # Saturday rolls forward to Monday 2005-02-14
+            "date": pd.to_datetime(["2005-02-01", "2005-02-12", "2005-01-03"]),
+        }
+    )
+    cars = event_cars(events, panel, windows=[(-1, 1), (0, 3)])
+
+    for e, event in cars.iterrows():
+        firm = panel[panel["permno"] == event["permno"]].reset_index(drop=True)
+        t = firm.index[firm["date"] >= event["date"]][0]
+        for (a, b), name in [((-1, 1), "m1_p1"), ((0, 3), "0_p3")]:
+            rows = firm.iloc[max(t + a, 0) : t + b + 1].dropna(subset=["ret"])
+            params = firm.iloc[max(t + a, 0)]
+            expected = (
+                rows["ret"] - params["alpha"] - params["beta"] * rows["mkt"]
+            ).sum()
+            assert cars.loc[e, f"n_{name}"] == len(rows)
+            if np.isnan(params["beta"]):
+                assert np.isnan(cars.loc[e, f"car_{name}"])
+            else:
+                assert np.isclose(cars.loc[e, f"car_{name}"], expected)
@@ -1,11 +1,27 @@
+import numpy as np
 import pandas as pd
 
 from misc_tools import (
+    convert_cusips_from_8_to_9_digit,
+    cusip_to_isin,
     get_most_recent_quarter_end,
     get_next_quarter_start,
+    groupby_rank,
     groupby_weighted_average,
+    groupby_weighted_quantile,
+    groupby_weighted_stats,
     groupby_weighted_std,
+    groupby_winsorize,
+    groupby_zscore,
+    histogram_counts,
+    isin_to_cusip,
+    lttb_downsample,
+    validate_cusip,
+    validate_isin,
     weighted_average,
+    weighted_quantile,
+    with_lagged_columns,
+    with_period_lags,
 )
 
 
@@ -69,6 +85,166 @@ def test_groupby_weighted_std():
     pd.testing.assert_series_equal(result, expected)
 
 
+def test_groupby_weighted_stats_columns_and_weights():
+    df = pd.DataFrame(
+        {
+            "g": ["a", "a", "a", "a", "b", "b", "b", "c", "c"],
+            "x": [1.0, 2.0, 4.0, np.nan, 5.0, 6.0, 9.0, 3.0, 4.0],
+            "y": [1e9 + 1, 1e9 + 3, 1e9, 1e9 + 2, 7.0, 7.0, 8.0, 1.0, 2.0],
+            "w": [1.0, 3.0, 0.0, 2.0, 2.0, np.nan, 1.0, 0.0, 0.0],
+        }
+    )
+    before = df.copy()
+    stats = groupby_weighted_stats(
+        data_col=["x", "y"], weight_col="w", by_col="g", data=df
+    )
+    assert stats.columns.tolist() == [
+        (col, stat) for col in ["x", "y"] for stat in ["mean", "var", "std"]
+    ]
+
+    for group, rows in df.groupby("g"):
+        for col in ["x", "y"]:
+            ok = rows[[col, "w"]].notna().all(axis=1)
+            x, w = rows.loc[ok, col], rows.loc[ok, "w"]
+            got = stats.loc[group, col]
+            if w.sum() == 0:
+                # Zero total weight: no mean, no variance
+                assert np.isnan(got["mean"]) and np.isnan(got["var"])
+                continue
+            mean = np.average(x, weights=w)
+            n = len(x)
+            var = (w * (x - mean) ** 2).sum() / ((n - 1) / n * w.sum())
+            np.testing.assert_allclose(got[["mean", "var"]], [mean, var], rtol=1e-6)
+            np.testing.assert_allclose(got["std"], np.sqrt(var), rtol=1e-6)
+
+    # The helpers built on it leave the input untouched
+    groupby_weighted_average(data_col="x", weight_col="w", by_col="g", data=df)
+    groupby_weighted_average(
+        data_col="x", weight_col="w", by_col="g", data=df, transform=True
+    )
+    groupby_weighted_std(data_col="x", weight_col="w", by_col="g", data=df)
+    weighted_average(data_col="y", weight_col="w", data=df)
+    pd.testing.assert_frame_equal(df, before)
+
+
+def test_groupby_weighted_quantile():
+    df = pd.DataFrame(
+        {
+            "date": ["a", "a", "a", "a", "b", "b", "b"],
+            "rate": [0.3, 0.1, 0.4, 0.2, 0.9, 0.5, 0.7],
+            "volume": [1, 2, 0, 3, 5, 1, 2],
+        }
+    )
+    quantiles = [0.1, 0.25, 0.5, 0.75, 0.9]
+    result = groupby_weighted_quantile(
+        data_col="rate",
+        weight_col="volume",
+        by_col="date",
+        data=df,
+        quantiles=quantiles,
+    )
+    for date, group in df.groupby("date"):
+        expected = weighted_quantile(
+            group["rate"], quantiles, sample_weight=group["volume"]
+        )
+        np.testing.assert_allclose(result.loc[date].to_numpy(), expected)
+
+
+def test_cusip_isin_round_trip():
+    cusip8 = pd.Series(["03783310", "17275R10", "59491810"])
+    cusip9 = convert_cusips_from_8_to_9_digit(cusip8)
+    assert cusip9.tolist() == ["037833100", "17275R102", "594918104"]
+    assert validate_cusip(cusip9).all()
+
+    isin = cusip_to_isin(cusip8)
+    assert isin.tolist() == ["US0378331005", "US17275R1023", "US5949181045"]
+    assert validate_isin(isin).all()
+    assert not validate_isin(["US0378331006"]).any()
+    assert isin_to_cusip(isin).tolist() == cusip9.tolist()
+
+
+def test_with_period_lags_matches_resampled_lags():
+    df = pd.DataFrame(
+        {
+            "id": ["A", "A", "A", "B", "B", "B", "B", "B", "B"],
+            "date": pd.to_datetime(
+                [
+                    "1990-01-01",
+                    "1990-02-01",
+                    "1990-03-01",
+                    "1989-12-01",
+                    "1990-01-01",
+                    "1990-02-01",
+                    "1990-03-01",
+                    "1990-04-01",
+                    "1990-06-01",
+                ]
+            ),
+            "value": [1, 2, 3, 12, 1, 2, 3, 4, 6],
+        }
+    )
+    expected = with_lagged_columns(
+        df=df, column_to_lag="value", id_column="id", lags=1, freq="MS"
+    ).dropna(subset=["value"])
+    result = with_period_lags(
+        df, columns="value", id_columns="id", lags=[1, -1], freq="MS"
+    )
+    np.testing.assert_array_equal(
+        result["L1_value"].to_numpy(), expected["L1_value"].to_numpy()
+    )
+    np.testing.assert_array_equal(
+        result["F1_value"].to_numpy(),
+        [2, 3, np.nan, 1, 2, 3, 4, np.nan, np.nan],
+    )
+
+
+def test_cross_sectional_normalization_matches_pandas():
+    rng = np.random.default_rng(0)
+    df = pd.DataFrame(
+        {
+            "date": rng.integers(0, 20, 500),
+            "x": rng.integers(0, 8, 500).astype(float),
+        }
+    )
+    df.loc[::17, "x"] = np.nan
+    # A single row, a single non-missing row, and a group of equal values
+    extra = pd.DataFrame(
+        {"date": [20, 21, 21, 22, 22, 22], "x": [3.5, np.nan, 7.0, 2.0, 2.0, 2.0]}
+    )
+    df = pd.concat([df, extra], ignore_index=True)
+    g = df.groupby("date")["x"]
+    for method in ["average", "min", "max", "first", "dense"]:
+        pd.testing.assert_series_equal(
+            groupby_rank(df, "x", "date", method=method)["x"],
+            g.rank(method=method),
+        )
+    pd.testing.assert_series_equal(
+        groupby_zscore(df, "x", "date")["x"],
+        g.transform(lambda s: (s - s.mean()) / s.std()),
+    )
+    pd.testing.assert_series_equal(
+        groupby_winsorize(df, "x", "date", lower=0.1, upper=0.9)["x"],
+        g.transform(lambda s: s.clip(s.quantile(0.1), s.quantile(0.9))),
+    )
+
+
+def test_histogram_counts_and_lttb():
+    rng = np.random.default_rng(0)
+    values = np.r_[rng.uniform(-1.5, 1.5, 10_000), [-1.0, 1.0, np.nan]]
+    edges = np.linspace(-1, 1, 41)
+    np.testing.assert_array_equal(
+        histogram_counts(values, edges),
+        np.histogram(values[~np.isnan(values)], edges)[0],
+    )
+
+    dates = pd.bdate_range("2000-01-03", periods=5_000)
+    y = np.cumsum(rng.normal(size=len(dates)))
+    y[1234] = 100.0
+    keep = lttb_downsample(dates.values, y, 200)
+    assert len(keep) == 200 and keep[0] == 0 and keep[-1] == len(y) - 1
+    assert (np.diff(keep) > 0).all() and 1234 in keep
+
+
 def test_get_most_recent_quarter_end():
     d = pd.to_datetime("2019-10-21")
     result = get_most_recent_quarter_end(d)
@@ -0,0 +1,22 @@
+import pandas as pd
+
+from parquet_fingerprint import parquet_fingerprint
+
+
+def test_fingerprint_tracks_only_requested_columns(tmp_path):
+    path = tmp_path / "data.parquet"
+    df = pd.DataFrame({"a": range(1_000), "b": [1.5] * 1_000})
+    df.to_parquet(path, row_group_size=300)
+    fp_a, fp_all = parquet_fingerprint(path, ["a"]), parquet_fingerprint(path)
+
+    df.to_parquet(path, row_group_size=300)  # same content, new mtime
+    assert parquet_fingerprint(path, ["a"]) == fp_a
+    assert parquet_fingerprint(path) == fp_all
+
+    df.assign(b=2.5).to_parquet(path, row_group_size=300)
+    assert parquet_fingerprint(path, ["a"]) == fp_a
+    assert parquet_fingerprint(path) != fp_all
+
+    df.assign(a=df["a"] + 1).to_parquet(path, row_group_size=300)
+    assert parquet_fingerprint(path, ["a"]) != fp_a
+    assert parquet_fingerprint(tmp_path, ["a"]) != fp_a
@@ -0,0 +1,34 @@
+import pandas as pd
+import pyarrow.parquet as pq
+
+from parquet_layout import write_parquet, write_sorted_from_files
+
+
+def test_files_are_combined_in_layout_order(tmp_path):
+    files = []
+    for year, ids in [(2005, ["C", "A", None, "B"]), (2006, ["B", "A", "C", "A"])]:
+        df = pd.DataFrame(
+            {
+                "rp_entity_id": ids,
+                "timestamp_utc": pd.date_range(f"{year}-01-01", periods=4, freq="D")[
+                    ::-1
+                ],
+                "year": year,
+            }
+        )
+        files.append(write_parquet(df, tmp_path / f"{year}.parquet", "ravenpack"))
+
+    out = tmp_path / "combined.parquet"
+    assert write_sorted_from_files(files, out, "ravenpack", rows_per_chunk=2) == 8
+
+    combined = pd.read_parquet(out)
+    expected = (
+        pd.concat([pd.read_parquet(f) for f in files])
+        .sort_values(["rp_entity_id", "timestamp_utc"], na_position="last")
+        .reset_index(drop=True)
+    )
+    pd.testing.assert_frame_equal(combined, expected)
+
+    metadata = pq.ParquetFile(out).metadata
+    assert metadata.row_group(0).column(0).compression == "ZSTD"
+    assert [c.column_index for c in metadata.row_group(0).sorting_columns] == [0, 1]
@@ -0,0 +1,36 @@
+import pandas as pd
+
+from perf_ledger import (
+    check_regression,
+    connect,
+    finish_task,
+    load_ledger,
+    start_task,
+    task_trend,
+)
+
+
+def test_ledger_records_runs_and_flags_regressions(tmp_path):
+    ledger_path = tmp_path / "perf.sqlite"
+    data = tmp_path / "data.parquet"
+    pd.DataFrame({"a": range(10)}).to_parquet(data)
+
+    for run_id in ["r1", "r2"]:
+        start_task("pull:x", run_id)
+        finish_task("pull:x", run_id, [], [data], ledger_path=ledger_path)
+
+    trend = task_trend(load_ledger(ledger_path))
+    assert trend["task"].tolist() == ["pull:x", "pull:x"]
+    assert trend["rows_out"].tolist() == [10, 10]
+    assert (trend["wall_s"] >= 0).all()
+
+    conn = connect(ledger_path)
+    slow = {
+        "task": "pull:x",
+        "wall_s": 100.0,
+        "cpu_s": 0.0,
+        "peak_rss_mb": None,
+        "bytes_read": 0,
+    }
+    assert len(check_regression(conn, slow)) == 1
+    conn.close()
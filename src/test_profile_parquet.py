@@ -0,0 +1,48 @@
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from profile_parquet import (
+    hll_empty,
+    hll_estimate,
+    hll_merge,
+    hll_update,
+    profile_parquet,
+    tdigest_empty,
+    tdigest_merge,
+    tdigest_quantiles,
+    tdigest_update,
+)
+
+
+def test_sketches_merge_and_estimate():
+    rng = np.random.default_rng(0)
+    values = rng.normal(size=200_000)
+    left, right = values[:100_000], values[100_000:]
+
+    registers = hll_merge(
+        hll_update(hll_empty(), pd.util.hash_array(left)),
+        hll_update(hll_empty(), pd.util.hash_array(right)),
+    )
+    assert abs(hll_estimate(registers) / len(values) - 1) < 0.03
+
+    digest = tdigest_merge(
+        tdigest_update(tdigest_empty(), left), tdigest_update(tdigest_empty(), right)
+    )
+    quantiles = [0.01, 0.25, 0.5, 0.75, 0.99]
+    np.testing.assert_allclose(
+        tdigest_quantiles(digest, quantiles), np.quantile(values, quantiles), atol=0.02
+    )
+
+
+def test_distinct_counts_do_not_depend_on_batches(tmp_path):
+    values = np.tile(np.arange(1000), 200)
+    nulls = np.zeros(len(values), dtype=bool)
+    nulls[[3, 60_000, 120_000]] = True  # nulls in a few batches only
+    path = tmp_path / "ints.parquet"
+    pq.write_table(pa.table({"x": pa.array(values, mask=nulls)}), path)
+
+    for batch_size in [10_000, 50_000, len(values)]:
+        profile = profile_parquet(path, batch_size=batch_size)
+        assert abs(profile["columns"]["x"]["distinct_approx"] - 1000) < 30
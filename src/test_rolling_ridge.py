@@ -0,0 +1,100 @@
+import numpy as np
+import pandas as pd
+
+from rolling_ridge import (
+    add_statistics,
+    block_statistics,
+    ridge_cv,
+    solve_ridge,
+    walk_forward_predictions,
+)
+
+
+def _fake_panel(n=3000, p=5, n_headlines=300, seed=0):
+    rng = np.random.default_rng(seed)
+    embeddings = rng.normal(size=(n_headlines, p)).astype(np.float16)
+    headline_id = rng.integers(0, n_headlines, n)
+    y = embeddings[headline_id].astype(float) @ rng.normal(size=p)
+    y += 0.1 * rng.normal(size=n)
+    panel = pd.DataFrame(
+        {
+            "rp_story_id": [f"s{i:05d}" for i in range(n)],
+            "permno": 10001,
+            "trading_date": pd.Timestamp("2005-01-01")
+            + pd.to_timedelta(rng.integers(0, 181, n), unit="D"),
+            "headline_id": headline_id,
+            "ret_lead1": y,
+        }
+    )
+    return panel, embeddings
+
+
+def test_walk_forward_matches_direct_fit():
+    panel, embeddings = _fake_panel()
+    result = walk_forward_predictions(panel, embeddings, window=2, alpha=0.0)
+
+    # Out-of-sample starts once two months of history exist
+    assert sorted(result["period"].unique()) == [
+        "2005-03",
+        "2005-04",
+        "2005-05",
+        "2005-06",
+    ]
+
+    period = pd.PeriodIndex(panel["trading_date"], freq="M").astype(str)
+    train = panel[(period == "2005-04") | (period == "2005-05")]
+    test = panel[period == "2005-06"]
+    X = np.c_[np.ones(len(train)), embeddings[train["headline_id"]].astype(float)]
+    coef = np.linalg.lstsq(X, train["ret_lead1"], rcond=None)[0]
+    X_test = np.c_[np.ones(len(test)), embeddings[test["headline_id"]].astype(float)]
+    expected = pd.Series(X_test @ coef, index=test["rp_story_id"]).sort_index()
+
+    got = result[result["period"] == "2005-06"].set_index("rp_story_id")["prediction"]
+    np.testing.assert_allclose(got.sort_index().to_numpy(), expected.to_numpy())
+
+
+def test_ridge_path_losses_match_refits():
+    rng = np.random.default_rng(1)
+    X = rng.normal(size=(400, 6))
+    y = 0.2 + X @ rng.normal(size=6) + rng.normal(size=400)
+    blocks = [
+        block_statistics(X[i : i + 100], np.arange(100), y[i : i + 100])
+        for i in range(0, 400, 100)
+    ]
+    alphas = [0.0, 1.0, 10.0, 1000.0]
+    cv = ridge_cv(blocks, alphas, n_folds=4)
+
+    for j, alpha in enumerate(alphas):
+        sse = 0.0
+        for k in range(4):
+            train = [b for i, b in enumerate(blocks) if i != k]
+            stats = train[0]
+            for b in train[1:]:
+                stats = add_statistics(stats, b)
+            intercept, beta = solve_ridge(stats, alpha=alpha)
+            Xk, yk = X[100 * k : 100 * (k + 1)], y[100 * k : 100 * (k + 1)]
+            sse += ((yk - intercept - Xk @ beta) ** 2).sum()
+        np.testing.assert_allclose(cv["mse"][j], sse / 400)
+
+    assert cv["alpha"] == alphas[int(np.argmin(cv["mse"]))]
+
+
+def test_ridge_cv_falls_back_to_fixed_alpha_without_folds():
+    panel, embeddings = _fake_panel(n=500)
+    ids, y = panel["headline_id"].to_numpy(), panel["ret_lead1"].to_numpy()
+    block = block_statistics(embeddings, ids, y)
+
+    cv = ridge_cv([block], [0.1, 10.0], n_folds=5, alpha=2.0)
+    intercept, beta = solve_ridge(block, alpha=2.0)
+    assert cv["alpha"] == 2.0 and np.isnan(cv["mse"]).all()
+    np.testing.assert_allclose(cv["beta"], beta)
+    np.testing.assert_allclose(cv["intercept"], intercept)
+
+    # An empty period block cannot be a training or validation set either
+    empty = block_statistics(embeddings, ids[:0], y[:0])
+    assert ridge_cv([block, empty], [0.1, 10.0], alpha=2.0)["alpha"] == 2.0
+
+    result = walk_forward_predictions(
+        panel, embeddings, window=1, alphas=[0.1, 10.0], alpha=2.0
+    )
+    assert not result.empty and (result["alpha"] == 2.0).all()
@@ -0,0 +1,60 @@
+import json
+
+import numpy as np
+import pandas as pd
+
+from summary_cube import (
+    load_cube,
+    manifest_path,
+    sentiment_histogram,
+    update_sentiment_cube,
+    update_sentiment_cube_from_files,
+)
+
+
+def test_sentiment_cube_updates_only_changed_years(tmp_path):
+    dates = pd.to_datetime(["2019-12-30", "2019-12-30", "2020-01-02", "2020-01-02"])
+    merged = pd.DataFrame(
+        {"date": dates, "event_sentiment_score": [-1.0, 0.5, 1.0, np.nan]}
+    )
+
+    hist = sentiment_histogram(merged)
+    assert hist["bin"].tolist() == [0, 75, 99]
+    assert hist["count"].tolist() == [1, 1, 1]
+
+    assert update_sentiment_cube(merged, tmp_path) == [2019, 2020]
+    assert update_sentiment_cube(merged, tmp_path) == []
+
+    merged.loc[3, "event_sentiment_score"] = 0.0
+    assert update_sentiment_cube(merged, tmp_path) == [2020]
+    assert load_cube("sentiment_hist", tmp_path)["count"].sum() == 4
+
+
+def test_sentiment_cube_from_yearly_merged_files(tmp_path):
+    rng = np.random.default_rng(0)
+    merged = pd.DataFrame(
+        {
+            "date": pd.Timestamp("2018-06-01")
+            + pd.to_timedelta(rng.integers(0, 3 * 365, 500), unit="D"),
+            "event_sentiment_score": rng.uniform(-1, 1, 500),
+        }
+    )
+    year_files = []
+    for year, sub in merged.groupby(merged["date"].dt.year):
+        path = tmp_path / f"ravenpack_crsp_merged_{year}.parquet"
+        sub.to_parquet(path, index=False)
+        year_files.append(path)
+
+    cube_dir = tmp_path / "summary_cube"
+    assert update_sentiment_cube_from_files(year_files, cube_dir) == [
+        2018,
+        2019,
+        2020,
+        2021,
+    ]
+    assert update_sentiment_cube_from_files(year_files, cube_dir) == []
+    manifest = json.loads(manifest_path("sentiment_hist", cube_dir).read_text())
+    assert sorted(manifest) == ["2018", "2019", "2020", "2021"]
+
+    expected = sentiment_histogram(merged)
+    pd.testing.assert_frame_equal(load_cube("sentiment_hist", cube_dir), expected)